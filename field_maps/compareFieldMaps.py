@@ -0,0 +1,192 @@
+#
+# compareFieldMaps.py
+#
+# compare two magnetic field maps in the r-z plane: converted ROOT field
+# maps (convert_fieldmap.py) and/or the field of a DD4hep compact file
+# Both fields are evaluated on a common grid (and along straight tracks
+# from the origin) with a single batched call each, and the statistics of
+# the differences are printed and written to a JSON report
+#
+# Usage:
+#   python compareFieldMaps.py ALLEGRO_fieldmap_2T_20260424.root new_fieldmap.root
+#   python compareFieldMaps.py ALLEGRO_fieldmap_2T_20260424.root compact:FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml
+#       --region tracker 0 2000 -2500 2500 --output report.json
+#
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Compare two magnetic field maps")
+    parser.add_argument("map1", type=str,
+                        help="First field: converted ROOT field map, or compact:<compact file relative to $K4GEO>")
+    parser.add_argument("map2", type=str, help="Second field (same format)")
+    parser.add_argument("--rho", type=float, nargs=3, default=[0., 6000., 601], metavar=("MIN", "MAX", "N"),
+                        help="rho range (mm) and number of points of the common grid")
+    parser.add_argument("--z", type=float, nargs=3, default=[-6000., 6000., 1201], metavar=("MIN", "MAX", "N"),
+                        help="z range (mm) and number of points of the common grid")
+    parser.add_argument("--region", type=str, nargs=5, action="append", default=[],
+                        metavar=("NAME", "RMIN", "RMAX", "ZMIN", "ZMAX"),
+                        help="Region (mm) in which statistics are computed, can be repeated (the full grid is always included)")
+    parser.add_argument("--theta", type=float, nargs="+", default=[10., 20., 30., 45., 60., 75., 90.],
+                        help="Polar angles (degrees) of the straight tracks from the origin along which B is integrated")
+    parser.add_argument("--step", type=float, default=1.,
+                        help="Integration step (mm) along the tracks")
+    parser.add_argument("--output", type=str, default="fieldmap_comparison.json",
+                        help="JSON report")
+    return parser.parse_args()
+
+
+# ================================
+# Field evaluation
+# ================================
+def fieldFunction(source):
+    """Return a function (r, z) -> (Br, Bz) in mm and T for the given source"""
+    if source.startswith("compact:"):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
+        from geometrySnapshot import loadSnapshot
+        from fieldSampler import sampleField
+        detectorFile = os.environ.get("K4GEO", "") + "/" + source[len("compact:"):]
+        snapshot = loadSnapshot(detectorFile)
+
+        def evaluate(r, z):
+            # cache the samples in the geometry snapshot, keyed by the points
+            key = hashlib.sha256(np.stack([r, z]).tobytes()).hexdigest()[:16]
+
+            def compute():
+                Bx, By, Bz = sampleField(snapshot.detector(), r, np.zeros_like(r), z)
+                return np.stack([Bx, Bz])
+            return tuple(snapshot.cachedArray("bfield_points_" + key, compute))
+        return evaluate
+
+    from fieldMap import FieldMap
+    return FieldMap(source).field
+
+
+# ================================
+# Statistics
+# ================================
+def regionStats(Br1, Bz1, Br2, Bz2, mask):
+    dBr = (Br2 - Br1)[mask]
+    dBz = (Bz2 - Bz1)[mask]
+    dB = np.hypot(dBr, dBz)
+    B1 = np.hypot(Br1, Bz1)[mask]
+    if dB.size == 0:
+        return {"npoints": 0}
+    imax = int(np.argmax(dB))
+    relative = dB / np.where(B1 > 1e-3, B1, np.nan)
+    return {
+        "npoints": int(dB.size),
+        "max_abs_dB": float(dB[imax]),
+        "rms_dB": float(np.sqrt(np.mean(dB**2))),
+        "mean_dBr": float(dBr.mean()),
+        "mean_dBz": float(dBz.mean()),
+        "max_abs_dBr": float(np.abs(dBr).max()),
+        "max_abs_dBz": float(np.abs(dBz).max()),
+        "max_rel_dB": float(np.nanmax(relative)) if np.isfinite(relative).any() else None,
+        "max_B1": float(B1.max()),
+    }
+
+
+def trackPoints(thetas, rMax, zMin, zMax, step):
+    """Points (r, z) along straight tracks from the origin up to the edge of
+    the grid, with the track index of each point and the directions"""
+    r, z, track = [], [], []
+    for i, theta in enumerate(thetas):
+        sinT, cosT = np.sin(theta), np.cos(theta)
+        lengths = [rMax / sinT if sinT > 1e-9 else np.inf,
+                   zMax / cosT if cosT > 1e-9 else (zMin / cosT if cosT < -1e-9 else np.inf)]
+        length = min(lengths)
+        t = np.arange(0.5 * step, length, step)
+        r.append(t * sinT)
+        z.append(t * cosT)
+        track.append(np.full(len(t), i))
+    return np.concatenate(r), np.concatenate(z), np.concatenate(track)
+
+
+def trackIntegrals(Br, Bz, track, thetas, step):
+    """Integrals (T m) of B along the track and of |B| transverse to it"""
+    sinT = np.sin(thetas)[track]
+    cosT = np.cos(thetas)[track]
+    Bpar = Br * sinT + Bz * cosT
+    Bperp = np.abs(Br * cosT - Bz * sinT)
+    dl = step / 1000.
+    return (np.bincount(track, Bpar, len(thetas)) * dl,
+            np.bincount(track, Bperp, len(thetas)) * dl)
+
+
+def main():
+    args = parseArgs()
+
+    rho_vals = np.linspace(args.rho[0], args.rho[1], int(args.rho[2]))
+    z_vals = np.linspace(args.z[0], args.z[1], int(args.z[2]))
+    R, Z = np.meshgrid(rho_vals, z_vals)
+    thetas = np.radians(args.theta)
+    tr, tz, track = trackPoints(thetas, rho_vals[-1], z_vals[0], z_vals[-1], args.step)
+
+    # evaluate each field once on all the points (grid + tracks)
+    r = np.concatenate([R.ravel(), tr])
+    z = np.concatenate([Z.ravel(), tz])
+    ngrid = R.size
+    fields = []
+    for source in (args.map1, args.map2):
+        print("Evaluating field", source, "at", len(r), "points")
+        Br, Bz = fieldFunction(source)(r, z)
+        fields.append((np.asarray(Br), np.asarray(Bz)))
+    (Br1, Bz1), (Br2, Bz2) = fields
+
+    report = {"map1": args.map1, "map2": args.map2,
+              "grid": {"rho": args.rho, "z": args.z}, "regions": {}, "tracks": []}
+
+    # statistics per region
+    regions = [("all", rho_vals[0], rho_vals[-1], z_vals[0], z_vals[-1])]
+    regions += [(name, float(rmin), float(rmax), float(zmin), float(zmax))
+                for name, rmin, rmax, zmin, zmax in args.region]
+    g = slice(0, ngrid)
+    for name, rmin, rmax, zmin, zmax in regions:
+        mask = (r[g] >= rmin) & (r[g] <= rmax) & (z[g] >= zmin) & (z[g] <= zmax)
+        stats = regionStats(Br1[g], Bz1[g], Br2[g], Bz2[g], mask)
+        stats["bounds"] = [rmin, rmax, zmin, zmax]
+        report["regions"][name] = stats
+
+    # integrals along the tracks
+    t = slice(ngrid, None)
+    par1, perp1 = trackIntegrals(Br1[t], Bz1[t], track, thetas, args.step)
+    par2, perp2 = trackIntegrals(Br2[t], Bz2[t], track, thetas, args.step)
+    for i, theta in enumerate(args.theta):
+        report["tracks"].append({
+            "theta_deg": theta,
+            "length_m": float(np.count_nonzero(track == i) * args.step / 1000.),
+            "int_Bdl_1": float(par1[i]), "int_Bdl_2": float(par2[i]), "diff_int_Bdl": float(par2[i] - par1[i]),
+            "int_Bperp_dl_1": float(perp1[i]), "int_Bperp_dl_2": float(perp2[i]),
+            "diff_int_Bperp_dl": float(perp2[i] - perp1[i]),
+        })
+
+    # summary
+    print("\n{:15s} {:>10s} {:>12s} {:>12s} {:>12s}".format("Region", "points", "max|dB| (T)", "RMS dB (T)", "max rel dB"))
+    for name, stats in report["regions"].items():
+        if stats["npoints"] == 0:
+            print("{:15s} {:>10d}".format(name, 0))
+            continue
+        rel = stats["max_rel_dB"]
+        print("{:15s} {:>10d} {:>12.3e} {:>12.3e} {:>12s}".format(
+            name, stats["npoints"], stats["max_abs_dB"], stats["rms_dB"], "-" if rel is None else f"{rel:.3e}"))
+    print("\n{:>10s} {:>10s} {:>14s} {:>14s} {:>18s} {:>18s}".format(
+        "theta", "L (m)", "int B.dl 1", "int B.dl 2", "int |Bperp| dl 1", "int |Bperp| dl 2"))
+    for entry in report["tracks"]:
+        print("{:>10.1f} {:>10.3f} {:>14.5f} {:>14.5f} {:>18.5f} {:>18.5f}".format(
+            entry["theta_deg"], entry["length_m"], entry["int_Bdl_1"], entry["int_Bdl_2"],
+            entry["int_Bperp_dl_1"], entry["int_Bperp_dl_2"]))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("\nReport written to", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
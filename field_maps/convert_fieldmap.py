@@ -1,24 +1,105 @@
 #!/usr/bin/env python3
+#
+# Convert a COMSOL txt export (columns r, z, Br, Bz) to the ROOT field map
+# read by DD4hep (FieldBrBz). The header is parsed once, then the numeric
+# body is read in fixed-size chunks and appended to the output tree, so that
+# the memory usage does not depend on the size of the map.
+#
+# If the nodes form a rectilinear (r, z) grid (in grid order, or in any order if
+# the header announces the number of nodes), the axes are written to the
+# fieldmap_axes tree and, if the nodes are not already in grid order
+# (r running fastest), the field values are also written in grid order to the
+# fieldmap_grid tree, for the interpolation in fieldMap.py.
+#
+import os
 import argparse
+import itertools
+import tempfile
 import numpy as np
 import uproot
+import awkward as ak
 import sys
 
-def detect_scale(filename):
+# length units of the COMSOL export -> m
+lengthUnits = {"m": 1.0, "cm": 0.01, "mm": 0.001}
+
+# columns of the output tree
+branches = ["r", "z", "Br", "Bz"]
+
+
+def read_header(f):
+    """Parse the '%' header lines at the start of the file.
+    Returns a dict with the header fields and the first data line."""
+    header = {}
+    for line in f:
+        if not line.strip():
+            continue
+        if not line.startswith("%"):
+            return header, line
+        key, sep, value = line[1:].partition(":")
+        if sep:
+            header[key.strip()] = value.strip()
+    return header, ""
+
+
+def detect_scale(header):
     """Detect length unit from header."""
-    scale = 0.0
-    with open(filename) as f:
-        for line in f:
-            if "Length unit:" in line:
-                unit = line.split(":")[1].strip()
-                if unit == "m":
-                    scale = 1.0
-                break
-    return scale
-
-def load_data(filename):
-    """Load numeric columns ignoring comments."""
-    return np.loadtxt(filename, comments='%', dtype=np.float64)
+    unit = header.get("Length unit", "")
+    return lengthUnits.get(unit, 0.0)
+
+
+def read_chunks(f, first_line, ncols, chunk_size):
+    """Yield arrays of shape (n, ncols) with up to chunk_size rows each."""
+    lines = itertools.chain([first_line], f)
+    while True:
+        raw = list(itertools.islice(lines, chunk_size))
+        if not raw:
+            return
+        block = [line for line in raw if line.strip() and not line.startswith("%")]
+        if not block:
+            continue
+        values = np.fromstring("".join(block), dtype=np.float64, sep=" ")
+        if values.size != len(block) * ncols:
+            raise ValueError(f"Expected {ncols} columns per line, got {values.size} values in {len(block)} lines")
+        yield values.reshape(-1, ncols)
+
+
+def write_grid(filename, r_axis, z_axis, chunk_size):
+    """Check that the nodes of the map fill the r_axis x z_axis grid and
+    write the grid representation. Returns False if the map is not a grid."""
+    nr, nz = len(r_axis), len(z_axis)
+    ordered = True
+    position = 0
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(filename))) as tmpdir:
+        # grid ordered values, kept on disk
+        grid = {b: np.lib.format.open_memmap(os.path.join(tmpdir, b + ".npy"), mode="w+",
+                                             dtype=np.float32, shape=(nr * nz,))
+                for b in ("Br", "Bz")}
+        filled = np.lib.format.open_memmap(os.path.join(tmpdir, "filled.npy"), mode="w+",
+                                           dtype=np.bool_, shape=(nr * nz,))
+        with uproot.open(filename) as fin:
+            for data in fin["fieldmap"].iterate(branches, step_size=chunk_size, library="np"):
+                index = np.searchsorted(z_axis, data["z"]) * nr + np.searchsorted(r_axis, data["r"])
+                if filled[index].any() or len(np.unique(index)) != len(index):
+                    print("Duplicated nodes: the map is not written as a grid")
+                    return False
+                ordered = ordered and np.array_equal(index, np.arange(position, position + len(index)))
+                position += len(index)
+                filled[index] = True
+                for b in ("Br", "Bz"):
+                    grid[b][index] = data[b]
+
+        with uproot.update(filename) as fout:
+            fout["fieldmap_axes"] = {"r": ak.Array([r_axis]), "z": ak.Array([z_axis]),
+                                     "ordered": np.array([ordered], dtype=np.int32)}
+            if not ordered:
+                tree = fout.mktree("fieldmap_grid", {b: np.float32 for b in ("Br", "Bz")})
+                for start in range(0, nr * nz, chunk_size):
+                    tree.extend({b: np.array(grid[b][start:start + chunk_size]) for b in ("Br", "Bz")})
+        del grid, filled
+    print(f"Map is a {nr} x {nz} (r x z) grid" + ("" if ordered else ", written in grid order to fieldmap_grid"))
+    return True
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -26,32 +107,62 @@ def main():
     )
     parser.add_argument("input", help="Input text file")
     parser.add_argument("output", help="Output ROOT file")
+    parser.add_argument("--chunk-size", type=int, default=1000000,
+                        help="Number of lines read and written at once")
     args = parser.parse_args()
 
-    # Detect unit scaling
-    scale = detect_scale(args.input)
-    if (scale == 0.0):
-        print("Error: length units not detected")
-        sys.exit(-1)
-
-    # Load data (vectorized)
-    data = load_data(args.input)
-
-    # Columns: r, z, Br, Bz
-    rho = np.round(data[:, 0] * scale, 2).astype(np.float32)
-    z   = np.round(data[:, 1] * scale, 2).astype(np.float32)
-    Brho = data[:, 2].astype(np.float32)
-    Bz   = data[:, 3].astype(np.float32)
-
-    # Write ROOT file
-    with uproot.recreate(args.output) as fout:
-        fout["fieldmap"] = {
-            "r": rho,
-            "z": z,
-            "Br": Brho,
-            "Bz": Bz,
-        }
-    print(f"Created {args.output} with {len(rho)} entries")
+    with open(args.input) as f:
+        header, first_line = read_header(f)
+
+        # Detect unit scaling
+        scale = detect_scale(header)
+        if (scale == 0.0):
+            print("Error: length units not detected")
+            sys.exit(-1)
+        ncols = len(first_line.split())
+        if ncols != len(branches):
+            print(f"Error: expected {len(branches)} columns (r, z, Br, Bz), found {ncols}")
+            sys.exit(-1)
+
+        # Stream the data to the ROOT file
+        nentries = 0
+        nodes = int(header["Nodes"]) if header.get("Nodes", "").isdigit() else 0
+        r_axis = np.empty(0, dtype=np.float32)
+        z_axis = np.empty(0, dtype=np.float32)
+        isGrid = True
+        with uproot.recreate(args.output) as fout:
+            tree = fout.mktree("fieldmap", {b: np.float32 for b in branches})
+            for data in read_chunks(f, first_line, ncols, args.chunk_size):
+                # Columns: r, z, Br, Bz
+                rho = np.round(data[:, 0] * scale, 2).astype(np.float32)
+                z = np.round(data[:, 1] * scale, 2).astype(np.float32)
+                tree.extend({
+                    "r": rho,
+                    "z": z,
+                    "Br": data[:, 2].astype(np.float32),
+                    "Bz": data[:, 3].astype(np.float32),
+                })
+                nentries += len(data)
+                # the axes of a grid are much smaller than the map: they are only accumulated
+                # while nr * nz does not exceed the number of nodes (announced in the header,
+                # otherwise twice the nodes read so far, as for nodes in grid order), so that
+                # they stay small and the accumulation stops early for other meshes
+                if isGrid:
+                    r_axis = np.union1d(r_axis, rho)
+                    z_axis = np.union1d(z_axis, z)
+                    if len(r_axis) * len(z_axis) > (nodes if nodes else 2 * nentries):
+                        isGrid = False
+                        r_axis = z_axis = None
+
+    if "Nodes" in header and int(header["Nodes"]) != nentries:
+        print(f"Warning: header announces {header['Nodes']} nodes, {nentries} read")
+    print(f"Created {args.output} with {nentries} entries")
+
+    # Grid representation
+    if isGrid and len(r_axis) * len(z_axis) == nentries and len(r_axis) > 1 and len(z_axis) > 1:
+        write_grid(args.output, r_axis, z_axis, args.chunk_size)
+    else:
+        print("Map nodes do not form a rectilinear grid, fieldMap.py will use a KD-tree")
 
 if __name__ == "__main__":
     main()
@@ -1,72 +1,77 @@
 #
-# print all constants and corresponding values in the compact files
-# The user can decide which subdetectors or other elements to show or not
+# draw the magnetic field of the detector in the r-z plane
+# The field is sampled on the whole grid at once and saved, so that the
+# plot can be redone (--input) without sampling the field again
 #
-import ROOT
-import dd4hep
 import os
 import sys
+import hashlib
 import argparse
-from dd4hep import Position, tesla, mm
 import matplotlib.pyplot as plt
 import numpy as np
+from fieldSampler import sampleRZ, saveSamples, loadSamples
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
 
 parser = argparse.ArgumentParser(
-        description="Print selected constants from a DD4hep compact file. Enable/disable the subdetectors in the elementsToShow list"
+        description="Draw the magnetic field of a DD4hep compact file in the r-z plane"
     )
-parser.parse_args()
-
-
-
-# ------------------------------------------------------------------
-# Load detector geometry
-# ------------------------------------------------------------------
-compactFile = "FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml"
-# compactFile = "ILD/compact/ILD_s6_v02/ILD_s6_v02.xml"
-path_to_detector = os.environ.get("K4GEO", "")
-detectorFile = path_to_detector + "/" + compactFile
-detector = dd4hep.Detector.getInstance()
-detector.fromXML(detectorFile)
-print("Loaded detector from compact file:", detectorFile)
-
-
-# Grid definition
-# rho_vals = np.linspace(2650, 2750, 100) * mm   # 0 - 6 m
-rho_vals = np.linspace(0, 6000, 100) * mm   # 0 - 6 m
-z_vals   = np.linspace(-5000, 5000, 100) * mm  # -5 - 5 m
-# z_vals   = np.linspace(3060, 3070, 100) * mm  # -5 - 5 m
-
-R, Z = np.meshgrid(rho_vals, z_vals)
-
-# Arrays for field
-Brho = np.zeros_like(R, dtype=float)
-Bz   = np.zeros_like(Z, dtype=float)
-Bmag = np.zeros_like(R, dtype=float)
-
-# Compute field
-print("rho (mm)     z (mm)  Bx (T)     Bx (T)     Bz (T)")
-for i in range(R.shape[0]):
-    for j in range(R.shape[1]):
-        rho = R[i, j]
-        z   = Z[i, j]
-
-        # phi = 0 ? x=rho, y=0
-        pos = Position(rho, 0.0, z)
-        B = detector.field().magneticField(pos) / tesla
-
-        # cylindrical components (phi = 0)
-        Br = B.x()
-        Bz_val = B.z()
-
-        Brho[i, j] = Br
-        Bz[i, j]   = Bz_val
-        Bmag[i, j] = np.sqrt(Br**2 + B.y()**2 + Bz_val**2)
-
-        print("{:12f} {:12f} {:12f} {:12f} {:12f}".format(rho/mm, z/mm, B.x(), B.y(), B.z()))
-
-# Convert axes to mm for plotting
-R_mm = R / mm
-Z_mm = Z / mm
+parser.add_argument("--rho", type=float, nargs=3, default=[0., 6000., 100], metavar=("MIN", "MAX", "N"),
+                    help="rho range (mm) and number of points of the grid")
+parser.add_argument("--z", type=float, nargs=3, default=[-5000., 5000., 100], metavar=("MIN", "MAX", "N"),
+                    help="z range (mm) and number of points of the grid")
+parser.add_argument("--output", type=str, default="field_samples.npz",
+                    help="File (.npz or .root) where the sampled field is saved")
+parser.add_argument("--input", type=str, default="",
+                    help="Draw the field from a file written previously with --output instead of sampling it")
+parser.add_argument("--print", action="store_true",
+                    help="Print the field at every point of the grid")
+args = parser.parse_args()
+
+
+if args.input:
+    samples = loadSamples(args.input)
+else:
+    # ------------------------------------------------------------------
+    # Load detector geometry
+    # ------------------------------------------------------------------
+    from geometrySnapshot import loadSnapshot
+    compactFile = "FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml"
+    # compactFile = "ILD/compact/ILD_s6_v02/ILD_s6_v02.xml"
+    path_to_detector = os.environ.get("K4GEO", "")
+    detectorFile = path_to_detector + "/" + compactFile
+    # the field values are cached in the geometry snapshot, DD4hep is only
+    # needed the first time a grid is drawn for a given geometry
+    snapshot = loadSnapshot(detectorFile)
+
+    # Grid definition (mm), e.g. --rho 2650 2750 100 --z 3060 3070 100 for the endcap fringe field
+    rho_vals = np.linspace(args.rho[0], args.rho[1], int(args.rho[2]))
+    z_vals   = np.linspace(args.z[0], args.z[1], int(args.z[2]))
+
+    # Compute field, all the grid points at once (grid in mm, field in T)
+    def computeField():
+        samples = sampleRZ(snapshot.detector(), rho_vals, z_vals)
+        return np.stack([samples["Brho"], samples["Bphi"], samples["Bz"]])
+
+    gridKey = hashlib.sha256(np.stack(np.meshgrid(rho_vals, z_vals)).tobytes()).hexdigest()[:16]
+    Brho, Bphi, Bz = snapshot.cachedArray("bfield_rz_" + gridKey, computeField)
+    R, Z = np.meshgrid(rho_vals, z_vals)
+    samples = {"rho_vals": rho_vals, "z_vals": z_vals, "R": R, "Z": Z,
+               "Brho": np.array(Brho), "Bphi": np.array(Bphi), "Bz": np.array(Bz)}
+    saveSamples(args.output, samples)
+
+R, Z = samples["R"], samples["Z"]
+# cylindrical components (phi = 0)
+Brho, Bphi, Bz = samples["Brho"], samples["Bphi"], samples["Bz"]
+Bmag = np.sqrt(Brho**2 + Bphi**2 + Bz**2)
+
+if args.print:
+    print("rho (mm)     z (mm)  Bx (T)     By (T)     Bz (T)")
+    table = np.column_stack([R.ravel(), Z.ravel(), Brho.ravel(), Bphi.ravel(), Bz.ravel()])
+    np.savetxt(sys.stdout, table, fmt="%12f")
+
+# Axes are already in mm for plotting
+R_mm = R
+Z_mm = Z
 
 # --- Plot ---
 plt.figure(figsize=(8, 6))
@@ -75,8 +80,8 @@ plt.figure(figsize=(8, 6))
 plt.pcolormesh(Z_mm, R_mm, Bmag, shading='auto')
 plt.colorbar(label='|B| [T]')
 
-# Quiver: downsample for readability
-step = 2
+# Quiver: downsample for readability (about 50 arrows per axis)
+step = max(1, max(R.shape) // 50)
 plt.quiver(
     Z_mm[::step, ::step],
     R_mm[::step, ::step],
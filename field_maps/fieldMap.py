@@ -0,0 +1,135 @@
+#
+# fieldMap.py
+#
+# reader of the (r, z) field maps written by convert_fieldmap.py, with
+# vectorized interpolation of the field at arbitrary points
+#
+# If the map is a rectilinear grid (axes stored in the fieldmap_axes tree by
+# the converter) the field is interpolated bilinearly in the grid cell
+# containing each point, whose index is computed directly for equally
+# spaced axes. Otherwise the map is a list of points and the field is
+# interpolated from the nearest nodes found with a KD-tree (requires scipy).
+# In both cases the field is 0 outside the map (grid range, or bounding box
+# of the nodes).
+#
+# Positions are in mm and the field in T. Maps covering only z >= 0 are
+# extended to z < 0 assuming the symmetry of a solenoid (Br odd, Bz even in z).
+#
+# Usage:
+#   from fieldMap import FieldMap
+#   fieldmap = FieldMap("ALLEGRO_fieldmap_2T_20260424.root")
+#   Br, Bz = fieldmap.field(rho, z)
+#   Bx, By, Bz = fieldmap.fieldXYZ(x, y, z)
+#
+import numpy as np
+import uproot
+
+treeName = "fieldmap"
+gridTreeName = "fieldmap_grid"
+axesTreeName = "fieldmap_axes"
+
+
+def _cellIndex(axis, values, uniform):
+    """Index i of the grid cell [axis[i], axis[i+1]] containing each value"""
+    if uniform:
+        index = np.floor((values - axis[0]) / (axis[1] - axis[0])).astype(np.int64)
+    else:
+        index = np.searchsorted(axis, values, side="right") - 1
+    return np.clip(index, 0, len(axis) - 2)
+
+
+def _isUniform(axis):
+    steps = np.diff(axis)
+    return len(axis) > 1 and np.allclose(steps, steps[0], rtol=1e-4, atol=0)
+
+
+class FieldMap:
+    """Br, Bz field map in the r-z plane"""
+
+    def __init__(self, filename, lengthScale=1000., mirrorZ=None, neighbours=4):
+        # lengthScale: map length unit in mm (the converter writes m)
+        self.lengthScale = lengthScale
+        with uproot.open(filename) as f:
+            if axesTreeName in f:
+                axes = f[axesTreeName].arrays(["r", "z", "ordered"], library="np")
+                self.rAxis = axes["r"][0].astype(np.float64) * lengthScale
+                self.zAxis = axes["z"][0].astype(np.float64) * lengthScale
+                grid = f[treeName if axes["ordered"][0] else gridTreeName].arrays(["Br", "Bz"], library="np")
+                # grid[iz, ir]
+                shape = (len(self.zAxis), len(self.rAxis))
+                self.Br = grid["Br"].astype(np.float64).reshape(shape)
+                self.Bz = grid["Bz"].astype(np.float64).reshape(shape)
+                self.rUniform = _isUniform(self.rAxis)
+                self.zUniform = _isUniform(self.zAxis)
+                self.isGrid = True
+                zMin = self.zAxis[0]
+            else:
+                # fallback for non-regular meshes
+                try:
+                    from scipy.spatial import cKDTree
+                except ImportError as e:
+                    raise ImportError(f"{filename} is not a grid map: its interpolation needs scipy (KD-tree), "
+                                      "install it or convert the map on a rectilinear grid") from e
+                points = f[treeName].arrays(["r", "z", "Br", "Bz"], library="np")
+                self.points = np.column_stack([points["r"], points["z"]]).astype(np.float64) * lengthScale
+                self.Br = points["Br"].astype(np.float64)
+                self.Bz = points["Bz"].astype(np.float64)
+                self.kdtree = cKDTree(self.points)
+                self.neighbours = min(neighbours, len(self.points))
+                self.isGrid = False
+                # bounding box of the nodes, outside of which the field is 0 as for grids
+                self.pointsMin = self.points.min(axis=0)
+                self.pointsMax = self.points.max(axis=0)
+                zMin = self.pointsMin[1]
+        self.mirrorZ = zMin >= 0 if mirrorZ is None else mirrorZ
+
+    def _gridField(self, r, z):
+        ir = _cellIndex(self.rAxis, r, self.rUniform)
+        iz = _cellIndex(self.zAxis, z, self.zUniform)
+        # position inside the cell (0-1)
+        tr = (r - self.rAxis[ir]) / (self.rAxis[ir + 1] - self.rAxis[ir])
+        tz = (z - self.zAxis[iz]) / (self.zAxis[iz + 1] - self.zAxis[iz])
+        result = []
+        for B in (self.Br, self.Bz):
+            result.append((1 - tz) * ((1 - tr) * B[iz, ir] + tr * B[iz, ir + 1])
+                          + tz * ((1 - tr) * B[iz + 1, ir] + tr * B[iz + 1, ir + 1]))
+        inside = ((r >= self.rAxis[0]) & (r <= self.rAxis[-1])
+                  & (z >= self.zAxis[0]) & (z <= self.zAxis[-1]))
+        return np.where(inside, result[0], 0.), np.where(inside, result[1], 0.)
+
+    def _pointsField(self, r, z):
+        # inverse-distance weighting of the nearest nodes
+        distances, index = self.kdtree.query(np.column_stack([r, z]), k=self.neighbours)
+        if self.neighbours == 1:
+            Br, Bz = self.Br[index], self.Bz[index]
+        else:
+            weights = 1. / np.maximum(distances, 1e-9)
+            weights /= weights.sum(axis=1, keepdims=True)
+            Br, Bz = (weights * self.Br[index]).sum(axis=1), (weights * self.Bz[index]).sum(axis=1)
+        inside = ((r >= self.pointsMin[0]) & (r <= self.pointsMax[0])
+                  & (z >= self.pointsMin[1]) & (z <= self.pointsMax[1]))
+        return np.where(inside, Br, 0.), np.where(inside, Bz, 0.)
+
+    def field(self, r, z):
+        """Br, Bz (T) at the points r, z (mm), arrays of any (common) shape"""
+        r, z = np.broadcast_arrays(np.asarray(r, dtype=np.float64), np.asarray(z, dtype=np.float64))
+        shape = r.shape
+        r = r.ravel()
+        z = z.ravel()
+        zSign = np.where(z < 0, -1., 1.) if self.mirrorZ else np.ones_like(z)
+        zMap = np.abs(z) if self.mirrorZ else z
+        if self.isGrid:
+            Br, Bz = self._gridField(r, zMap)
+        else:
+            Br, Bz = self._pointsField(r, zMap)
+        return (Br * zSign).reshape(shape), Bz.reshape(shape)
+
+    def fieldXYZ(self, x, y, z):
+        """Bx, By, Bz (T) at the points x, y, z (mm)"""
+        x, y, z = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64),
+                                      np.asarray(z, dtype=np.float64))
+        r = np.hypot(x, y)
+        Br, Bz = self.field(r, z)
+        cosPhi = np.divide(x, r, out=np.ones_like(r), where=r > 0)
+        sinPhi = np.divide(y, r, out=np.zeros_like(r), where=r > 0)
+        return Br * cosPhi, Br * sinPhi, Bz
@@ -0,0 +1,107 @@
+#
+# fieldSampler.py
+#
+# evaluate the DD4hep magnetic field on whole arrays of points in a single
+# call: the loop over the points runs in C++ (declared through cling),
+# instead of one detector.field().magneticField(Position) call per point
+# from Python
+#
+# Positions are given in mm and the field is returned in T, independently
+# of the DD4hep internal units.
+#
+# Usage:
+#   from fieldSampler import sampleRZ, saveSamples
+#   samples = sampleRZ(detector, rho_vals, z_vals)
+#   saveSamples("field_samples.npz", samples)
+#
+import numpy as np
+
+treeName = "fieldsamples"
+
+_sampleFieldCode = """
+#include "DD4hep/Detector.h"
+#include "DD4hep/Fields.h"
+
+void fieldSamplerLoop(const dd4hep::Detector& detector, long n,
+                      const double* x, const double* y, const double* z,
+                      double* bx, double* by, double* bz) {
+  dd4hep::OverlayedField field = detector.field();
+  double pos[3];
+  double b[3];
+  for (long i = 0; i < n; ++i) {
+    pos[0] = x[i];
+    pos[1] = y[i];
+    pos[2] = z[i];
+    b[0] = b[1] = b[2] = 0.;
+    field.magneticField(pos, b);
+    bx[i] = b[0];
+    by[i] = b[1];
+    bz[i] = b[2];
+  }
+}
+"""
+_declared = False
+
+
+def _declare():
+    global _declared
+    if not _declared:
+        import ROOT
+        ROOT.gInterpreter.Declare(_sampleFieldCode)
+        _declared = True
+
+
+def sampleField(detector, x, y, z):
+    """Bx, By, Bz (T) at the points x, y, z (mm), arrays of any (common) shape"""
+    import ROOT
+    import dd4hep
+    _declare()
+    x, y, z = np.broadcast_arrays(x, y, z)
+    shape = x.shape
+    pos = [np.ascontiguousarray(np.ravel(v), dtype=np.float64) * dd4hep.mm for v in (x, y, z)]
+    B = np.zeros((3, pos[0].size))
+    ROOT.fieldSamplerLoop(detector, pos[0].size, pos[0], pos[1], pos[2], B[0], B[1], B[2])
+    B /= dd4hep.tesla
+    return B[0].reshape(shape), B[1].reshape(shape), B[2].reshape(shape)
+
+
+def sampleRZ(detector, rho_vals, z_vals):
+    """Sample the field on the grid rho_vals x z_vals (mm) in the phi = 0 plane.
+    Returns a dict with the axes, the R, Z meshgrid and Brho, Bphi, Bz (T)
+    (Bphi = By at phi = 0)"""
+    R, Z = np.meshgrid(np.asarray(rho_vals, dtype=np.float64), np.asarray(z_vals, dtype=np.float64))
+    Bx, By, Bz = sampleField(detector, R, np.zeros_like(R), Z)
+    return {"rho_vals": np.asarray(rho_vals, dtype=np.float64), "z_vals": np.asarray(z_vals, dtype=np.float64),
+            "R": R, "Z": Z, "Brho": Bx, "Bphi": By, "Bz": Bz}
+
+
+# ================================
+# Storage of the samples
+# ================================
+def saveSamples(filename, samples):
+    """Write the samples of sampleRZ to a .npz file or a ROOT file (one
+    entry per grid point, plus the axes in a second tree)"""
+    if filename.endswith(".npz"):
+        np.savez(filename, **samples)
+    else:
+        import uproot
+        with uproot.recreate(filename) as f:
+            f[treeName] = {var: np.ravel(samples[var]) for var in ("R", "Z", "Brho", "Bphi", "Bz")}
+            f[treeName + "_axes"] = {"rho_vals": samples["rho_vals"]}
+            f[treeName + "_axes_z"] = {"z_vals": samples["z_vals"]}
+    print("Field samples written to", filename)
+
+
+def loadSamples(filename):
+    if filename.endswith(".npz"):
+        with np.load(filename) as f:
+            return {var: f[var] for var in f.files}
+    import uproot
+    with uproot.open(filename) as f:
+        rho_vals = f[treeName + "_axes"]["rho_vals"].array(library="np")
+        z_vals = f[treeName + "_axes_z"]["z_vals"].array(library="np")
+        samples = {"rho_vals": rho_vals, "z_vals": z_vals}
+        shape = (len(z_vals), len(rho_vals))
+        for var, values in f[treeName].arrays(library="np").items():
+            samples[var] = values.reshape(shape)
+    return samples
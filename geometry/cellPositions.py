@@ -0,0 +1,183 @@
+#
+# cellPositions.py
+#
+# precompute the positions of all the cells of the calorimeter readouts
+# and store them as a columnar table sorted by cellId, so that the
+# positions of many cells can be obtained with a vectorized lookup
+# instead of one seg.position + volman.lookupContext call per cell
+#
+# Usage:
+#   python cellPositions.py --cells-from neighbours_map_ecalB_ecalE_hcalB_hcalE.root
+#
+# The cellIDs are taken from a map containing all the cells of the readouts
+# (e.g. the full neighbour map, whose cells are enumerated with the
+# segmentation utilities of k4geo), the positions are computed with DD4hep.
+# The table (columns cellId, x, y, z, rho, theta, phi, layer; lengths in mm)
+# is written to a ROOT tree or npz file and stored in the geometry snapshot.
+#
+# Lookup from other scripts:
+#   from cellPositions import loadCellPositions, lookupPositions
+#   table = loadCellPositions(snapshot)   # or loadCellPositions("cellPositions.root")
+#   positions = lookupPositions(table, cellIds)
+#
+import os
+import sys
+import argparse
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+
+columns = ["cellId", "x", "y", "z", "rho", "theta", "phi", "layer"]
+treeName = "cellPositions"
+snapshotPrefix = "cellPositions_"
+
+# readouts of the ALLEGRO calorimeters and their system IDs
+readoutMap = {
+    4 : "ECalBarrelModuleThetaMerged",
+    5 : "ECalEndcapTurbine",
+    8 : "HCalBarrelReadout",
+    9 : "HCalEndcapReadout",
+}
+
+defaultCompactFile = "FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml"
+
+
+# ================================
+# Reading and lookup
+# ================================
+def loadCellPositions(source):
+    """Return the table (dict column -> array sorted by cellId) from a
+    geometry snapshot, a ROOT file or a npz file"""
+    if not isinstance(source, str):
+        if not source.hasArray(snapshotPrefix + "cellId"):
+            return None
+        return {c: source.array(snapshotPrefix + c) for c in columns}
+    if source.endswith(".npz"):
+        with np.load(source) as f:
+            return {c: f[c] for c in columns}
+    import uproot
+    with uproot.open(source) as f:
+        return f[treeName].arrays(columns, library="np")
+
+
+def findRows(table, cellIds):
+    """Row of each cellId in the table, -1 if the cell is not in it"""
+    cellIds = np.asarray(cellIds, dtype=np.uint64)
+    sortedIds = table["cellId"]
+    if len(sortedIds) == 0:
+        return np.full(cellIds.shape, -1, dtype=np.int64)
+    rows = np.minimum(np.searchsorted(sortedIds, cellIds), len(sortedIds) - 1)
+    return np.where(sortedIds[rows] == cellIds, rows, -1)
+
+
+def lookupPositions(table, cellIds):
+    """Return dict column -> values for the given cellIds (NaN, or -1 for
+    the layer, if a cell is not in the table)"""
+    rows = findRows(table, cellIds)
+    found = rows >= 0
+    result = {"cellId": np.asarray(cellIds, dtype=np.uint64)}
+    for c in columns[1:]:
+        values = table[c][np.where(found, rows, 0)]
+        result[c] = np.where(found, values, -1 if c == "layer" else np.nan)
+    return result
+
+
+# ================================
+# Creation
+# ================================
+def computePositions(detector, readoutName, cellIds):
+    """x, y, z (mm) of the given cells of a readout, computed with DD4hep"""
+    import dd4hep
+    volman = detector.volumeManager()
+    seg = detector.readout(readoutName).segmentation()
+    xyz = np.empty((len(cellIds), 3))
+    contexts = {}
+    for i, cellID in enumerate(cellIds.tolist()):
+        # look up the volume context once per volume
+        volumeID = seg.volumeID(cellID)
+        vc = contexts.get(volumeID)
+        if vc is None:
+            vc = volman.lookupContext(volumeID)
+            contexts[volumeID] = vc
+        position = vc.localToWorld(seg.position(cellID))
+        xyz[i] = (position.x(), position.y(), position.z())
+    return xyz / dd4hep.mm
+
+
+def createTable(snapshot, cellIds):
+    from bitFieldCoder import BitFieldCoder
+
+    cellIds = np.unique(np.asarray(cellIds, dtype=np.uint64))
+    systemOfCell = (cellIds & np.uint64(0b1111)).astype(np.int64)
+    known = np.isin(systemOfCell, list(readoutMap))
+    if not known.all():
+        print("WARNING:", int((~known).sum()), "cellIDs belong to unknown systems and are skipped")
+    cellIds = cellIds[known]
+    systemOfCell = systemOfCell[known]
+
+    xyz = np.full((len(cellIds), 3), np.nan)
+    layer = np.full(len(cellIds), -1, dtype=np.int32)
+    detector = snapshot.detector()
+    for system, readoutName in readoutMap.items():
+        rows = np.flatnonzero(systemOfCell == system)
+        if len(rows) == 0:
+            continue
+        print(f"Computing positions of {len(rows)} cells of {readoutName}")
+        xyz[rows] = computePositions(detector, readoutName, cellIds[rows])
+        coder = BitFieldCoder(snapshot.encoding(readoutName))
+        layer[rows] = coder.get(cellIds[rows], "layer")
+
+    x, y, z = xyz.T
+    rho = np.hypot(x, y)
+    return {
+        "cellId": cellIds,
+        "x": x, "y": y, "z": z,
+        "rho": rho,
+        "theta": np.arctan2(rho, z),
+        "phi": np.arctan2(y, x),
+        "layer": layer,
+    }
+
+
+def writeTable(filename, table):
+    if filename.endswith(".npz"):
+        np.savez(filename, **table)
+    else:
+        import uproot
+        with uproot.recreate(filename) as f:
+            f[treeName] = table
+    print("Positions of", len(table["cellId"]), "cells written to", filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the table of the positions of all calorimeter cells")
+    parser.add_argument("--cells-from", type=str, nargs="+", required=True,
+                        help="Map file(s) with a cellId branch listing all the cells (e.g. the full neighbour map)")
+    parser.add_argument("--tree", type=str, default="neighbours",
+                        help="Name of the tree in the map file(s)")
+    parser.add_argument("--compact", type=str, default=defaultCompactFile,
+                        help="Compact file, relative to $K4GEO")
+    parser.add_argument("--output", type=str, default="cellPositions.root",
+                        help="Output table (.root or .npz)")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Do not store the table in the geometry snapshot")
+    args = parser.parse_args()
+
+    import mapTools
+    from geometrySnapshot import loadSnapshot
+
+    cellIds = np.concatenate([mapTools.readCellIds(f, treeName=args.tree) for f in args.cells_from])
+    print("Read", len(cellIds), "cellIDs from", ", ".join(args.cells_from))
+
+    detectorFile = os.environ.get("K4GEO", "") + "/" + args.compact
+    snapshot = loadSnapshot(detectorFile)
+    table = createTable(snapshot, cellIds)
+    writeTable(args.output, table)
+    if not args.no_snapshot:
+        for c in columns:
+            snapshot.saveArray(snapshotPrefix + c, table[c])
+        print("Table stored in geometry snapshot", snapshot.folder)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
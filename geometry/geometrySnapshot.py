@@ -0,0 +1,218 @@
+#
+# geometrySnapshot.py
+#
+# cache of the geometry information used by the utilities (constants,
+# readout encodings, segmentation parameters and arrays such as cell
+# positions or field samples), so that the full compact file only has to
+# be parsed with DD4hep when it (or one of the files it includes) changes
+#
+# Usage:
+#   from geometrySnapshot import loadSnapshot
+#   snapshot = loadSnapshot(detectorFile)
+#   nWheels = snapshot.constantAsLong("EMECnWheels")
+#   encoding = snapshot.encoding("ECalEndcapTurbine")
+#
+# The snapshots are stored in $GEOMETRY_CACHE_DIR (default:
+# ~/.cache/k4geo-snapshots), one directory per compact file and checksum.
+# The checksum is computed over the compact file and all the files it
+# includes, since the compact_checksum constant itself is only known after
+# parsing the geometry (its value is stored in the snapshot as well).
+#
+import os
+import re
+import json
+import hashlib
+import xml.etree.ElementTree as ET
+import numpy as np
+
+snapshotVersion = 1
+defaultCacheDir = os.path.join(os.path.expanduser("~"), ".cache", "k4geo-snapshots")
+
+# attributes pointing to other files that can change the geometry
+fileAttributes = ["ref", "filename"]
+
+
+# ================================
+# Checksum of the compact files
+# ================================
+def compactFiles(detectorFile):
+    """Return the compact file and all the existing files it refers to (recursively)"""
+    files = []
+    toVisit = [os.path.abspath(detectorFile)]
+    while toVisit:
+        filename = toVisit.pop(0)
+        if filename in files:
+            continue
+        files.append(filename)
+        if not filename.endswith(".xml"):
+            continue
+        try:
+            root = ET.parse(filename).getroot()
+        except ET.ParseError:
+            continue
+        folder = os.path.dirname(filename)
+        for element in root.iter():
+            for attribute in fileAttributes:
+                ref = element.get(attribute)
+                if not ref or re.match(r"^\w+://", ref):
+                    continue
+                for candidate in (os.path.join(folder, ref), os.path.abspath(ref)):
+                    if os.path.isfile(candidate):
+                        toVisit.append(os.path.abspath(candidate))
+                        break
+    return files
+
+
+def compactChecksum(detectorFile):
+    checksum = hashlib.sha256()
+    for filename in compactFiles(detectorFile):
+        checksum.update(filename.encode())
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                checksum.update(block)
+    return checksum.hexdigest()
+
+
+# ================================
+# Snapshot
+# ================================
+class GeometrySnapshot:
+    """Constants, readouts and cached arrays of a compact file.
+
+    The accessors mimic those of dd4hep::Detector; the DD4hep geometry
+    itself is only loaded if detector() is called.
+    """
+
+    def __init__(self, detectorFile, folder, content):
+        self.detectorFile = detectorFile
+        self.folder = folder
+        self.checksum = content["checksum"]
+        self.constants = content["constants"]
+        self.values = content["values"]
+        self.readouts = content["readouts"]
+        self._detector = None
+
+    # ----------------------------
+    # constants
+    # ----------------------------
+    def constantAsString(self, name):
+        return self.constants[name]
+
+    def constantAsDouble(self, name):
+        value = self.values.get(name)
+        if value is None:
+            raise RuntimeError(f"Constant {name} cannot be evaluated as a number")
+        return value
+
+    def constantAsLong(self, name):
+        return int(round(self.constantAsDouble(name)))
+
+    # ----------------------------
+    # readouts
+    # ----------------------------
+    def encoding(self, readoutName):
+        return self.readouts[readoutName]["encoding"]
+
+    def segmentationType(self, readoutName):
+        return self.readouts[readoutName]["segmentation"]
+
+    def segmentationParameters(self, readoutName):
+        return self.readouts[readoutName]["parameters"]
+
+    # ----------------------------
+    # cached arrays (cell positions, field samples, ...)
+    # ----------------------------
+    def _arrayFile(self, name):
+        return os.path.join(self.folder, name + ".npy")
+
+    def hasArray(self, name):
+        return os.path.isfile(self._arrayFile(name))
+
+    def array(self, name, mmap=True):
+        return np.load(self._arrayFile(name), mmap_mode="r" if mmap else None)
+
+    def saveArray(self, name, values):
+        tmp = self._arrayFile(name) + f".tmp{os.getpid()}.npy"
+        np.save(tmp, values)
+        os.replace(tmp, self._arrayFile(name))
+
+    def cachedArray(self, name, compute):
+        """Return the array name from the snapshot, computing (and storing) it if missing"""
+        if not self.hasArray(name):
+            self.saveArray(name, compute())
+        return self.array(name)
+
+    # ----------------------------
+    # full geometry, for what is not in the snapshot
+    # ----------------------------
+    def detector(self):
+        if self._detector is None:
+            self._detector = loadDetector(self.detectorFile)
+        return self._detector
+
+
+def loadDetector(detectorFile):
+    import dd4hep
+    detector = dd4hep.Detector.getInstance()
+    detector.fromXML(detectorFile)
+    print("Loaded detector from compact file:", detectorFile)
+    return detector
+
+
+def extractContent(detector, checksum):
+    constants = {}
+    values = {}
+    for name, handle in detector.constants():
+        pname = str(name)
+        constants[pname] = str(detector.constantAsString(name))
+        try:
+            values[pname] = float(detector.constantAsDouble(name))
+        except Exception:
+            values[pname] = None
+
+    readouts = {}
+    for name, handle in detector.readouts():
+        rname = str(name)
+        readout = detector.readout(rname)
+        content = {"encoding": str(readout.idSpec().fieldDescription()),
+                   "segmentation": "", "parameters": {}}
+        seg = readout.segmentation()
+        if seg.isValid():
+            content["segmentation"] = str(seg.type())
+            for par in seg.parameters():
+                content["parameters"][str(par.name())] = str(par.value())
+        readouts[rname] = content
+
+    return {"version": snapshotVersion, "checksum": checksum,
+            "constants": constants, "values": values, "readouts": readouts}
+
+
+def loadSnapshot(detectorFile, rebuild=False, cacheDir=None):
+    """Return the snapshot of detectorFile, parsing it with DD4hep only on a cache miss"""
+    detectorFile = os.path.abspath(detectorFile)
+    if not os.path.isfile(detectorFile):
+        raise FileNotFoundError(f"Compact file '{detectorFile}' does not exist")
+    cacheDir = cacheDir or os.environ.get("GEOMETRY_CACHE_DIR", defaultCacheDir)
+    checksum = compactChecksum(detectorFile)
+    pathKey = hashlib.sha256(detectorFile.encode()).hexdigest()[:12]
+    folder = os.path.join(cacheDir, f"{os.path.basename(detectorFile)[:-4]}-{pathKey}-{checksum[:16]}")
+    snapshotFile = os.path.join(folder, "snapshot.json")
+
+    if not rebuild and os.path.isfile(snapshotFile):
+        with open(snapshotFile) as f:
+            content = json.load(f)
+        if content.get("version") == snapshotVersion and content.get("checksum") == checksum:
+            print("Loaded geometry snapshot:", folder)
+            return GeometrySnapshot(detectorFile, folder, content)
+
+    print("Creating geometry snapshot for", detectorFile)
+    detector = loadDetector(detectorFile)
+    content = extractContent(detector, checksum)
+    os.makedirs(folder, exist_ok=True)
+    tmp = snapshotFile + f".tmp{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(content, f)
+    os.replace(tmp, snapshotFile)
+    snapshot = GeometrySnapshot(detectorFile, folder, content)
+    snapshot._detector = detector
+    return snapshot
@@ -2,14 +2,16 @@
 # print all constants and corresponding values in the compact files
 # The user can decide which subdetectors or other elements to show or not
 #
-import dd4hep
 import os
 import argparse
+from geometrySnapshot import loadSnapshot
 
 parser = argparse.ArgumentParser(
         description="Print selected constants from a DD4hep compact file. Enable/disable the subdetectors in the elementsToShow list"
     )
-parser.parse_args()
+parser.add_argument("--rebuild-snapshot", action="store_true",
+                    help="Parse the compact file again even if a geometry snapshot exists")
+args = parser.parse_args()
 
 # elements to skip at parsing time
 elementsToSkip = []
@@ -123,22 +125,20 @@ def getElement(name):
 
 
 # ------------------------------------------------------------------
-# Load detector geometry
+# Load detector geometry (from the snapshot cache if up to date)
 # ------------------------------------------------------------------
 compactFile = "FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml"
 # compactFile = "FCCee/ALLEGRO/compact/ALLEGRO_o2_v01/ALLEGRO_o2_v01.xml"
 path_to_detector = os.environ.get("K4GEO", "")
 detectorFile = path_to_detector + "/" + compactFile
-detector = dd4hep.Detector.getInstance()
-detector.fromXML(detectorFile)
-print("Loaded detector from compact file:", detectorFile)
+detector = loadSnapshot(detectorFile, rebuild=args.rebuild_snapshot)
 
 print("")
 
 # extract constants
 constants = {}
 
-for name, handle in detector.constants():
+for name in detector.constants:
     # 1. Always get the string representation first
     pname = str(name)
     element = getElement(pname)
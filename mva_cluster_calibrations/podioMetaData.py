@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# podioMetaData.py
+#
+# reads the list of shower shape parameters of a cluster collection from the
+# metadata frame of a podio file (parameter <collection>__shapeParameterNames),
+# in the same python process (replaces the former getMetaData.sh, which ran
+# printMetaData.py in a key4hep environment in a subprocess)
+#
+# The podio reader is used when available (key4hep environment), otherwise the
+# parameter is read with uproot from the metadata tree (GPStringKeys/GPStringValues).
+# The result is memoized per (file, collection), in memory and in small json
+# files in $PODIO_METADATA_CACHE_DIR (default: ~/.cache/podio-metadata), keyed
+# on the path, size and modification time of the file.
+#
+# Usage:
+#   from podioMetaData import shapeParameterNames
+#   names = shapeParameterNames("reconstruction.root", "AugmentedEMBCaloClusters")
+#
+#   python podioMetaData.py reconstruction.root AugmentedEMBCaloClusters
+
+import os
+import sys
+import json
+import hashlib
+
+defaultCacheDir = os.path.join(os.path.expanduser("~"), ".cache", "podio-metadata")
+
+_memo = {}
+
+
+def readParameterWithPodio(filename, name):
+    from podio.reading import get_reader
+    reader = get_reader(filename)
+    frame = reader.get("metadata")[0]
+    return frame.get_parameter(name)
+
+
+def readParameterWithUproot(filename, name):
+    import uproot
+    with uproot.open(filename) as f:
+        tree = f["metadata"]
+        keys = tree["GPStringKeys"].array(library="np", entry_stop=1)[0]
+        values = tree["GPStringValues"].array(library="np", entry_stop=1)[0]
+    for key, value in zip(keys, values):
+        if key == name:
+            return list(value)
+    return None
+
+
+def readShapeParameterNames(filename, collection):
+    """Names of the shape parameters of the collection, read from the file"""
+    name = f"{collection}__shapeParameterNames"
+    try:
+        names = readParameterWithPodio(filename, name)
+    except ImportError:
+        names = readParameterWithUproot(filename, name)
+    except KeyError:
+        # missing parameter (Frame.get_parameter raises), same as the uproot reader
+        names = None
+    if names is None:
+        print(f"WARNING: no parameter {name} in the metadata of {filename}")
+        return []
+    if isinstance(names, str):
+        return [names]
+    return [str(n) for n in names]
+
+
+def shapeParameterNames(filename, collection, cacheDir=None):
+    """Names of the shape parameters of the collection, read once per file
+    (and per collection) and then taken from the cache"""
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = hashlib.sha256(json.dumps([filename, stat.st_size, stat.st_mtime_ns, collection]).encode()).hexdigest()[:16]
+    if key in _memo:
+        return list(_memo[key])
+
+    cacheDir = cacheDir or os.environ.get("PODIO_METADATA_CACHE_DIR", defaultCacheDir)
+    cacheFile = os.path.join(cacheDir, f"shape_parameters_{key}.json")
+    if os.path.isfile(cacheFile):
+        with open(cacheFile) as f:
+            names = json.load(f)["names"]
+    else:
+        names = readShapeParameterNames(filename, collection)
+        try:
+            os.makedirs(cacheDir, exist_ok=True)
+            # write to a temporary file first so that concurrent jobs never read a partial file
+            tmpFile = f"{cacheFile}.{os.getpid()}.tmp"
+            with open(tmpFile, "w") as f:
+                json.dump({"file": filename, "collection": collection, "names": names}, f, indent=2)
+            os.replace(tmpFile, cacheFile)
+        except OSError as e:
+            print(f"Warning: could not cache the metadata in {cacheDir}: {e}")
+    _memo[key] = names
+    return list(names)
+
+
+if __name__ == "__main__":
+    inputfile = sys.argv[1]
+    collection = sys.argv[2] if len(sys.argv) > 2 else "AugmentedCaloClusters"
+    print("\nShapeParameter names for collection %s in file %s:\n" % (collection, inputfile))
+    for i, name in enumerate(shapeParameterNames(inputfile, collection)):
+        print("{:3}  {}".format(i, name))
+    print("")
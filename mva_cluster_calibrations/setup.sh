@@ -13,6 +13,7 @@ pip3 install scipy
 pip3 install seaborn
 pip3 install uproot
 pip3 install awkward
+pip3 install pyarrow
 pip3 install tqdm
 pip3 install numba
 pip3 install onnxmltools
@@ -144,7 +144,7 @@ else:
     print('Error: model format %s unknown' % modelFormat)
     import sys
     sys.exit()
-import subprocess
+import podioMetaData
 from math import sqrt, acos, atan2
 import json
 
@@ -210,16 +210,8 @@ c_calc_cluster_energy_per_layer = njit(calc_cluster_energy_per_layer)
 # function to read and return list of shower shape parameters from file
 def read_metadata(filename, clusters):
     print('Reading metadata in file', filename)
-    shapeParameterNames = []
-
-    # Invoke the shell script and capture the output
-    output = subprocess.check_output(['./getMetaData.sh', filename, clusters], shell=False)
-
-    # Decode the output (it's a bytes object) and split it into lines
-    lines = output.decode().splitlines()
-
-    for line in lines:
-        shapeParameterNames.append(line.split()[1])
+    # read in-process from the podio metadata, cached per file and collection
+    shapeParameterNames = podioMetaData.shapeParameterNames(filename, clusters)
     return shapeParameterNames
 
 # -------------------------------------------------------------------------------------------
@@ -17,12 +17,17 @@ readInputsFromCsv = False                                      # read input feat
 readInputsFromPkl = False                                      # read input features from root or from saved dataframe
 saveDataToCsv = False                                          # save data to CSV
 saveDataToPkl = True                                           # save data to pickle
+useFeatureCache = True                                         # when reading from root, cache the features of each input sample in a feather file and reuse it if the inputs did not change
+featureCacheCompression = "uncompressed"                       # compression of the feature cache: "uncompressed" (memory-mapped zero-copy reads), "lz4" or "zstd"
+nReadWorkers = 0                                               # number of processes reading the files of samples with usechain = True (0: number of cores, at most 8)
+readStepSizeMB = 2000                                          # memory (MB) used for the batches read at once, shared among the reading processes
 # cssplkDir = "."                                              # directory where we save/load data in csv/pkl format
 # csvpklDir = "../fullsim/run/test/training_reconstruction_smallSWclusters_noise"
 # csvpklDir = "../../run/paper_LArPb/training_reconstruction"
 # csvpklDir = "../../run/paper_LKrW/training_reconstruction_small"
 csvpklDir = "../../run/paper_LKrW/training_reconstruction_big"
 # csvpklDir = "../../run/paper_LArPb/training_reconstruction_endcap_200k_topo"
+featureCacheDir = csvpklDir + "/feature_cache"                 # directory of the feature cache (one subdirectory per cluster collection)
 # suffix = ""                                                    # suffix to append to model files
 suffix = "_LKrW"
 doTraining = True                                              # if false, only plot Ereco/Etrue
@@ -50,7 +55,8 @@ clusterCollections = [                                         # collections for
 # dictionary of input files: path, filename, and whether to use merged file or not
 # in general I used to run directly over the merged file, but with very big productions
 # and noise on I started to have some overflow issue. This can be worked around
-# running on the unmerged files (usechain = True), though slower.
+# running on the unmerged files (usechain = True), which are read in parallel
+# by nReadWorkers processes.
 # Replace with your own production. Multiple files can be combined
 inputFiles = {
     "lowE": {
@@ -250,10 +256,19 @@ if saveModelToONNX:
     import onnxmltools
 if readInputsFromROOT:
     import uproot
-import subprocess
-from math import sqrt, acos, atan2, pi
+    import awkward as ak
+if useFeatureCache:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import hashlib
+    import json
+import podioMetaData
+from math import pi
 from tqdm import tqdm
 import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 # -------------------------------------------------------------------------------------------
 
@@ -293,26 +308,19 @@ def plotImp(model, X, num=20, fig_size=(40, 20), clusters="clusters", imptype="g
 
 def read_metadata(filename, clusters):
     print('Reading metadata in file', filename)
-    shapeParameterNames = []
-
-    # Invoke the shell script and capture the output
-    output = subprocess.check_output(['./getMetaData.sh', filename, clusters], shell=False)
-
-    # Decode the output (it's a bytes object) and split it into lines
-    lines = output.decode().splitlines()
-    print(lines)
-
-    for line in lines:
-        shapeParameterNames.append(line.split()[1])
+    # read in-process from the podio metadata, cached per file and collection
+    shapeParameterNames = podioMetaData.shapeParameterNames(filename, clusters)
+    print(shapeParameterNames)
     return shapeParameterNames
 
 # -------------------------------------------------------------------------------------------
 
 
-# read the info in the numpy arrays in arr and fill the numpy array with particle momentum,
+# read the info in the awkward arrays in arr and fill the numpy arrays with particle momentum,
 # cluster energy and other features needed for the calibration
+# (all the events of the batch are processed at once, without python loop over the events)
 
-def fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions):
+def fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions, clusters):
     px_part = arr['MCParticles/MCParticles.momentum.x']
     py_part = arr['MCParticles/MCParticles.momentum.y']
     pz_part = arr['MCParticles/MCParticles.momentum.z']
@@ -326,59 +334,52 @@ def fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions)
     shapeParameters = arr[f'_Augmented{clusters}_shapeParameters']
 
     # calculate particle energy
-    nentries = len(px_part)
-    p_part = np.zeros(nentries)
-    # px_part, py_part, pz_part are lists of numpy arrays..
-    for entry in range(nentries):
-        # this selects photons/electrons (depending on PDG) with status=1
-        # mask = (pdg_part[entry] == particle_PDG) & (status_part[entry] == 1)
-        # p_part[entry] = (np.sqrt(px_part[entry][mask]**2 + py_part[entry][mask]**2 + pz_part[entry][mask]**2)).item()
-
-        # this selects the highest momentum particle
-        p = np.sqrt(px_part[entry]**2 + py_part[entry]**2 + pz_part[entry]**2)
-        p_part[entry] = np.max(p)
+    # this selects photons/electrons (depending on PDG) with status=1
+    # mask = (pdg_part == particle_PDG) & (status_part == 1)
+    # this selects the highest momentum particle
+    p = np.sqrt(px_part**2 + py_part**2 + pz_part**2)
+    p_part = ak.to_numpy(ak.fill_none(ak.max(p, axis=1), 0.)).astype(np.float64)
 
     # find out highest energy cluster and retrieve its energy, energy fractions per layer, theta, phi
-    e_cl = np.zeros(nentries)
-    theta_cl = np.zeros(nentries)
-    phi_cl = np.zeros(nentries)
-    efrac_cl = []
-    for layer in range(nLayers):
-        efrac_cl.append(np.zeros(nentries))
-
-    keep = np.ones(nentries, dtype=bool)
-    for entry in range(nentries):
-        if len(e_clusters[entry]) == 0:
-            print('No clusters found for event %d, p=%f, skipping' % (entry, p_part[entry]))
-            keep[entry] = 0
-        else:
-            icl = np.argmax(e_clusters[entry])
-            e_cl[entry] = e_clusters[entry][icl]
-            x_cl = x_clusters[entry][icl]
-            y_cl = y_clusters[entry][icl]
-            z_cl = z_clusters[entry][icl]
-            r_cl = sqrt(x_cl**2 + y_cl**2 + z_cl**2)
-            theta_cl[entry] = acos(z_cl / r_cl)
-            phi_cl[entry] = atan2(y_cl, x_cl)
-            for layer in range(nLayers):
-                position = parBegin[entry][icl] + inputFeaturePositions[layer]
-                efrac_cl[layer][entry] = shapeParameters[entry][position]
-            # hack to see what happens if we sum up all clusters
-            # e_cl[entry] = np.sum(e_clusters[entry])
-
-            # keep only clusters in given energy range
-            if e_cl[entry] < emin or e_cl[entry] > emax:
-                keep[entry] = 0
-
-            # drop events with poorly reconstructed e_true/e_cl (not in 0.4..1.7)
-            if e_cl[entry] / p_part[entry] < 0.3 or e_cl[entry] / p_part[entry] > 1.7:
-                keep[entry] = 0
+    hasCluster = ak.to_numpy(ak.num(e_clusters, axis=1) > 0)
+    for entry in np.flatnonzero(~hasCluster):
+        print('No clusters found for event %d, p=%f, skipping' % (entry, p_part[entry]))
+    icl = ak.argmax(e_clusters, axis=1, keepdims=True)
+
+    def leading(values):
+        return ak.to_numpy(ak.fill_none(ak.firsts(values[icl]), 0)).astype(np.float64)
+
+    e_cl = leading(e_clusters)
+    x_cl = leading(x_clusters)
+    y_cl = leading(y_clusters)
+    z_cl = leading(z_clusters)
+    # hack to see what happens if we sum up all clusters
+    # e_cl = ak.to_numpy(ak.sum(e_clusters, axis=1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r_cl = np.sqrt(x_cl**2 + y_cl**2 + z_cl**2)
+        theta_cl = np.arccos(z_cl / r_cl)
+    phi_cl = np.arctan2(y_cl, x_cl)
+
+    # energy fractions: shape parameters of the leading cluster, gathered from the
+    # flattened shapeParameters of the batch (parBegin is relative to the event)
+    eventOffsets = np.zeros(len(hasCluster), dtype=np.int64)
+    np.cumsum(ak.to_numpy(ak.num(shapeParameters, axis=1))[:-1], out=eventOffsets[1:])
+    flatShapeParameters = ak.to_numpy(ak.flatten(shapeParameters))
+    begin = ak.to_numpy(ak.fill_none(ak.firsts(parBegin[icl]), 0)).astype(np.int64)
+    positions = (eventOffsets + begin)[hasCluster][np.newaxis, :] + np.asarray(inputFeaturePositions, dtype=np.int64)[:, np.newaxis]
+    efrac_layers = np.zeros((nLayers, len(hasCluster)))
+    efrac_layers[:, hasCluster] = flatShapeParameters[positions]
+
+    # keep only events with clusters, clusters in given energy range, and
+    # drop events with poorly reconstructed e_true/e_cl (not in 0.3..1.7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = e_cl / p_part
+    keep = hasCluster & ~(e_cl < emin) & ~(e_cl > emax) & ~(ratio < 0.3) & ~(ratio > 1.7)
 
     # remove events without clusters
     p_part = p_part[keep]
     e_cl = e_cl[keep]
-    for i in range(nLayers):
-        efrac_cl[i] = (efrac_cl[i])[keep]
+    efrac_cl = efrac_layers[:, keep]
     theta_cl = theta_cl[keep]
     phi_cl = phi_cl[keep]
 
@@ -387,6 +388,28 @@ def fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions)
 # -------------------------------------------------------------------------------------------
 
 
+# read all the events of one file and return the selected particle momenta and cluster
+# features, as fillVectorsFromROOTBranches (used by the worker processes with usechain)
+
+def readFeaturesFromFile(filename, clusters, emin, emax, nLayers, inputFeaturePositions, stepSize="2 GB"):
+    batches = []
+    for arr in uproot.iterate([filename + ":" + treeName],
+                              branchesToRead(clusters), step_size=stepSize, library="ak"):
+        batches.append(fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions, clusters))
+        del arr
+    return concatenateBatches(batches)
+
+
+def concatenateBatches(batches):
+    return (np.concatenate([batch[0] for batch in batches]),
+            np.concatenate([batch[1] for batch in batches]),
+            np.concatenate([batch[2] for batch in batches], axis=1),
+            np.concatenate([batch[3] for batch in batches]),
+            np.concatenate([batch[4] for batch in batches]))
+
+# -------------------------------------------------------------------------------------------
+
+
 # function to read an input file and fill a pandas dataframe with the relevant information
 
 def readROOTFileIntoPandas(inputfile, clusters, emin, emax, nLayers):
@@ -427,30 +450,32 @@ def readROOTFileIntoPandas(inputfile, clusters, emin, emax, nLayers):
     print("All input features found in metadata, in positions:", inputFeaturePositions)
 
     # open root file and read events tree
+    # the selected events of each batch (or file) are collected in lists, and concatenated once at the end
     print("Reading events from ROOT file(s)", filepath)
     if not usechain:
         afile = uproot.open(filepath)
         events = afile[treeName]
-        arr = events.arrays(branchesToRead(clusters), library='np')
-        p_part, e_cl, efrac_cl, theta_cl, phi_cl = fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions)
+        arr = events.arrays(branchesToRead(clusters), library='ak')
+        batches = [fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions, clusters)]
     else:
-        p_part = np.array([])
-        e_cl = np.array([])
-        theta_cl = np.array([])
-        phi_cl = np.array([])
-        efrac_cl = []
-        for layer in range(nLayers):
-            efrac_cl.append(np.array([]))
-
-        for arr in tqdm(uproot.iterate([filepath + ":" + treeName],
-                                       branchesToRead(clusters), step_size="2 GB", library="np")):
-            p_part_batch, e_cl_batch, efrac_cl_batch, theta_cl_batch, phi_cl_batch = fillVectorsFromROOTBranches(arr, emin, emax, nLayers, inputFeaturePositions)
-            p_part = np.concatenate([p_part, p_part_batch])
-            e_cl = np.concatenate([e_cl, e_cl_batch])
-            theta_cl = np.concatenate([theta_cl, theta_cl_batch])
-            phi_cl = np.concatenate([phi_cl, phi_cl_batch])
-            for layer in range(nLayers):
-                efrac_cl[layer] = np.concatenate([efrac_cl[layer], efrac_cl_batch[layer]])
+        # files read in parallel, results collected in the order of the (sorted) file names
+        fileList = sorted(fileList)
+        nWorkers = min(nReadWorkers if nReadWorkers > 0 else min(8, os.cpu_count() or 1), len(fileList))
+        # the processes share the memory budget of the batches, so that the peak memory does not grow with their number
+        stepSize = f"{max(readStepSizeMB // nWorkers, 100)} MB"
+        print(f"Reading {len(fileList)} files with {nWorkers} processes, batches of {stepSize}")
+        if nWorkers > 1:
+            # not forked: the parent may already run threads (LightGBM/OpenMP, matplotlib) after a first training
+            context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None)
+            with ProcessPoolExecutor(max_workers=nWorkers, mp_context=context) as executor:
+                batches = list(tqdm(executor.map(readFeaturesFromFile, fileList, repeat(clusters), repeat(emin), repeat(emax),
+                                                 repeat(nLayers), repeat(inputFeaturePositions), repeat(stepSize)),
+                                    total=len(fileList)))
+        else:
+            batches = [readFeaturesFromFile(f, clusters, emin, emax, nLayers, inputFeaturePositions, stepSize) for f in tqdm(fileList)]
+
+    p_part, e_cl, efrac_layers, theta_cl, phi_cl = concatenateBatches(batches)
+    del batches
 
     print('Total number of events selected:', len(p_part))
     print('')
@@ -459,8 +484,7 @@ def readROOTFileIntoPandas(inputfile, clusters, emin, emax, nLayers):
     # - energy fractions
     # - possibly extra features related to cluster position
     # - total cluster energy
-    efrac_layers = np.array([efrac_cl[i] for i in range(nLayers)])
-    inputs = [efrac_layers]
+    inputs = list(efrac_layers)
     if useExtraFeatures:
         theta_cl_mod_calo = theta_cl / deltaThetaCalo % 1
         phi_cl_mod_calo = phi_cl / deltaPhiCalo % 1
@@ -483,21 +507,82 @@ def readROOTFileIntoPandas(inputfile, clusters, emin, emax, nLayers):
             inputs.extend([long_barycenter, long_rms])
 
     inputs.append(e_cl)
-    features = np.vstack(inputs)
 
     # calculate target
     if targetUsesLog:
         target = np.log(p_part / e_cl)
     else:
         target = p_part / e_cl
+    inputs.append(target)
+
+    # combine into a single float32 array, one column per feature (and target in the last one),
+    # and wrap it into a pandas dataframe (with default index)
+    data = np.empty((len(p_part), len(inputs)), dtype=np.float32, order="F")
+    for i, column in enumerate(inputs):
+        data[:, i] = column
+    df = pd.DataFrame(data=data,
+                      columns=['f' + str(i) for i in range(data.shape[1])],
+                      copy=False)
+    return df
 
+# -------------------------------------------------------------------------------------------
+
+
+# on-disk cache of the features and target read from the ROOT files: one feather (Arrow IPC)
+# file per cluster collection and input sample, whose name contains a hash of everything
+# the features depend on (input files, branches, feature settings, energy window), so that
+# a change of any of them triggers the reading of the ROOT files again
+# (the positions of the layer energy fractions among the shape parameters come from the
+# metadata of the same files). Bump featureCacheVersion whenever the code that builds the
+# features or the target changes, so that the files cached by older versions are not used
+
+featureCacheVersion = 2
+
+
+def featureCacheKey(inputfile, clusters, emin, emax, nLayers):
+    filepath = os.path.abspath(inputFiles[inputfile]["basedir"]) + "/" + inputFiles[inputfile]["filename"]
+    # the input files are identified by their path, size and modification time
+    files = []
+    for f in sorted(glob.glob(filepath)):
+        stat = os.stat(f)
+        files.append([f, stat.st_size, stat.st_mtime_ns])
+    config = {
+        "version": featureCacheVersion,
+        "files": files,
+        "branches": branchesToRead(clusters),
+        "clusters": clusters,
+        "nLayers": nLayers,
+        "emin": emin,
+        "emax": emax,
+        "useExtraFeatures": useExtraFeatures,
+        "useLongitudinalVars": useLongitudinalVars,
+        "targetUsesLog": targetUsesLog,
+        "deltaThetaCalo": deltaThetaCalo,
+        "deltaPhiCalo": deltaPhiCalo,
+    }
+    key = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+    return key, config
+
+
+def featureCacheFile(inputfile, clusters, key):
+    return os.path.join(os.path.abspath(featureCacheDir), clusters, f"{inputfile}_{key}.feather")
+
+
+def readFeaturesFromCache(filename):
+    # memory-mapped, the columns of the dataframe point to the file if it is not compressed
+    table = feather.read_table(filename, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def writeFeaturesToCache(df, filename, config):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({"config": json.dumps(config)})
+    # write to a temporary file first so that an interrupted job never leaves a partial file
+    tmpFile = f"{filename}.{os.getpid()}.tmp"
+    feather.write_feather(table, tmpFile, compression=featureCacheCompression)
+    os.replace(tmpFile, filename)
 
-    # combine and import into pandas dataframe
-    data = np.vstack((features, target.transpose())).transpose()
-    df = pd.DataFrame(data=data[0:, 0:],
-                      index=[i for i in range(data.shape[0])],
-                      columns=['f' + str(i) for i in range(data.shape[1])])
-    return df
 
 # -------------------------------------------------------------------------------------------
 
@@ -514,9 +599,23 @@ def train(clusters='EMBCaloClusters', emin=0, emax=1000, optimise=False, optType
     if readInputsFromROOT:
         df_list = []
         for i, inputFile in enumerate(inputFiles):
-            # read info about clustering from metadata (and log)
-            getClusterInfo(inputFile, clusters)
-            df = readROOTFileIntoPandas(inputFile, clusters, emin, emax, nLayers)
+            df = None
+            if useFeatureCache:
+                key, config = featureCacheKey(inputFile, clusters, emin, emax, nLayers)
+                cacheFile = featureCacheFile(inputFile, clusters, key)
+                if os.path.isfile(cacheFile):
+                    print("Loading input features and target of sample", inputFile, "from cache", cacheFile)
+                    df = readFeaturesFromCache(cacheFile)
+            if df is None:
+                # read info about clustering from metadata (and log)
+                getClusterInfo(inputFile, clusters)
+                df = readROOTFileIntoPandas(inputFile, clusters, emin, emax, nLayers)
+                if useFeatureCache:
+                    try:
+                        writeFeaturesToCache(df, cacheFile, config)
+                        print("Input features and target of sample", inputFile, "cached in", cacheFile)
+                    except OSError as e:
+                        print("WARNING: cannot write the feature cache", cacheFile, ":", e)
             df_list.append(df)
         df = pd.concat(df_list, ignore_index=True)
         # save the dataframe for later use
@@ -801,10 +900,12 @@ def train(clusters='EMBCaloClusters', emin=0, emax=1000, optimise=False, optType
 
 
 # training
-for clusters in clusterCollections:
-    nLayers = 0
-    if clusters[0:3] == "EMB":
-        nLayers = 11
-    elif clusters[0:4] == "EMEC":
-        nLayers = 98
-    train(clusters, 0, 1000, False, '', nLayers)
+# (guarded, since the processes reading the input files import this module)
+if __name__ == "__main__":
+    for clusters in clusterCollections:
+        nLayers = 0
+        if clusters[0:3] == "EMB":
+            nLayers = 11
+        elif clusters[0:4] == "EMEC":
+            nLayers = 98
+        train(clusters, 0, 1000, False, '', nLayers)
@@ -1,9 +1,10 @@
 import ROOT
 import math
-import dd4hep
 import os
 import sys
 import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
+from geometrySnapshot import loadSnapshot
 
 
 parser = argparse.ArgumentParser()
@@ -18,8 +19,8 @@ if not os.path.isfile(detectorFile):
     print(f"Error: compact file '{detectorFile}' does not exist.", file=sys.stderr)
     sys.exit(1)
 
-detector = dd4hep.Detector.getInstance()
-detector.fromXML(detectorFile)
+# constants from the geometry snapshot (the compact file is only parsed if it changed)
+detector = loadSnapshot(detectorFile)
 
 n_wheels = detector.constantAsLong("EMECnWheels")
 blade_angles = [ detector.constantAsDouble("EMECBladeAngle1"),
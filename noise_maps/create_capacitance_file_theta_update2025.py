@@ -2,7 +2,16 @@
 # output is saved in ROOT file with given filename
 #
 # execute script with
-# python create_capacitance_file_theta_CERN_PCBv2_fix_capadensities.py
+# python create_capacitance_file_theta_update2025.py
+# or, with another merging of the cells (one value for all the layers or one value per layer)
+# python create_capacitance_file_theta_update2025.py --merged-modules 2 --merged-theta-cells 4 1 4 4 4 4 4 4 4 4 4
+#
+# the capacitances can also be computed from python, as arrays [layer, theta]:
+#   from create_capacitance_file_theta_update2025 import computeCapacitances
+#   capa = computeCapacitances(nMergedModules=[1]*11)
+#   capa["trace"], capa["shield"], capa["detector"]
+# several merging strategies can be evaluated at once by giving 2D lists [strategy, layer]
+# for nMergedModules and/or nMergedThetaCells, the results are then arrays [strategy, layer, theta]
 #
 # Updated from the previous verion by Juska in November 2025
 #
@@ -10,14 +19,9 @@
 # shields-per-pad count is fixed and (soon) dielectric between signal pad and absorber
 # is taken into account in the detector capacitance calculation
 
-
-from ROOT import TH1F, TF1, TF2, TCanvas, TLegend, TFile, gStyle
-import ROOT
-from math import ceil, sin, cos, log, tan, pi, sqrt, asin, degrees
-
-ROOT.gROOT.SetBatch(ROOT.kTRUE)
-
-gStyle.SetPadTickY(1)
+import argparse
+import numpy as np
+from math import ceil, pi
 
 debug = False
 verbose = True
@@ -127,23 +131,6 @@ hm = 0.3
 pcbThickness = 5 * t + 2 * tsh + 2 * hhv + 2 * hs + 2 * hm  # mm #JP updated also this equation
                                                                  # Resulting 1.31 mm matches measurement well
 
-if verbose:
-    print("minTheta =", minTheta)
-    print("maxTheta =", maxTheta)
-    print("numTheta =", numTheta)
-    print("Nplanes =", Nplanes)
-    print("rmin = %f mm" % rmin)
-    print("activeTotal = %f mm" % activeTotal)
-    print("readoutLayerRadialLengths (in cm) =", readoutLayerRadialLengths)
-    print("inclination (deg) =", inclination_degree)
-    print("inclinedTotal = %f mm" % inclinedTotal)
-    print("passiveThickness = %f mm" % passiveThickness)
-    print("number of layers =", numLayers)
-    print("merged cells in theta =", nMergedThetaCells)
-    print("merged modules =", nMergedModules)
-    print("traces per layer =", tracesPerLayer)
-    print("pcbThickness: %f mm" % pcbThickness)
-
 # constants:
 # distance from signal trace to shield (HS) - from impedance vs. trace width vs. distance to ground layer 2D plot (Z = 50 Ohm)
 # trace width (W) - min value
@@ -168,9 +155,6 @@ capa_per_mm[stripLayer] = 0# 0.0575*2 #JP See justification above
 
 stripLineCapaDensity = 0.1868 # Measured from PCBv2 T3 cell 1
 
-if verbose:
-    print("capa_per_mm (pF/mm) = " , capa_per_mm)
-
 # multiplicative factors
 # for the trace, factor 2 because we have two HV plate / absorber capa per cell
 nmultTrace = 2 #FIXME JP I already doubled the capa density but still now get a correct value. To be understood.
@@ -181,269 +165,332 @@ epsilonRLAr = 1.5  # LAr at 88 K #TODO Double-check from Martin's ATLAS source
 epsilon0 = 8.854 / 1000.  # pF/mm
 
 
-# Fill the layer length, trace length, etc
-readoutLayerParallelLengths = []
-real_radial_separation = [rmin]
-real_radial_depth = []
-inclinations_wrt_radial_dir_at_middleRadialDepth = []
-trace_length = []
-numLayers = len(readoutLayerRadialLengths)
-
-
-dilution_factor = inclinedTotal / activeTotal # Dilution factor takes care of capa decrease due to gap widening (right?)
-trace_length_inner = 0
-trace_length_outer = 0
-
-outer = False
-current_electrode_length = 0
-
-for idx in range(numLayers):  # first pass to get all length parallel to the readout, real radial separation, inclination at the middle of the layer
 
-    readoutLayerRadialLengths[idx] *= 10 # change from cm to mm
+# ================================
+# Geometry of the layers
+# ================================
+def layerGeometry(radialLengths=readoutLayerRadialLengths, traces=tracesPerLayer):
+    """Lengths (mm) and inclination (rad) of the readout layers, arrays [layer]
+    (real_radial_separation has one more entry: the radii of the layer boundaries)"""
+    radialLengths = np.asarray(radialLengths, dtype=np.float64) * 10  # change from cm to mm
+    nLayers = len(radialLengths)
 
-    parallel_length = readoutLayerRadialLengths[idx] * dilution_factor
+    dilution_factor = inclinedTotal / activeTotal # Dilution factor takes care of capa decrease due to gap widening (right?)
 
     # Tricky point: in the xml geo, you define 'radial'segmentation, but these depths will be the one parallel to the plates after scaling by the dilution factor --> even when setting constant radial depth, the geometry builder will make constant parallel length step, not constant radial steps
+    parallel_lengths = radialLengths * dilution_factor
 
-    readoutLayerParallelLengths.append(parallel_length)
-    if outer:  # prepare the starting trace length when starting to extract by the back of the PCB
-        trace_length_outer += parallel_length
-    if tracesPerLayer[idx] == 0 and tracesPerLayer[idx - 1] == 0:
-        outer = True
     # sqrt(r**2+(L1+i*L2)**2+2*r*(L1+i*L2)*cos(alpha)) where L1 = 2.68, L2=12.09, r=192, alpha=50)
-    current_electrode_length += parallel_length
-    real_radial_separation.append(sqrt(rmin * rmin + current_electrode_length * current_electrode_length + 2 * rmin * current_electrode_length * cos(angle)))
-    real_radial_depth.append(real_radial_separation[idx + 1] - real_radial_separation[idx])
+    electrode_length = np.concatenate([[0.], np.cumsum(parallel_lengths)])
+    real_radial_separation = np.sqrt(rmin * rmin + electrode_length * electrode_length + 2 * rmin * electrode_length * np.cos(angle))
+    real_radial_depth = np.diff(real_radial_separation)
     # treating the fact that radial angle decreases when radial depth increase
     # angle comprise by lines from  1) Interaction point to inner right edge of a cell, 2) Interaction point to outer left edge of the considered cell (useful to get the plate angle with radial direction that changes with increasing R)
     # based on scalene triangle sine law A/sin(a) = B/sin(b) = C/sin(c) (outer left edge aligned on the Y axis)
-    inclinations_wrt_radial_dir_at_middleRadialDepth.append(asin(rmin * sin(angle) / (real_radial_separation[idx] + ((real_radial_separation[idx + 1] - real_radial_separation[idx]) / 2))))
-
-
-# second pass to get trace lengths
-outer = False
-for idx in range(numLayers):
-    if tracesPerLayer[idx] == 0 and tracesPerLayer[idx - 1] == 0:  # we change direction
-        outer = True
-    if outer:
-        trace_length.append(trace_length_outer)
-        if idx == numLayers - 1:
-            trace_length_outer == 0
-            continue
-        trace_length_outer -= readoutLayerParallelLengths[idx + 1]
-    else:
-        trace_length.append(trace_length_inner)
-        trace_length_inner += readoutLayerParallelLengths[idx]
-
-#JP The signal trace lengths are now the wrong way around in the array.
-# (this did not have impact when transferline capa was neglected)
-# Let's invert it and it should be fine for the capacitance calculation.
-trace_length.reverse()
-
-print('Readout radial lengths originally asked: ', readoutLayerRadialLengths)
-print('Readout parallel lengths: ', readoutLayerParallelLengths)
-print("Real radial separation: ", real_radial_separation)
-print("Real radial depth: ", real_radial_depth)
-print("inclinations_wrt_radial_dir_at_middleRadialDepth: ", [degrees(inclinations) for inclinations in inclinations_wrt_radial_dir_at_middleRadialDepth])
-print("Signal trace length per layer: ", trace_length)
-
-
-gStyle.SetOptStat(0)
-
-cImpedance = TCanvas("cImpedance", "", 600, 800)
-cImpedance.Divide(1, 2)
-cImpedance.cd(1)
-fImpedance = TF2("fImpedance", "60/sqrt([0])*log(1.9*(2*x+[1])/(0.8*y+[1]))", 0.04, 0.2, 0.04, 0.2)
-fImpedance.SetTitle("Impedance vs trace width and distance to ground")
-fImpedance.SetParameters(epsilonR, t)
-fImpedance.Draw("colz")
-fImpedance.GetXaxis().SetTitle("Distance to ground [mm]")
-fImpedance.GetYaxis().SetTitle("Trace width [mm]")
-cImpedance.cd(2)
-fImpedance1D = TF1("fImpedance1D", "60/sqrt([0])*log(1.9*(2*x+[1])/(0.8*[2]+[1]))", 0.04, 0.2)
-fImpedance1D.SetTitle("Impedance vs distance to ground")
-fImpedance1D.SetParameters(epsilonR, t, w)
-fImpedance1D.Draw()
-fImpedance1D.GetXaxis().SetTitle("Distance to ground [mm]")
-fImpedance1D.GetYaxis().SetTitle("Impedance [#Omega]")
-
-# prepare the TH1
-hCapTrace = []
-hCapShield = []
-hCapDetector = []
-line_color_number = 1
-line_style_number = 1
-for i in range(0, len(readoutLayerRadialLengths)):
-    if line_color_number == 8:
-        line_color_number = 22
-    if line_style_number == 8:
-        line_style_number = 1
-    # traces
-    hCapTrace.append(TH1F())
-    hCapTrace[i].SetBins(numTheta, minTheta, maxTheta)
-    hCapTrace[i].SetLineColor(line_color_number)
-    hCapTrace[i].SetLineStyle(line_style_number)
-    hCapTrace[i].SetLineWidth(2)
-    hCapTrace[i].SetTitle("Stripline capacitance; #theta; Capacitance [pF]")
-    hCapTrace[i].SetName("hCapacitance_traces"+str(i))
-    # shields
-    hCapShield.append(TH1F())
-    hCapShield[i].SetBins(numTheta, minTheta, maxTheta)
-    hCapShield[i].SetLineColor(line_color_number)
-    hCapShield[i].SetLineStyle(line_style_number)
-    hCapShield[i].SetLineWidth(2)
-    hCapShield[i].SetTitle("Signal pads - ground shields capacitance; #theta; Capacitance [pF]")
-    hCapShield[i].SetName("hCapacitance_shields"+str(i))
-    # area
-    hCapDetector.append(TH1F())
-    hCapDetector[i].SetBins(numTheta, minTheta, maxTheta)
-    hCapDetector[i].SetLineColor(line_color_number)
-    hCapDetector[i].SetLineStyle(line_style_number)
-    hCapDetector[i].SetLineWidth(2)
-    hCapDetector[i].SetTitle("Signal pad - absorber capacitance; #theta; Capacitance [pF]")
-    hCapDetector[i].SetName("hCapacitance_detector"+str(i))
-    if line_color_number > 8:
-        line_color_number += 10
-    else:
-        line_color_number += 1
-    line_style_number += 1
-
-cTrace = TCanvas("cTrace", "", 600, 400)
-cShield = TCanvas("cShield", "", 600, 400)
-cDetector = TCanvas("cDetector", "", 600, 400)
-
-legend = TLegend(0.1, 0.693, 0.8, 0.9)
-legend.SetHeader("Longitudinal layers")
-legend.SetNColumns(4)
-capa_shield_max = 0
-capa_det_max = 0
-cellcapas = []
-for i in range(0, len(readoutLayerParallelLengths)):
-    print("--------------")
-    for index in range(0, numTheta):
-        theta = minTheta + index * deltaTheta
-        thetaNext = minTheta + (index + 1) * deltaTheta
-        eta = -log(tan(theta / 2.0))
-        deltaEta = abs(-log(tan((minTheta + (index + 1) * deltaTheta) / 2.0)) - eta)
-        if (debug):
-            print("theta = ", theta)
-            print("eta = ", eta)
-            print("delta eta = ", deltaEta)
-
-        # take into account the inclination in theta
-        traceLength = trace_length[i] / sin(theta)
-        # print("Layer %d trace length %f"%(i+1, traceLength))
-        # Trace capacitance (stripline) - not used since already accounted for elsewhere
-        logStripline = log(3.1 * hs / (0.8 * w + t))
-        # analytical formula
-        #capacitanceTrace = nmultTrace * 1 / inch2mm * 1.41 * epsilonR / logStripline * traceLength
-
-        #JP calculate with value from measurement instead; analytical formula has assumptions that are not fulfilled
-        capacitanceTrace = nmultTrace*stripLineCapaDensity*traceLength
-
-        hCapTrace[i].SetBinContent(index + 1, capacitanceTrace)
-
-        # Shield capacitance (microstrip)
-        cellLength = readoutLayerParallelLengths[i] / sin(theta)
-        logMicrostrip = log(5.98 * hm / (0.8 * ws + t))
-        # analytical formula (nmultShield = 2)
-        # capacitanceShield = nmultShield * nMergedModules[i] * cellLength * tracesPerLayer[i] * 1 / inch2mm * 0.67 * (epsilonR + 1.41) / logMicrostrip
-        # from maxwell (nmultShield = 1)
-        # dont multiply by nMergedThetaCells:  the shield/pad capa is reasonably independent of the cell size and the fact that there is some merging
-        # done for theta cells is already taken into account by the tracesPerLayer
-        capacitanceShield = nmultShield * nMergedModules[i] * cellLength * tracesPerLayer[i] * capa_per_mm[i]
-        if capacitanceShield > capa_shield_max:
-            capa_shield_max = capacitanceShield
-        hCapShield[i].SetBinContent(index + 1, capacitanceShield)
-
-        # Detector area (C = epsilon*A/d)
-        # area = ( radius[i] * ( 1 / (tan(2. * atan(exp(- (index + 1) * deltaEta)))) -  1 / (tan(2. * atan(exp(- index * deltaEta))) ) )
-        #         + radius[i + 1] * ( 1 / (tan(2. * atan(exp(- (index + 1) * deltaEta)))) -  1 / (tan(2. * atan(exp(- index * deltaEta))) ) )
-        #         ) / 2. * (radius[i+1] - radius[i])
-        # distance = (radius[i+1] + radius[i]) / 2. * pi / Nplanes * cos (angle) - pcbThickness / 2. - passiveThickness / 2.
-
-        # Detector area (C = epsilon*A/d)
-        area = abs(real_radial_separation[i] * (1 / tan(thetaNext) - 1 / tan(theta)) + real_radial_separation[i + 1] * (1 / tan(thetaNext) - 1 / tan(theta))
-                 ) / 2. * (real_radial_separation[i+1] - real_radial_separation[i])
-
-        # get the cell size perpendicular to the plate direction from the cell size on the circle at given radius and the inclination w.r.t. radial dir, then remove the PCB and lead thickness (no need for any factor here because we are perpendicular to the PCB and lead plates) --> gives the LAr gap size perpendicular
-        distance = (2 * pi * (real_radial_separation[i+1] + real_radial_separation[i]) / 2. / Nplanes * cos (inclinations_wrt_radial_dir_at_middleRadialDepth[i]) - pcbThickness - passiveThickness) / 2. # divided by two because two lar gap per cell
-        distance += hhv  # the capa is between signal plate and absorber --> need to add distance between HV plate and signal pad
-        distance += t  # the capa is between signal plate and absorber --> need to add distance between HV plate and signal pad
-        if (abs(theta - pi / 2.) < 1e-4):
-            print("LAr gap size (perpendicular) + hhv + t: %f mm" % distance)
-        #capacitanceDetector = nMergedModules[i] * nMergedThetaCells[i] * 2 * epsilon0 * epsilonRLAr * area / distance  # factor 2 is because there are 2 LAr gaps for each cell
-        #JP Updated to include the effect of 100um dielectric layer
-        capacitanceDetector = ( nMergedModules[i] * nMergedThetaCells[i] * 2 * epsilon0 * epsilonRLAr * epsilonR * area ) / ( (distance-hhv)*epsilonR + hhv*epsilonRLAr )
-        # (this is the equation for the two-dielectric sandwitch capacitors, equivalent to two capacitors in series)
-
-        hCapDetector[i].SetBinContent(index + 1, capacitanceDetector)
-        if capacitanceDetector > capa_det_max:
-            capa_det_max = capacitanceDetector
-        if (abs(theta - pi / 2.) < 1e-4):
-            print("layer %d" % (i + 1), "theta=%f" % theta, ": capacitanceTrace: %.0f pF," % capacitanceTrace, "capacitanceShield: %.0f pF," % capacitanceShield, "capacitanceDetector: %.0f pF," %capacitanceDetector, "total/2: %.0f pF" % ((capacitanceTrace + capacitanceShield + capacitanceDetector)/2.))
-            # , "distance %.1f mm" %distance
+    inclinations = np.arcsin(rmin * np.sin(angle) / (real_radial_separation[:-1] + real_radial_depth / 2))
+
+    # trace lengths: extracted by the front of the PCB until two consecutive layers without trace,
+    # then by the back
+    trace_length_inner = 0
+    trace_length_outer = 0
+    outer = False
+    for idx in range(nLayers):  # prepare the starting trace length when starting to extract by the back of the PCB
+        if outer:
+            trace_length_outer += parallel_lengths[idx]
+        if traces[idx] == 0 and traces[idx - 1] == 0:
+            outer = True
+    trace_length = []
+    outer = False
+    for idx in range(nLayers):
+        if traces[idx] == 0 and traces[idx - 1] == 0:  # we change direction
+            outer = True
+        if outer:
+            trace_length.append(trace_length_outer)
+            if idx == nLayers - 1:
+                continue
+            trace_length_outer -= parallel_lengths[idx + 1]
+        else:
+            trace_length.append(trace_length_inner)
+            trace_length_inner += parallel_lengths[idx]
+
+    #JP The signal trace lengths are now the wrong way around in the array.
+    # (this did not have impact when transferline capa was neglected)
+    # Let's invert it and it should be fine for the capacitance calculation.
+    trace_length.reverse()
+
+    return {
+        "radial_lengths": radialLengths,
+        "parallel_lengths": parallel_lengths,
+        "real_radial_separation": real_radial_separation,
+        "real_radial_depth": real_radial_depth,
+        "inclinations": inclinations,
+        "trace_length": np.array(trace_length),
+    }
+
+
+def thetaBins():
+    """Lower edges of the theta bins"""
+    return minTheta + np.arange(numTheta) * deltaTheta
+
+
+# ================================
+# Capacitances
+# ================================
+def computeCapacitances(nMergedModules=nMergedModules, nMergedThetaCells=nMergedThetaCells, geometry=None):
+    """Trace, shield and detector capacitances (pF) of all the cells, arrays [layer, theta].
+    nMergedModules and nMergedThetaCells have one entry per layer, or shape [strategy, layer]
+    to evaluate several merging strategies at once (results [strategy, layer, theta])"""
+    if geometry is None:
+        geometry = layerGeometry()
+    # per-layer quantities as column vectors [layer, 1], broadcasting against theta
+    mergedModules = np.asarray(nMergedModules, dtype=np.float64)[..., np.newaxis]
+    mergedThetaCells = np.asarray(nMergedThetaCells, dtype=np.float64)[..., np.newaxis]
+    traceLength = geometry["trace_length"][:, np.newaxis]
+    parallelLength = geometry["parallel_lengths"][:, np.newaxis]
+    rInner = geometry["real_radial_separation"][:-1, np.newaxis]
+    rOuter = geometry["real_radial_separation"][1:, np.newaxis]
+    inclination = geometry["inclinations"][:, np.newaxis]
+    traces = np.asarray(tracesPerLayer, dtype=np.float64)[:, np.newaxis]
+    capaPerMm = np.asarray(capa_per_mm, dtype=np.float64)[:, np.newaxis]
+
+    theta = thetaBins()
+    thetaNext = theta + deltaTheta
+    sinTheta = np.sin(theta)
+
+    # Trace capacitance (stripline)
+    # take into account the inclination in theta
+    # analytical formula (not used, its assumptions are not fulfilled):
+    #   logStripline = log(3.1 * hs / (0.8 * w + t))
+    #   capacitanceTrace = nmultTrace * 1 / inch2mm * 1.41 * epsilonR / logStripline * traceLength
+    #JP calculate with value from measurement instead; analytical formula has assumptions that are not fulfilled
+    capacitanceTrace = nmultTrace * stripLineCapaDensity * traceLength / sinTheta
+
+    # Shield capacitance (microstrip)
+    cellLength = parallelLength / sinTheta
+    # analytical formula (nmultShield = 2)
+    #   logMicrostrip = log(5.98 * hm / (0.8 * ws + t))
+    #   capacitanceShield = nmultShield * nMergedModules[i] * cellLength * tracesPerLayer[i] * 1 / inch2mm * 0.67 * (epsilonR + 1.41) / logMicrostrip
+    # from maxwell (nmultShield = 1)
+    # dont multiply by nMergedThetaCells:  the shield/pad capa is reasonably independent of the cell size and the fact that there is some merging
+    # done for theta cells is already taken into account by the tracesPerLayer
+    capacitanceShield = nmultShield * mergedModules * cellLength * traces * capaPerMm
+
+    # Detector area (C = epsilon*A/d)
+    area = np.abs(rInner * (1 / np.tan(thetaNext) - 1 / np.tan(theta)) + rOuter * (1 / np.tan(thetaNext) - 1 / np.tan(theta))
+                  ) / 2. * (rOuter - rInner)
+
+    # get the cell size perpendicular to the plate direction from the cell size on the circle at given radius and the inclination w.r.t. radial dir, then remove the PCB and lead thickness (no need for any factor here because we are perpendicular to the PCB and lead plates) --> gives the LAr gap size perpendicular
+    distance = (2 * pi * (rOuter + rInner) / 2. / Nplanes * np.cos(inclination) - pcbThickness - passiveThickness) / 2. # divided by two because two lar gap per cell
+    distance += hhv  # the capa is between signal plate and absorber --> need to add distance between HV plate and signal pad
+    distance += t  # the capa is between signal plate and absorber --> need to add distance between HV plate and signal pad
+    #JP Updated to include the effect of 100um dielectric layer
+    # factor 2 is because there are 2 LAr gaps for each cell
+    capacitanceDetector = ( mergedModules * mergedThetaCells * 2 * epsilon0 * epsilonRLAr * epsilonR * area ) / ( (distance-hhv)*epsilonR + hhv*epsilonRLAr )
+    # (this is the equation for the two-dielectric sandwitch capacitors, equivalent to two capacitors in series)
+
+    shape = np.broadcast_shapes(capacitanceTrace.shape, capacitanceShield.shape, capacitanceDetector.shape)
+    return {
+        "theta": theta,
+        "trace": np.broadcast_to(capacitanceTrace, shape),
+        "shield": np.broadcast_to(capacitanceShield, shape),
+        "detector": np.broadcast_to(capacitanceDetector, shape),
+        "gap": distance[:, 0],
+    }
+
+
+def perLayer(parser, values, name):
+    """One value per layer from a command line list of one or numLayers values"""
+    if len(values) == 1:
+        return values * numLayers
+    if len(values) != numLayers:
+        parser.error(f"{name}: expected 1 or {numLayers} values, got {len(values)}")
+    return values
+
+
+# ================================
+# Histograms
+# ================================
+def main():
+    parser = argparse.ArgumentParser(description="Compute the capacitances of the ECal barrel cells vs theta")
+    parser.add_argument("--merged-modules", type=int, nargs="+", default=nMergedModules,
+                        help="Number of merged modules (one value for all the layers or one per layer)")
+    parser.add_argument("--merged-theta-cells", type=int, nargs="+", default=nMergedThetaCells,
+                        help="Number of merged theta cells (one value for all the layers or one per layer)")
+    parser.add_argument("--output", type=str, default=filename, help="Output ROOT file")
+    args = parser.parse_args()
+
+    mergedModules = perLayer(parser, args.merged_modules, "--merged-modules")
+    mergedThetaCells = perLayer(parser, args.merged_theta_cells, "--merged-theta-cells")
+
+    from ROOT import TH1F, TF1, TF2, TCanvas, TLegend, TFile, gStyle
+    import ROOT
+
+    ROOT.gROOT.SetBatch(ROOT.kTRUE)
+
+    gStyle.SetPadTickY(1)
+
+    if verbose:
+        print("minTheta =", minTheta)
+        print("maxTheta =", maxTheta)
+        print("numTheta =", numTheta)
+        print("Nplanes =", Nplanes)
+        print("rmin = %f mm" % rmin)
+        print("activeTotal = %f mm" % activeTotal)
+        print("readoutLayerRadialLengths (in cm) =", readoutLayerRadialLengths)
+        print("inclination (deg) =", inclination_degree)
+        print("inclinedTotal = %f mm" % inclinedTotal)
+        print("passiveThickness = %f mm" % passiveThickness)
+        print("number of layers =", numLayers)
+        print("merged cells in theta =", mergedThetaCells)
+        print("merged modules =", mergedModules)
+        print("traces per layer =", tracesPerLayer)
+        print("pcbThickness: %f mm" % pcbThickness)
+        print("capa_per_mm (pF/mm) = " , capa_per_mm)
+
+    geometry = layerGeometry()
+    print('Readout radial lengths originally asked: ', geometry["radial_lengths"].tolist())
+    print('Readout parallel lengths: ', geometry["parallel_lengths"].tolist())
+    print("Real radial separation: ", geometry["real_radial_separation"].tolist())
+    print("Real radial depth: ", geometry["real_radial_depth"].tolist())
+    print("inclinations_wrt_radial_dir_at_middleRadialDepth: ", np.degrees(geometry["inclinations"]).tolist())
+    print("Signal trace length per layer: ", geometry["trace_length"].tolist())
+
+    capa = computeCapacitances(mergedModules, mergedThetaCells, geometry)
+    theta = capa["theta"]
+    if debug:
+        eta = -np.log(np.tan(theta / 2.0))
+        print("theta = ", theta)
+        print("eta = ", eta)
+        print("delta eta = ", np.abs(-np.log(np.tan((theta + deltaTheta) / 2.0)) - eta))
+
+    gStyle.SetOptStat(0)
+
+    cImpedance = TCanvas("cImpedance", "", 600, 800)
+    cImpedance.Divide(1, 2)
+    cImpedance.cd(1)
+    fImpedance = TF2("fImpedance", "60/sqrt([0])*log(1.9*(2*x+[1])/(0.8*y+[1]))", 0.04, 0.2, 0.04, 0.2)
+    fImpedance.SetTitle("Impedance vs trace width and distance to ground")
+    fImpedance.SetParameters(epsilonR, t)
+    fImpedance.Draw("colz")
+    fImpedance.GetXaxis().SetTitle("Distance to ground [mm]")
+    fImpedance.GetYaxis().SetTitle("Trace width [mm]")
+    cImpedance.cd(2)
+    fImpedance1D = TF1("fImpedance1D", "60/sqrt([0])*log(1.9*(2*x+[1])/(0.8*[2]+[1]))", 0.04, 0.2)
+    fImpedance1D.SetTitle("Impedance vs distance to ground")
+    fImpedance1D.SetParameters(epsilonR, t, w)
+    fImpedance1D.Draw()
+    fImpedance1D.GetXaxis().SetTitle("Distance to ground [mm]")
+    fImpedance1D.GetYaxis().SetTitle("Impedance [#Omega]")
+
+    # prepare the TH1, filled in one go with the capacitances of all the theta bins (+ empty under/overflow)
+    def histogram(name, title, values, color, style):
+        h = TH1F()
+        h.SetBins(numTheta, minTheta, maxTheta)
+        h.SetLineColor(color)
+        h.SetLineStyle(style)
+        h.SetLineWidth(2)
+        h.SetTitle(title)
+        h.SetName(name)
+        h.SetContent(np.concatenate([[0.], values, [0.]]).astype(np.float64))
+        return h
+
+    hCapTrace = []
+    hCapShield = []
+    hCapDetector = []
+    line_color_number = 1
+    line_style_number = 1
+    for i in range(0, numLayers):
+        if line_color_number == 8:
+            line_color_number = 22
+        if line_style_number == 8:
+            line_style_number = 1
+        hCapTrace.append(histogram("hCapacitance_traces"+str(i), "Stripline capacitance; #theta; Capacitance [pF]",
+                                   capa["trace"][i], line_color_number, line_style_number))
+        hCapShield.append(histogram("hCapacitance_shields"+str(i), "Signal pads - ground shields capacitance; #theta; Capacitance [pF]",
+                                    capa["shield"][i], line_color_number, line_style_number))
+        hCapDetector.append(histogram("hCapacitance_detector"+str(i), "Signal pad - absorber capacitance; #theta; Capacitance [pF]",
+                                      capa["detector"][i], line_color_number, line_style_number))
+        if line_color_number > 8:
+            line_color_number += 10
+        else:
+            line_color_number += 1
+        line_style_number += 1
+
+    # capacitances at theta = 90 degrees
+    central = np.flatnonzero(np.abs(theta - pi / 2.) < 1e-4)
+    cellcapas = []
+    for i in range(0, numLayers):
+        print("--------------")
+        for index in central:
+            print("LAr gap size (perpendicular) + hhv + t: %f mm" % capa["gap"][i])
+            capacitanceTrace = capa["trace"][i, index]
+            capacitanceShield = capa["shield"][i, index]
+            capacitanceDetector = capa["detector"][i, index]
+            print("layer %d" % (i + 1), "theta=%f" % theta[index], ": capacitanceTrace: %.0f pF," % capacitanceTrace, "capacitanceShield: %.0f pF," % capacitanceShield, "capacitanceDetector: %.0f pF," %capacitanceDetector, "total/2: %.0f pF" % ((capacitanceTrace + capacitanceShield + capacitanceDetector)/2.))
             cellcapas.append(round((capacitanceTrace + capacitanceShield + capacitanceDetector)/2.))
 
-    # Draw
+    cellcapas.reverse()
+
+    print("Cell capas per electrode:")
+    print(cellcapas)
+
+    cTrace = TCanvas("cTrace", "", 600, 400)
+    cShield = TCanvas("cShield", "", 600, 400)
+    cDetector = TCanvas("cDetector", "", 600, 400)
+
+    legend = TLegend(0.1, 0.693, 0.8, 0.9)
+    legend.SetHeader("Longitudinal layers")
+    legend.SetNColumns(4)
+    for i in range(0, numLayers):
+        option = "" if i == 0 else "same"
+        cTrace.cd()
+        hCapTrace[i].Draw(option)
+        legend.AddEntry(hCapTrace[i], "layer %d" % (i + 1), "l")
+        cShield.cd()
+        hCapShield[i].Draw(option)
+        cDetector.cd()
+        hCapDetector[i].Draw(option)
+
+    capa_shield_max = max(0, capa["shield"].max())
+    capa_det_max = max(0, capa["detector"].max())
+    maximum = capa_shield_max
+
+    plots = TFile(args.output, "RECREATE")
+
+    for i in range(0, numLayers):
+        hCapTrace[i].SetMinimum(0)
+        hCapTrace[i].SetMaximum(maximum * 1.8)
+        hCapTrace[i].Write()
+        hCapShield[i].SetMinimum(0)
+        hCapShield[i].SetMaximum(capa_shield_max * 1.5)
+        hCapShield[i].Write()
+        hCapDetector[i].SetMinimum(0)
+        hCapDetector[i].SetMaximum(capa_det_max * 1.5)
+        hCapDetector[i].Write()
+
     cTrace.cd()
-    if i == 0:
-        hCapTrace[i].Draw()
-    else:
-        hCapTrace[i].Draw("same")
-    legend.AddEntry(hCapTrace[i], "layer %d" % (i + 1), "l")
+    legend.Draw()
+    cTrace.Update()
+    cTrace.Write()
+    cTrace.Print("capa_trace%s.png" % apdx)
+    cTrace.Print("capa_trace%s.pdf" % apdx)
     cShield.cd()
-    if i == 0:
-        hCapShield[i].Draw()
-    else:
-        hCapShield[i].Draw("same")
+    legend.Draw()
+    cShield.Update()
+    cShield.Write()
+    cShield.Print("capa_shield%s.png" % apdx)
+    cShield.Print("capa_shield%s.pdf" % apdx)
     cDetector.cd()
-    if i == 0:
-        hCapDetector[i].Draw()
-    else:
-        hCapDetector[i].Draw("same")
-
-cellcapas.reverse()
-
-print("Cell capas per electrode:")
-print(cellcapas)
-
-maximum = capa_shield_max
-
-plots = TFile(filename, "RECREATE")
-
-for i in range(0, len(readoutLayerParallelLengths)):
-    hCapTrace[i].SetMinimum(0)
-    hCapTrace[i].SetMaximum(maximum * 1.8)
-    hCapTrace[i].Write()
-    hCapShield[i].SetMinimum(0)
-    hCapShield[i].SetMaximum(capa_shield_max * 1.5)
-    hCapShield[i].Write()
-    hCapDetector[i].SetMinimum(0)
-    hCapDetector[i].SetMaximum(capa_det_max * 1.5)
-    hCapDetector[i].Write()
-
-cTrace.cd()
-legend.Draw()
-cTrace.Update()
-cTrace.Write()
-cTrace.Print("capa_trace%s.png" % apdx)
-cTrace.Print("capa_trace%s.pdf" % apdx)
-cShield.cd()
-legend.Draw()
-cShield.Update()
-cShield.Write()
-cShield.Print("capa_shield%s.png" % apdx)
-cShield.Print("capa_shield%s.pdf" % apdx)
-cDetector.cd()
-legend.Draw()
-cDetector.Update()
-cDetector.Write()
-cDetector.Print("capa_detector%s.png" % apdx)
-cDetector.Print("capa_detector%s.pdf" % apdx)
-
-fImpedance.Write()
-fImpedance1D.Write()
-
-#closeInput = raw_input("Press ENTER to exit")
+    legend.Draw()
+    cDetector.Update()
+    cDetector.Write()
+    cDetector.Print("capa_detector%s.png" % apdx)
+    cDetector.Print("capa_detector%s.pdf" % apdx)
+
+    fImpedance.Write()
+    fImpedance1D.Write()
+    plots.Close()
+
 
+if __name__ == "__main__":
+    main()
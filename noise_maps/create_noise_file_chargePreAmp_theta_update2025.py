@@ -7,6 +7,10 @@
 
 # execute script with
 # python create_noise_file_chargePreAmp_theta_update2025.py
+#
+# scan mode: evaluate a grid of noise model parameters at once, e.g.
+# python create_noise_file_chargePreAmp_theta_update2025.py --scan-a 10 12 --scan-r-recomb 0.02 0.04
+# writes one noise file per parameter point and a summary table in noise_capa_ecalbarrel/scan
 
 # the input file name is configured with capa_filename
 # noise and capacitances per layer are saved in root files
@@ -19,13 +23,12 @@ import ROOT
 import itertools
 from datetime import date
 import os, sys
-#from numpy import ones,vstack
-#from numpy.linalg import lstsq
+import argparse
+import noiseScan
+import noiseModel
 import numpy as np
 from math import floor
 
-from scipy.optimize import curve_fit
-
 ROOT.gROOT.SetBatch(ROOT.kTRUE)
 ROOT.gStyle.SetPadTickY(1)
 ROOT.gStyle.SetOptTitle(0)
@@ -43,54 +46,23 @@ def rescaleaxis(g, scale = 50e-12/1e-9):
 # you know the noise charge rms from Martin (as a function of capacitance): https://indico.cern.ch/event/1066234/contributions/4708987/attachments/2387716/4080914/20220209_Brieuc_Francois_Noble_Liquid_Calorimetry_forFCCee_FCCworkshop2022.pdf#page=7
 # you need to further get, for each layer, the collected charge corresponding to an energy deposit of 1 MeV in the cell (cell considered including the energy in absorber and PCB), the cell merging strategy does not matter yet here to first approximation because the 1 MeV current equivalent will be the same in any merging scenarios (the current will be shared in more gaps when merging many cells, but all these current will then be 'summed' before to reach the readout). Merging many cells will pay back later, when more signal will be collected per read out channel compared to merging less cells, for the same noise values
 
-# Retrieving a capa dependent function for the noise charge rms in terms of number of electrons: https://indico.cern.ch/event/1066234/contributions/4708987/attachments/2387716/4080914/20220209_Brieuc_Francois_Noble_Liquid_Calorimetry_forFCCee_FCCworkshop2022.pdf#page=7
-
-"""
-points_capa_noise = [(100, 4375), (500, 6750)]
-x_coords, y_coords = zip(*points_capa_noise)
-A = vstack([x_coords, ones(len(x_coords))]).T
-m, c = lstsq(A, y_coords,rcond=-1)[0]
-#print("Line Solution is y = {m}x + {c}".format(m=m, c=c))
-def get_noise_charge_rms(capacitance):
-    return m * capacitance + c # number of electrons
-"""
-
-# Capa-to-noise relation updated to Omega labs' model in December 2025
-
-# Capacitance (x) and ENC (y) points from Aimie Laffitte's plot
-# (three needed but let's take more for a more reliable fit)
-
-x = np.array([100.2, 199.8, 300, 400.2, 500.4, 600])
-y = np.array([1020, 1254, 1546, 1878, 2239, 2610])
-
-def parabolic_func(x, a, b):
-    return np.sqrt(a * x **2 + b)
-
-# Fit the curve
-popt, pcov = curve_fit(parabolic_func, x, y)
-
-# Extract optimized parameters
-a_opt, b_opt = popt
+# Capa-to-noise relation updated to Omega labs' model in December 2025 (see noiseModel.py)
+# The fit of the measured points is cached, it is only redone when the points change
+a_opt, b_opt = noiseModel.fitPreampCurve(noiseModel.omegaCapacitances, noiseModel.omegaENC)
 print(f"Optimal Parameters: a = {a_opt}, b = {b_opt}")
 
-def get_noise_charge_rms(capacitance):
-    return np.sqrt( a_opt*capacitance**2 + b_opt ) # number of electrons
-
-
-# Get the equivalent of 1 MeV energy deposit in a cell (absorber + Lar) in terms of number of electrons in the charge pre-amplifier + shaper
-r_recomb = 0.04
-w_lar = 23.6 # eV needed to create a ion/electron pair
-
-def get_ref_charge(SF, E_dep = 1 * pow(10, 6)): #E_dep en eV, choose 1 MeV
-    return E_dep * SF * (1 - r_recomb) / (2 * w_lar) # nA, the factor 2 comes from: Q_tot = I_0 * t_drift * 1/2  (rectangle --> triangle), t_drift cancels out from the formula to get I_0 which has v_drift/d_gap (Ramo Shockley).
-                                                     # Assumption: shaping time is similar or bigger to drift time
-
 # Sampling fraction in each layer
 # numbers updated for v03 model with 1536 modules and 11 layers, calculated with ddsim
 SFfcc = [0.3800493723322256] * 1 + [0.13494147915064658] * 1 + [0.142866851721152] * 1 + [0.14839315921940666] * 1 + [0.15298362570665006] * 1 + [0.15709704561942747] * 1 + [0.16063717490147533] * 1 + [0.1641723795419055] * 1 + [0.16845490287689746] * 1 + [0.17111520115997653] * 1 + [0.1730605163148862] * 1
 nLayers = len(SFfcc)
 
-print("##########: ", get_ref_charge(0.16))
+# noise model parameters that can be scanned (--scan-<name> v1 v2 ...)
+noiseModelDefaults = {"a": a_opt, "b": b_opt, "r_recomb": noiseModel.r_recomb, "shaping": noiseModel.shaping}
+parser = argparse.ArgumentParser(description="Create the ECal barrel noise histograms from the capacitances")
+noiseScan.addScanArguments(parser, noiseModelDefaults)
+args = parser.parse_args()
+
+print("##########: ", noiseModel.refCharge(0.16))
 
 SF_rounded_forPrint = []
 for SF in SFfcc:
@@ -111,6 +83,50 @@ output_folder = "noise_capa_ecalbarrel"
 # output_folder = "noise_capa_ecalbarrel" + date.today().strftime("%y%m%d")
 if not os.path.isdir(output_folder):
     os.mkdir(output_folder)
+
+if noiseScan.isScan(args, noiseModelDefaults):
+    # total capacitance [layer, bin] (including under/overflow bins) read once for all the points
+    import uproot
+    with uproot.open(capa_filename) as f:
+        capTotal = np.array([f["hCapacitance_shields"+str(i)].values(flow=True)
+                             + f["hCapacitance_traces"+str(i)].values(flow=True)
+                             + f["hCapacitance_detector"+str(i)].values(flow=True) for i in range(nLayers)])
+        axis = f["hCapacitance_shields0"].axis()
+        nbins, thetaMin, thetaMax = len(axis), axis.low, axis.high
+    # the overflow bin is not filled in the standard mode
+    capTotal[:, -1] = np.nan
+
+    sfSets = [SFfcc] + [noiseScan.readSF(f) for f in args.scan_sf]
+    for f, sfSet in zip(args.scan_sf, sfSets[1:]):
+        if len(sfSet) != nLayers:
+            print(f"Error: {f} has {len(sfSet)} sampling fractions, {nLayers} expected")
+            sys.exit(1)
+    sfSets = np.array(sfSets)
+    grid = noiseScan.parameterGrid(args, noiseModelDefaults, len(sfSets))
+    col = noiseScan.column
+
+    # noise [point, layer, bin] for all the points at once
+    param = lambda name: col(grid[name])[..., np.newaxis]
+    noise = noiseModel.noisePerMeV(capTotal[np.newaxis], sfSets[grid["sf_set"]][..., np.newaxis], param("a"), param("b"),
+                                   r_recomb=param("r_recomb"), shaping=param("shaping"))
+    noise = np.nan_to_num(noise, nan=0.)
+
+    scan_folder = os.path.join(output_folder, "scan")
+    if not os.path.isdir(scan_folder):
+        os.mkdir(scan_folder)
+    stats = {}
+    for i in range(nLayers):
+        stats["mean_noise_layer"+str(i+1)] = noise[:, i, 1:nbins+1].mean(axis=1)
+        stats["max_noise_layer"+str(i+1)] = noise[:, i, 1:nbins+1].max(axis=1)
+    for point in range(len(grid["sf_set"])):
+        fScan = TFile(os.path.join(scan_folder, "elecNoise_ecalBarrelFCCee_theta_"+str(point)+".root"),"RECREATE")
+        for i in range(nLayers):
+            h = TH1F("h_elecNoise_fcc_"+str(i+1), "Default electronic noise: shield + detector + trace capacitance; #theta; Electronic noise [MeV]", nbins, thetaMin, thetaMax)
+            h.SetContent(noise[point, i].astype(np.float64))
+            h.Write()
+        fScan.Close()
+    noiseScan.writeSummary(os.path.join(scan_folder, "scan_summary.csv"), grid, stats)
+    sys.exit(0)
 fSaveAll = TFile(os.path.join(output_folder, "capacitances_ecalBarrelFCCee_theta.root"),"RECREATE")
 fSave = TFile(os.path.join(output_folder, "elecNoise_ecalBarrelFCCee_theta.root"),"RECREATE")
 
@@ -215,7 +231,7 @@ for i in range (0, nLayers):
     hCapTotal[i].SetTitle("Total capacitance; #theta; Capacitance [pF]")
     hCapTotal[i].SetName("hCapacitance"+str(i))
 
-    ref_charge_1mev = get_ref_charge(SFfcc[i])
+    ref_charge_1mev = noiseModel.refCharge(SFfcc[i])
     if i != 0:
         print(noise_charge_rms)
     print(i, " ", ref_charge_1mev)
@@ -229,12 +245,12 @@ for i in range (0, nLayers):
         hCapTotal[i].SetBinContent( ibin, capShield + capTrace + capDetector )
 
         # Compute the NOISE
-        noise_charge_rms = get_noise_charge_rms(capShield + capDetector + capTrace) #JP trace added!
+        noise_charge_rms = noiseModel.noiseChargeRMS(capShield + capDetector + capTrace, a_opt, b_opt) #JP trace added!
         noise = noise_charge_rms / (ref_charge_1mev)
-        noiseWithTrace = get_noise_charge_rms(capShield + capDetector + capTrace) / ref_charge_1mev
-        noiseShield = get_noise_charge_rms(capShield) / ref_charge_1mev
-        noiseTrace = get_noise_charge_rms(capTrace) / ref_charge_1mev
-        noiseDetector = get_noise_charge_rms(capDetector) / ref_charge_1mev
+        noiseWithTrace = noiseModel.noiseChargeRMS(capShield + capDetector + capTrace, a_opt, b_opt) / ref_charge_1mev
+        noiseShield = noiseModel.noiseChargeRMS(capShield, a_opt, b_opt) / ref_charge_1mev
+        noiseTrace = noiseModel.noiseChargeRMS(capTrace, a_opt, b_opt) / ref_charge_1mev
+        noiseDetector = noiseModel.noiseChargeRMS(capDetector, a_opt, b_opt) / ref_charge_1mev
         #find maximum for drawing of histograms
         if noise > maximumNoise:
             maximumNoise = noise
@@ -1,12 +1,20 @@
 import ROOT
-import math
-import dd4hep
+import numpy as np
+import uproot
 import os
 import sys
 import argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
+from geometrySnapshot import loadSnapshot
+import noiseScan
+import noiseModel
+
+# noise model parameters that can be scanned (--scan-<name> v1 v2 ...)
+noiseModelDefaults = {"A": noiseModel.endcapA, "B": noiseModel.endcapB, "r_recomb": noiseModel.r_recomb, "shaping": noiseModel.shaping}
 
 parser = argparse.ArgumentParser()
 parser.add_argument("compactFile", type=str, help="Top-level compact file name")
+noiseScan.addScanArguments(parser, noiseModelDefaults)
 args = parser.parse_args()
 
 path_to_detector = os.environ.get("K4GEO", "")
@@ -17,8 +25,8 @@ if not os.path.isfile(detectorFile):
     print(f"Error: compact file '{detectorFile}' does not exist.", file=sys.stderr)
     sys.exit(1)
 
-detector = dd4hep.Detector.getInstance()
-detector.fromXML(detectorFile)
+# constants from the geometry snapshot (the compact file is only parsed if it changed)
+detector = loadSnapshot(detectorFile)
 
 nWheels = detector.constantAsLong("EMECnWheels")
 
@@ -41,7 +49,7 @@ nLayers = 0
 for i in range(0, nWheels) :
     nLayers += EMECNumCalibRhoLayers[i]*EMECNumCalibZLayers[i]
 
-SF = (
+SF = np.array(
     [0.0897818] * 1
     + [0.221318] * 1
     + [0.0820002] * 1
@@ -145,58 +153,88 @@ SF = (
 if (len(SF) != nLayers) :
     print ("Error: number of entries in sF list does not match number of layers")
 
+# number of calibration layers in the wheels before each wheel
+layerOffsets = np.concatenate([[0], np.cumsum(np.multiply(EMECNumCalibRhoLayers, EMECNumCalibZLayers))[:-1]])
+
+# all the functions below work on numpy arrays (one entry per cell) as well as on numbers
 def get_layer(iWheel,iRho, iZ):
-    layerOffset = 0
-    if (iWheel == 1) :
-        layerOffset = EMECNumCalibRhoLayers[0]*EMECNumCalibZLayers[0]
-    if (iWheel == 2):
-        layerOffset = EMECNumCalibRhoLayers[0]*EMECNumCalibZLayers[0] +  EMECNumCalibRhoLayers[1]*EMECNumCalibZLayers[1]
+    iWheel = np.asarray(iWheel)
+    layerOffset = layerOffsets[iWheel]
+    readoutPerCalibZ = np.divide(EMECNumReadoutZLayers, EMECNumCalibZLayers)[iWheel]
+    readoutPerCalibRho = np.divide(EMECNumReadoutRhoLayers, EMECNumCalibRhoLayers)[iWheel]
+    calibZ = np.asarray(EMECNumCalibZLayers)[iWheel]
 
-    return int(layerOffset + iZ/(EMECNumReadoutZLayers[iWheel]/EMECNumCalibZLayers[iWheel]) + EMECNumCalibZLayers[iWheel]*(iRho/(EMECNumReadoutRhoLayers[iWheel]/EMECNumCalibRhoLayers[iWheel]) ))
+    return (layerOffset + iZ/readoutPerCalibZ + calibZ*(iRho/readoutPerCalibRho)).astype(int)
 
-#conversion from capacitance to noise in electrons, assuming cold electronics
+# conversion from capacitance to noise in electrons, assuming cold electronics: ENC = sqrt(A C^2 + B^2)
 # taken from Omega lab measurements as reported in https://indico.cern.ch/event/1545838/contributions/6831866/attachments/3194785/5686292/capa_and_noise_juska_v0.pdf
-def get_noise_charge_rms(capacitance):
-    A = 16.5
-    B = 945
-    return math.sqrt(A * capacitance**2 + B**2) # number of electrons
-
-# Get the equivalent of 1 MeV energy deposit in a cell (absorber + Lar) in terms of number of electrons in the charge pre-amplifier + shaper
-r_recomb = 0.04
-w_lar = 23.6 # eV needed to create a ion/electron pair
-def get_ref_charge(SF, E_dep = 1 * pow(10, 6)): #E_dep en eV, choose 1 MeV
-    return E_dep * SF * (1 - r_recomb) / (2 * w_lar) # nA, the factor 2 comes from: Q_tot = I_0 * t_drift * 1/2  (rectangle --> triangle), t_drift cancels out from the formula to get I_0 which has v_drift/d_gap (Ramo Shockley).
-                                                     # Assumption: shaping time is similar or bigger to drift time
+# and from number of electrons to MeV (see noiseModel.py)
+def get_noise(capacitance, SF, A=noiseModel.endcapA, B=noiseModel.endcapB, r_recomb=noiseModel.r_recomb, shaping=noiseModel.shaping):
+    return noiseModel.noisePerMeV(capacitance, SF, A, B**2, r_recomb=r_recomb, shaping=shaping)
 
 
+# capacitances as array [iWheel, iZ]
 filename = "endcap_capacitances.root"
-fIn = ROOT.TFile(filename, "r")
-hIn =fIn.Get("endcap_capacitances")
+with uproot.open(filename) as fIn:
+    capacitances = fIn["endcap_capacitances"].values()
 
 output_folder = "noise_capa_ecalendcap"
 if not os.path.isdir(output_folder):
     os.mkdir(output_folder)
 
-fSave = ROOT.TFile(os.path.join(output_folder, "elecNoise_ecalendcap.root"),"RECREATE")
-h_elecNoise_fcc = []
-
+# all (iZ, iRho) cells of each wheel, as arrays
+cells = []
 for iWheel in range(0,nWheels) :
-    hNoise = ROOT.TH2F("noise_endcap_wheel"+str(iWheel+1), "noise_endcap_wheel"+str(iWheel+1), EMECNumReadoutZLayers[iWheel], 0, EMECNumReadoutZLayers[iWheel], EMECNumReadoutRhoLayers[iWheel], 0, EMECNumReadoutRhoLayers[iWheel])
-    for iZ in range (0, EMECNumReadoutZLayers[iWheel]) :
-        for iRho in range (0, EMECNumReadoutRhoLayers[iWheel]) :
-            layer = get_layer(iWheel, iRho, iZ)
-            ref_charge_1mev = get_ref_charge(SF[layer])
-            binIndex = hIn.GetBin(iWheel+1, iZ+1)
-            cap = hIn.GetBinContent(binIndex)
-            noise_RMS = get_noise_charge_rms(cap) / ref_charge_1mev
-            hNoise.Fill(iZ, iRho, noise_RMS)
-
-    h_elecNoise_fcc.append(hNoise)
-
-fSave.cd()
-for iHist in range (0, nWheels) :
-    h_elecNoise_fcc[iHist].Write()
-
-fSave.Close()
-
-
+    iZ, iRho = np.meshgrid(np.arange(EMECNumReadoutZLayers[iWheel]), np.arange(EMECNumReadoutRhoLayers[iWheel]), indexing="ij")
+    iZ = iZ.ravel()
+    iRho = iRho.ravel()
+    cells.append((iZ, iRho, get_layer(iWheel, iRho, iZ), capacitances[iWheel, iZ]))
+
+
+def write_noise_file(filename, noisePerWheel):
+    fSave = ROOT.TFile(filename,"RECREATE")
+    h_elecNoise_fcc = []
+    for iWheel in range(0,nWheels) :
+        hNoise = ROOT.TH2F("noise_endcap_wheel"+str(iWheel+1), "noise_endcap_wheel"+str(iWheel+1), EMECNumReadoutZLayers[iWheel], 0, EMECNumReadoutZLayers[iWheel], EMECNumReadoutRhoLayers[iWheel], 0, EMECNumReadoutRhoLayers[iWheel])
+        iZ, iRho, _, _ = cells[iWheel]
+        noise_RMS = noisePerWheel[iWheel]
+        hNoise.FillN(len(noise_RMS), iZ.astype(np.float64), iRho.astype(np.float64), noise_RMS.astype(np.float64))
+        h_elecNoise_fcc.append(hNoise)
+
+    fSave.cd()
+    for iHist in range (0, nWheels) :
+        h_elecNoise_fcc[iHist].Write()
+
+    fSave.Close()
+
+
+if not noiseScan.isScan(args, noiseModelDefaults):
+    noisePerWheel = []
+    for iZ, iRho, layer, cap in cells:
+        noisePerWheel.append(get_noise(cap, SF[layer]))
+    write_noise_file(os.path.join(output_folder, "elecNoise_ecalendcap.root"), noisePerWheel)
+else:
+    # scan mode: all the parameter points evaluated at once, arrays [point, cell]
+    sfSets = [SF] + [noiseScan.readSF(f) for f in args.scan_sf]
+    for f, sfSet in zip(args.scan_sf, sfSets[1:]):
+        if len(sfSet) != nLayers:
+            print(f"Error: {f} has {len(sfSet)} sampling fractions, {nLayers} expected", file=sys.stderr)
+            sys.exit(1)
+    sfSets = np.array(sfSets)
+    grid = noiseScan.parameterGrid(args, noiseModelDefaults, len(sfSets))
+    col = noiseScan.column
+    noisePerWheel = []
+    for iZ, iRho, layer, cap in cells:
+        noisePerWheel.append(get_noise(cap, sfSets[col(grid["sf_set"]), layer], col(grid["A"]), col(grid["B"]),
+                                       r_recomb=col(grid["r_recomb"]), shaping=col(grid["shaping"])))
+
+    scan_folder = os.path.join(output_folder, "scan")
+    if not os.path.isdir(scan_folder):
+        os.mkdir(scan_folder)
+    stats = {}
+    for iWheel in range(0,nWheels) :
+        stats[f"mean_noise_wheel{iWheel+1}"] = noisePerWheel[iWheel].mean(axis=1)
+        stats[f"max_noise_wheel{iWheel+1}"] = noisePerWheel[iWheel].max(axis=1)
+    for point in range(len(grid["sf_set"])):
+        write_noise_file(os.path.join(scan_folder, f"elecNoise_ecalendcap_{point}.root"), [noise[point] for noise in noisePerWheel])
+    noiseScan.writeSummary(os.path.join(scan_folder, "scan_summary.csv"), grid, stats)
@@ -0,0 +1,186 @@
+#
+# noiseMapBuilder.py
+#
+# build the cell noise map (tree noisyCells: cellId, noiseLevel, noiseOffset)
+# directly from the noise histograms, without running the Gaudi job of
+# noise_map.py
+#
+# The cells are taken from the table of cell positions (geometry/cellPositions.py),
+# either stored in the geometry snapshot of the compact file or given as a
+# file, and the noise of all the cells of a subdetector is looked up at once:
+#  - ECal barrel: histogram h_elecNoise_fcc_<layer+1> vs theta (as NoiseCaloCellsFromFileBarrelTool)
+#  - ECal endcap: histogram noise_endcap_wheel<wheel+1> vs (z, rho) indices (as NoiseCaloCellsFromFileTurbineEndcapTool)
+#  - HCal barrel and endcap: constant noise (as ConstNoiseTool)
+# The noise histograms are in MeV, the noise levels of the map in GeV.
+#
+# Usage:
+#   python noiseMapBuilder.py --subdetectors ecalb ecale hcalb hcale --detector FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml
+#   python noiseMapBuilder.py --subdetectors ecalb --cells cellPositions.root
+#
+# The output file name is composed as in noise_map.py.
+#
+import os
+import sys
+import argparse
+import numpy as np
+import uproot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils"))
+from cellPositions import loadCellPositions
+from bitFieldCoder import BitFieldCoder, defaultEncodingMap
+
+# subdetector -> (system ID, readout name, tag in the output file name), in the order of noise_map.py
+subdetectors = {
+    "ecalb": (4, "ECalBarrelModuleThetaMerged", "ecalB"),
+    "ecale": (5, "ECalEndcapTurbine", "ecalE"),
+    "hcalb": (8, "HCalBarrelReadout", "hcalB"),
+    "hcale": (9, "HCalEndcapReadout", "hcalE"),
+}
+
+ecalBarrelNoiseFile = "noise_capa_ecalbarrel/elecNoise_ecalBarrelFCCee_theta.root"
+ecalBarrelNoiseRMSHistName = "h_elecNoise_fcc_"
+ecalEndcapNoiseFile = "noise_capa_ecalendcap/elecNoise_ecalendcap.root"
+ecalEndcapNoiseRMSHistName = "noise_endcap_wheel"
+hcalNoiseRMS = 0.0115 / 4  # GeV
+scaleFactor = 1 / 1000.  # MeV to GeV
+
+treeName = "noisyCells"
+
+
+def outputFileName(subdets):
+    name = "cellNoise_map_electronicsNoiseLevel"
+    for subdet in subdetectors:
+        if subdet in subdets:
+            name += "_" + subdetectors[subdet][2] + "_" + subdetectors[subdet][1]
+    return name + ".root"
+
+
+# ================================
+# Noise per subdetector
+# ================================
+def ecalBarrelNoise(layer, theta, filename=ecalBarrelNoiseFile, histName=ecalBarrelNoiseRMSHistName):
+    """Noise RMS (GeV) of the cells from their layer and theta"""
+    with uproot.open(filename) as f:
+        nLayers = 0
+        while f"{histName}{nLayers + 1}" in f:
+            nLayers += 1
+        if nLayers == 0:
+            raise RuntimeError(f"no histogram {histName}1 in {filename}")
+        # contents [layer, bin] including under/overflow bins
+        contents = np.array([f[f"{histName}{i + 1}"].values(flow=True) for i in range(nLayers)])
+        edges = f[f"{histName}1"].axis().edges()
+    if (layer >= nLayers).any():
+        print(f"WARNING: more layers than the {nLayers} histograms of {filename}, noise set to 0 for", int((layer >= nLayers).sum()), "cells")
+    # all the histograms have the same, uniform, binning
+    nBins = len(edges) - 1
+    thetaBin = np.floor((theta - edges[0]) / ((edges[-1] - edges[0]) / nBins)).astype(np.int64) + 1
+    if (thetaBin > nBins).any():
+        print("WARNING: theta outside the range of the histograms for", int((thetaBin > nBins).sum()), "cells, last bin used")
+    thetaBin = np.clip(thetaBin, 0, nBins)
+    inRange = (layer >= 0) & (layer < nLayers)
+    noise = np.where(inRange, contents[np.where(inRange, layer, 0), thetaBin], 0.)
+    return noise * scaleFactor
+
+
+def ecalEndcapNoise(wheel, iRho, iZ, filename=ecalEndcapNoiseFile, histName=ecalEndcapNoiseRMSHistName):
+    """Noise RMS (GeV) of the cells from their wheel and (rho, z) indices"""
+    noise = np.zeros(len(wheel))
+    with uproot.open(filename) as f:
+        for w in np.unique(wheel):
+            rows = np.flatnonzero(wheel == w)
+            # contents [iZ, iRho]
+            contents = f[f"{histName}{w + 1}"].values()
+            inRange = (iZ[rows] < contents.shape[0]) & (iRho[rows] < contents.shape[1])
+            if not inRange.all():
+                print(f"WARNING: {int((~inRange).sum())} cells of wheel {w} outside the noise histogram, noise set to 0")
+            noise[rows] = np.where(inRange, contents[np.minimum(iZ[rows], contents.shape[0] - 1),
+                                                     np.minimum(iRho[rows], contents.shape[1] - 1)], 0.)
+    return noise * scaleFactor
+
+
+def buildNoiseMap(table, subdets, coders, ecalBarrelFile=ecalBarrelNoiseFile, ecalEndcapFile=ecalEndcapNoiseFile,
+                  hcalNoise=hcalNoiseRMS):
+    """cellId, noiseLevel, noiseOffset of all the cells of the table belonging to the subdetectors"""
+    systemOfCell = (table["cellId"] & np.uint64(0xF)).astype(np.int64)
+    cellIds, noiseLevels = [], []
+    for subdet in subdetectors:
+        if subdet not in subdets:
+            continue
+        system, readoutName, _ = subdetectors[subdet]
+        rows = np.flatnonzero(systemOfCell == system)
+        if len(rows) == 0:
+            print(f"WARNING: no cell of {readoutName} in the table of cell positions")
+            continue
+        ids = table["cellId"][rows]
+        coder = coders[system]
+        if subdet == "ecalb":
+            noise = ecalBarrelNoise(coder.get(ids, "layer"), table["theta"][rows], ecalBarrelFile)
+        elif subdet == "ecale":
+            noise = ecalEndcapNoise(coder.get(ids, "wheel"), coder.get(ids, "rho"), coder.get(ids, "z"), ecalEndcapFile)
+        else:
+            noise = np.full(len(ids), hcalNoise)
+        if (noise < 1e-9).any():
+            print(f"WARNING: zero noise for {int((noise < 1e-9).sum())} cells of {readoutName}")
+        print(f"{readoutName}: {len(ids)} cells, mean noise {noise.mean():.3g} GeV")
+        cellIds.append(ids)
+        noiseLevels.append(noise)
+    cellIds = np.concatenate(cellIds) if cellIds else np.zeros(0, dtype=np.uint64)
+    noiseLevels = np.concatenate(noiseLevels) if noiseLevels else np.zeros(0)
+    return {"cellId": cellIds.astype(np.uint64), "noiseLevel": noiseLevels.astype(np.float64),
+            "noiseOffset": np.zeros(len(cellIds))}
+
+
+def writeNoiseMap(filename, noiseMap):
+    with uproot.recreate(filename) as f:
+        f[treeName] = noiseMap
+    print("Noise map of", len(noiseMap["cellId"]), "cells written to", filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the cell noise map from the noise histograms")
+    parser.add_argument("--detector", type=str, default="FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml",
+                        help="The detector xml file, relative to $K4GEO")
+    parser.add_argument("--subdetectors", type=str, nargs="+", default=list(subdetectors), choices=list(subdetectors),
+                        help="List of subdetectors: ecalb, ecale, hcalb, hcale")
+    parser.add_argument("--cells", type=str, default=None,
+                        help="Table of cell positions (.root or .npz from cellPositions.py), default: the one stored in the geometry snapshot")
+    parser.add_argument("--ecalb-noise-file", type=str, default=ecalBarrelNoiseFile, help="ECal barrel noise histograms")
+    parser.add_argument("--ecale-noise-file", type=str, default=ecalEndcapNoiseFile, help="ECal endcap noise histograms")
+    parser.add_argument("--hcal-noise", type=float, default=hcalNoiseRMS, help="Constant noise of the HCal cells (GeV)")
+    parser.add_argument("--output", type=str, default=None, help="Output file (default: name composed as in noise_map.py)")
+    args = parser.parse_args()
+
+    for subdet, filename in (("ecalb", args.ecalb_noise_file), ("ecale", args.ecale_noise_file)):
+        if subdet in args.subdetectors and not os.path.isfile(filename):
+            print(f"Error: noise file '{filename}' does not exist.", file=sys.stderr)
+            return 1
+
+    # encodings and cell positions from the geometry snapshot (the compact file is only parsed if it changed)
+    detectorFile = os.path.join(os.environ.get("K4GEO", ""), args.detector)
+    snapshot = None
+    if os.path.isfile(detectorFile):
+        from geometrySnapshot import loadSnapshot
+        snapshot = loadSnapshot(detectorFile)
+    elif args.cells is None:
+        print(f"Error: compact file '{detectorFile}' does not exist.", file=sys.stderr)
+        return 1
+    else:
+        print(f"WARNING: compact file '{detectorFile}' not found, using the default encodings")
+
+    table = loadCellPositions(args.cells if args.cells else snapshot)
+    if table is None:
+        print("Error: no table of cell positions in the geometry snapshot, create it first with geometry/cellPositions.py", file=sys.stderr)
+        return 1
+
+    coders = {}
+    for subdet in args.subdetectors:
+        system, readoutName, _ = subdetectors[subdet]
+        coders[system] = BitFieldCoder(snapshot.encoding(readoutName) if snapshot else defaultEncodingMap[system])
+
+    noiseMap = buildNoiseMap(table, args.subdetectors, coders, args.ecalb_noise_file, args.ecale_noise_file, args.hcal_noise)
+    writeNoiseMap(args.output or outputFileName(args.subdetectors), noiseMap)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#
+# noiseModel.py
+#
+# electronic noise model shared by the noise scripts: conversion of the cell
+# capacitance to the equivalent noise charge (ENC) of the preamplifier, of
+# the sampling fraction to the charge collected for a reference energy
+# deposit, and of both to the noise in MeV
+#
+# All the functions work on numbers as well as on numpy arrays of any
+# (broadcastable) shapes, e.g. capacitances [layer, theta] with sampling
+# fractions [layer, 1], or parameter columns [point, 1] for scans.
+#
+# Usage:
+#   import noiseModel
+#   a, b = noiseModel.fitPreampCurve(noiseModel.omegaCapacitances, noiseModel.omegaENC)
+#   noise = noiseModel.noisePerMeV(capacitance, SF, a, b)
+#
+# The fit of the preamplifier curve is cached in $NOISE_MODEL_CACHE_DIR
+# (default: ~/.cache/noise-model), keyed on the measurement points, so it is
+# only redone when the points change.
+#
+# Self-check (run by ctest):
+#   python noiseModel.py
+#
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+
+defaultCacheDir = os.path.join(os.path.expanduser("~"), ".cache", "noise-model")
+
+w_lar = 23.6  # eV needed to create a ion/electron pair
+r_recomb = 0.04  # recombination rate in LAr
+shaping = 2.  # Q_tot = I_0 * t_drift * 1/2 (rectangle --> triangle)
+E_ref = 1e6  # eV, reference energy deposit (1 MeV)
+
+# Capacitance (pF) and ENC (electrons) points from Aimie Laffitte's plot (Omega labs' model, December 2025)
+# https://indico.cern.ch/event/1545838/contributions/6831866/attachments/3194785/5686292/capa_and_noise_juska_v0.pdf
+omegaCapacitances = np.array([100.2, 199.8, 300, 400.2, 500.4, 600])
+omegaENC = np.array([1020, 1254, 1546, 1878, 2239, 2610])
+
+# parameters used so far for the endcap: ENC = sqrt(A C^2 + B^2)
+endcapA = 16.5
+endcapB = 945.
+
+
+# ================================
+# Noise model
+# ================================
+def noiseChargeRMS(capacitance, a, b):
+    """Equivalent noise charge (number of electrons) of the preamplifier for the
+    capacitance (pF): sqrt(a C^2 + b)"""
+    capacitance = np.asarray(capacitance, dtype=np.float64)
+    return np.sqrt(a * capacitance**2 + b)
+
+
+def refCharge(SF, E_dep=E_ref, r_recomb=r_recomb, shaping=shaping):
+    """Number of electrons read out for an energy deposit E_dep (eV) in the cell
+    (absorber + LAr), given the sampling fraction SF"""
+    # the factor shaping=2 comes from: Q_tot = I_0 * t_drift * 1/2 (rectangle --> triangle), t_drift cancels out
+    # from the formula to get I_0 which has v_drift/d_gap (Ramo Shockley).
+    # Assumption: shaping time is similar or bigger to drift time
+    SF = np.asarray(SF, dtype=np.float64)
+    return E_dep * SF * (1 - r_recomb) / (shaping * w_lar)
+
+
+def noisePerMeV(capacitance, SF, a, b, r_recomb=r_recomb, shaping=shaping):
+    """Electronic noise (MeV) of a cell with the given capacitance (pF) and sampling fraction"""
+    return noiseChargeRMS(capacitance, a, b) / refCharge(SF, E_ref, r_recomb, shaping)
+
+
+# ================================
+# Fit of the preamplifier curve
+# ================================
+def _preampCurve(x, a, b):
+    return np.sqrt(a * x**2 + b)
+
+
+def fitPreampCurve(capacitances, enc, cacheDir=None, refit=False):
+    """Parameters (a, b) of ENC = sqrt(a C^2 + b) fitted to the measured points.
+    The result is cached on disk, keyed on the points."""
+    capacitances = np.asarray(capacitances, dtype=np.float64)
+    enc = np.asarray(enc, dtype=np.float64)
+    key = hashlib.sha256(np.stack([capacitances, enc]).tobytes()).hexdigest()[:16]
+    cacheDir = cacheDir or os.environ.get("NOISE_MODEL_CACHE_DIR", defaultCacheDir)
+    cacheFile = os.path.join(cacheDir, f"preamp_fit_{key}.json")
+    if not refit and os.path.isfile(cacheFile):
+        with open(cacheFile) as f:
+            cached = json.load(f)
+        return cached["a"], cached["b"]
+
+    from scipy.optimize import curve_fit
+    popt, pcov = curve_fit(_preampCurve, capacitances, enc)
+    a, b = float(popt[0]), float(popt[1])
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        # write to a temporary file first so that concurrent jobs never read a partial file
+        tmpFile = f"{cacheFile}.{os.getpid()}.tmp"
+        with open(tmpFile, "w") as f:
+            json.dump({"a": a, "b": b, "capacitances": capacitances.tolist(), "enc": enc.tolist()}, f, indent=2)
+        os.replace(tmpFile, cacheFile)
+    except OSError as e:
+        print(f"Warning: could not cache the preamplifier fit in {cacheDir}: {e}")
+    return a, b
+
+
+# ================================
+# Self-check
+# ================================
+def selfCheck():
+    import math
+    import tempfile
+    failures = []
+
+    def check(name, condition):
+        print(("OK      " if condition else "FAILED  ") + name)
+        if not condition:
+            failures.append(name)
+
+    # reference values computed by hand
+    check("noiseChargeRMS scalar", math.isclose(noiseChargeRMS(100., endcapA, endcapB**2),
+                                                math.sqrt(16.5 * 100.**2 + 945.**2)))
+    check("refCharge scalar", math.isclose(refCharge(0.16), 1e6 * 0.16 * 0.96 / (2 * 23.6)))
+    check("noisePerMeV scalar", math.isclose(noisePerMeV(200., 0.2, 10., 1e6),
+                                             math.sqrt(10. * 200.**2 + 1e6) / (1e6 * 0.2 * 0.96 / 47.2)))
+
+    # vectorized evaluation agrees with the scalar one and broadcasts
+    rng = np.random.default_rng(1)
+    capacitances = rng.uniform(50., 800., size=(11, 50))
+    SF = rng.uniform(0.1, 0.4, size=(11, 1))
+    noise = noisePerMeV(capacitances, SF, 10., 1e6)
+    scalar = np.array([[noisePerMeV(c, s[0], 10., 1e6) for c in row] for row, s in zip(capacitances, SF)])
+    check("noisePerMeV vectorized", noise.shape == (11, 50) and np.allclose(noise, scalar, rtol=1e-12))
+    a = np.array([[8.], [10.], [12.]])[:, :, np.newaxis]
+    check("noisePerMeV broadcast over parameters", noisePerMeV(capacitances, SF, a, 1e6).shape == (3, 11, 50))
+
+    # the fit reproduces the points it was made from, and is read back from the cache
+    x = np.array([100., 200., 300., 400., 500., 600.])
+    y = _preampCurve(x, 12., 9e5)
+    with tempfile.TemporaryDirectory() as cacheDir:
+        fitted = fitPreampCurve(x, y, cacheDir=cacheDir)
+        check("fitPreampCurve", np.allclose(fitted, (12., 9e5), rtol=1e-4))
+        cacheFiles = os.listdir(cacheDir)
+        check("fitPreampCurve cache written", len(cacheFiles) == 1)
+        with open(os.path.join(cacheDir, cacheFiles[0])) as f:
+            cached = json.load(f)
+        cached["a"] = -1.
+        with open(os.path.join(cacheDir, cacheFiles[0]), "w") as f:
+            json.dump(cached, f)
+        check("fitPreampCurve cache hit", fitPreampCurve(x, y, cacheDir=cacheDir)[0] == -1.)
+        check("fitPreampCurve cache keyed on points", fitPreampCurve(x, y * 1.01, cacheDir=cacheDir)[0] > 0
+              and len(os.listdir(cacheDir)) == 2)
+
+    if failures:
+        print(f"{len(failures)} check(s) failed")
+        return 1
+    print("All checks passed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(selfCheck())
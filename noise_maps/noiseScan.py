@@ -0,0 +1,61 @@
+#
+# noiseScan.py
+#
+# helpers for the parameter-scan mode of the noise scripts: build the grid
+# of noise-model parameters, broadcast it against the per-cell arrays and
+# write the summary table of the scan
+#
+# The parameters of a scan are given on the command line as lists, e.g.
+#   --scan-A 14 16.5 19 --scan-r-recomb 0.02 0.04
+# and all their combinations are evaluated at once: each parameter becomes
+# a column vector (one row per scan point) that broadcasts against the cell
+# arrays (one column per cell).
+#
+import itertools
+import numpy as np
+
+
+def addScanArguments(parser, defaults, sfSets=True):
+    """Add one --scan-<name> option per noise-model parameter"""
+    for name, default in defaults.items():
+        parser.add_argument("--scan-" + name.replace("_", "-"), dest="scan_" + name, type=float, nargs="+",
+                            help=f"Scan mode: values of {name} (default: {default})")
+    if sfSets:
+        parser.add_argument("--scan-sf", type=str, nargs="+", default=[],
+                            help="Scan mode: files with alternative sampling fractions (one value per layer, whitespace or comma separated)")
+
+
+def isScan(args, defaults):
+    return any(getattr(args, "scan_" + name) for name in defaults) or bool(getattr(args, "scan_sf", []))
+
+
+def readSF(filename):
+    with open(filename) as f:
+        return np.array([float(x) for x in f.read().replace(",", " ").split()])
+
+
+def parameterGrid(args, defaults, nSFSets=1):
+    """All combinations of the scanned values, as dict name -> array (one entry per scan point).
+    The index of the SF set (0 = default SF) is in 'sf_set'."""
+    names = list(defaults)
+    values = [getattr(args, "scan_" + name) or [defaults[name]] for name in names]
+    names.append("sf_set")
+    values.append(range(nSFSets))
+    points = list(itertools.product(*values))
+    return {name: np.array([p[i] for p in points]) for i, name in enumerate(names)}
+
+
+def column(values):
+    """Column vector (one row per scan point) broadcasting against per-cell arrays"""
+    return np.asarray(values)[:, np.newaxis]
+
+
+def writeSummary(filename, grid, stats):
+    """Write one line per scan point with its parameters and statistics"""
+    columns = list(grid) + list(stats)
+    with open(filename, "w") as f:
+        f.write(",".join(["point"] + columns) + "\n")
+        for i in range(len(grid["sf_set"])):
+            values = [grid[c][i] for c in grid] + [stats[c][i] for c in stats]
+            f.write(",".join([str(i)] + [f"{v:.6g}" for v in values]) + "\n")
+    print("Summary of", len(grid["sf_set"]), "scan points written to", filename)
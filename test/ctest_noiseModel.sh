@@ -0,0 +1,27 @@
+#!/bin/bash
+
+# set-up the Key4hep environment if not already set
+if [[ -z "${KEY4HEP_STACK}" ]]; then
+  source /cvmfs/sw-nightlies.hsf.org/key4hep/setup.sh
+else
+  echo "The Key4hep stack was already loaded in this environment."
+fi
+
+if [ -z "${ALLEGRO+x}" ]; then
+    ALLEGRO=../
+fi
+
+
+# check the noise model functions (scalar vs vectorized evaluation, fit cache)
+echo
+echo "#############################"
+echo "# Checking the noise model  #"
+echo "#############################"
+echo
+python $ALLEGRO/noise_maps/noiseModel.py || exit 1
+
+echo
+echo "#############################"
+echo "# SUCCESS                   #"
+echo "#############################"
+echo
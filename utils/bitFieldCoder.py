@@ -0,0 +1,113 @@
+#
+# bitFieldCoder.py
+#
+# pure numpy replacement of dd4hep::BitFieldCoder, to decode/encode cellIDs
+# (single values or whole uint64 arrays) without loading ROOT/DD4hep
+#
+# The encoding strings have the same format as in the compact files:
+# comma-separated fields name:offset:width or name:width (offset following
+# the previous field), a negative width denoting a signed field,
+# e.g. "system:0:4,cryo:4:1,type:5:3,subtype:8:3,side:11:-2,..."
+#
+import numpy as np
+
+# default encodings of the ALLEGRO calorimeter readouts, per system ID
+# (as in ALLEGRO_o1_v03, can be overridden reading them from the XML)
+defaultEncodingMap = {
+    4 : "system:0:4,cryo:4:1,type:5:3,subtype:8:3,layer:11:8,module:19:11,theta:30:10",
+    5 : "system:0:4,cryo:4:1,type:5:3,subtype:8:3,side:11:-2,wheel:13:3,layer:16:12,module:28:11,rho:39:8,z:47:8",
+    8 : "system:0:4,layer:4:5,row:9:9,theta:18:9,phi:27:10",
+    9 : "system:0:4,type:4:3,layer:7:6,row:13:11,theta:24:11,phi:35:10"
+}
+
+
+class BitField:
+    """A field of the cellID: name, offset and width in bits, signedness"""
+
+    def __init__(self, name, offset, width, signed):
+        self._name = name
+        self.offset = offset
+        self.width = width
+        self.signed = signed
+        self.mask = ((1 << width) - 1) << offset
+        self.minValue = -(1 << (width - 1)) if signed else 0
+        self.maxValue = (1 << (width - 1)) - 1 if signed else (1 << width) - 1
+
+    # same accessor as dd4hep::BitFieldElement
+    def name(self):
+        return self._name
+
+    def description(self):
+        width = -self.width if self.signed else self.width
+        return f"{self._name}:{self.offset}:{width}"
+
+
+class BitFieldCoder:
+    """Decode and encode cellIDs according to an encoding string.
+
+    get/set mimic dd4hep::BitFieldCoder for single values; they and
+    decode/encode also accept numpy arrays and then work on all of them
+    at once.
+    """
+
+    def __init__(self, description):
+        self._fields = []
+        self._index = {}
+        offset = 0
+        for token in description.split(","):
+            parts = token.strip().split(":")
+            if len(parts) == 3:
+                offset = int(parts[1])
+            elif len(parts) != 2:
+                raise ValueError(f"Invalid field '{token}' in encoding '{description}'")
+            width = int(parts[-1])
+            field = BitField(parts[0], offset, abs(width), width < 0)
+            if field.width == 0 or offset + field.width > 64:
+                raise ValueError(f"Field '{token}' does not fit in 64 bits")
+            self._index[field.name()] = len(self._fields)
+            self._fields.append(field)
+            offset += field.width
+
+    def fields(self):
+        return self._fields
+
+    def fieldNames(self):
+        return [field.name() for field in self._fields]
+
+    def field(self, name):
+        return self._fields[self._index[name]]
+
+    def fieldDescription(self):
+        return ",".join(field.description() for field in self._fields)
+
+    def get(self, cellID, name):
+        """Value of field name for one cellID (int) or an array of cellIDs (int64 array)"""
+        field = self.field(name)
+        scalar = np.ndim(cellID) == 0
+        ids = np.asarray(cellID, dtype=np.uint64)
+        value = ((ids >> np.uint64(field.offset)) & np.uint64((1 << field.width) - 1)).astype(np.int64)
+        if field.signed:
+            value = np.where(value > field.maxValue, value - (1 << field.width), value)
+        return int(value) if scalar else value
+
+    def decode(self, cellIDs):
+        """Return a dict field name -> values for the given cellID(s)"""
+        return {name: self.get(cellIDs, name) for name in self.fieldNames()}
+
+    def set(self, cellID, name, value):
+        """Return cellID(s) with field name set to value"""
+        field = self.field(name)
+        value = np.asarray(value, dtype=np.int64)
+        if np.any(value < field.minValue) or np.any(value > field.maxValue):
+            raise ValueError(f"Value out of range for field {name} ({field.minValue}..{field.maxValue})")
+        bits = (value.astype(np.uint64) << np.uint64(field.offset)) & np.uint64(field.mask)
+        result = (np.asarray(cellID, dtype=np.uint64) & ~np.uint64(field.mask)) | bits
+        return int(result) if result.ndim == 0 else result
+
+    def encode(self, **values):
+        """Build cellID(s) from field values, e.g. encode(system=4, layer=layers, ...).
+        Fields not given are set to 0."""
+        cellID = np.uint64(0)
+        for name, value in values.items():
+            cellID = self.set(cellID, name, value)
+        return cellID
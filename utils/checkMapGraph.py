@@ -0,0 +1,189 @@
+#
+# checkMapGraph.py
+#
+# check the structure of a neighbour or crosstalk map seen as a graph of
+# cells: every link is looked up at once in the CSR copy of the map
+# (csrMap.py), and the violations are reported per subsystem
+#  - duplicated cells (entries with the same cellId)
+#  - self links and duplicated links within an entry
+#  - dangling links: neighbour cellIds that have no entry in the map
+#  - asymmetric links: B in N(A) but A not in N(B)
+#  - (crosstalk maps) links whose coefficient differs from the reverse one
+# The degree distribution per system and layer and the number of links
+# between systems (e.g. added by --link-calos / --link-ecal / --link-hcal)
+# are printed as well.
+#
+# Usage:
+#   python checkMapGraph.py neighbours neighbours_map_ecalB_ecalE_hcalB_hcalE.root
+#   python checkMapGraph.py xtalk xtalk_neighbours_map_ecalB_thetamodulemerged.root --json report.json
+#
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import mapTools
+from csrMap import loadCSRMap
+from bitFieldCoder import BitFieldCoder, defaultEncodingMap
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
+
+systemNames = {
+    4: "ECalBarrel",
+    5: "ECalEndcap",
+    8: "HCalBarrel",
+    9: "HCalEndcap",
+}
+
+
+def systemName(system):
+    return systemNames.get(int(system), f"system{int(system)}")
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Check the graph structure of a neighbour or crosstalk map")
+    parser.add_argument("maptype", choices=["neighbours", "xtalk"], help="Type of map")
+    parser.add_argument("filename", type=str, help="Map (ROOT file, or folder of its CSR copy)")
+    parser.add_argument("--compact", type=str, default=None,
+                        help="Compact file (relative to $K4GEO) to read the encodings from, default: built-in encodings")
+    parser.add_argument("--tolerance", type=float, default=1e-9,
+                        help="Crosstalk maps: maximum difference between the coefficients of a link and of its reverse")
+    parser.add_argument("--examples", type=int, default=3, help="Number of example cellIds printed per violation")
+    parser.add_argument("--json", type=str, default=None, help="Write the report to a JSON file")
+    return parser.parse_args()
+
+
+# ================================
+# Checks
+# ================================
+def countPerSystem(systems, mask):
+    """dict system name -> number of True entries of mask"""
+    values, counts = np.unique(systems[mask], return_counts=True)
+    return {systemName(v): int(c) for v, c in zip(values, counts)}
+
+
+def findLinks(keys, queries):
+    """Position of each query in the sorted array keys, -1 if absent"""
+    pos = np.minimum(np.searchsorted(keys, queries), max(len(keys) - 1, 0))
+    found = (keys[pos] == queries) if len(keys) else np.zeros(len(queries), dtype=bool)
+    return np.where(found, pos, -1)
+
+
+def checkGraph(csr, tolerance=1e-9, nExamples=3):
+    cellIds = np.asarray(csr.cellIds)
+    nCells = len(cellIds)
+    degrees = csr.degrees()
+    source = csr.sourceRows()
+    targetIds = np.asarray(csr.links)
+    cellSystem = mapTools.systemOf(cellIds).astype(np.int64)
+    linkSystem = cellSystem[source]
+    report = {"cells": nCells, "links": int(len(targetIds)), "violations": {}, "examples": {}}
+
+    def record(name, mask, systems, exampleIds):
+        report["violations"][name] = countPerSystem(systems, mask)
+        report["examples"][name] = [int(c) for c in exampleIds[mask][:nExamples]]
+
+    # duplicated cells (the ids are sorted)
+    duplicated = np.zeros(nCells, dtype=bool)
+    duplicated[1:] = cellIds[1:] == cellIds[:-1]
+    record("duplicated cells", duplicated, cellSystem, cellIds)
+
+    # target row of each link (-1 for dangling links)
+    target = findLinks(cellIds, targetIds)
+    record("self links", targetIds == cellIds[source], linkSystem, cellIds[source])
+    dangling = target < 0
+    record("dangling links", dangling, linkSystem, cellIds[source])
+
+    # links as integer keys source * nCells + target, sorted once
+    valid = ~dangling
+    keys = source[valid] * nCells + target[valid]
+    order = np.argsort(keys, kind="stable")
+    sortedKeys = keys[order]
+    duplicatedLinks = np.zeros(len(keys), dtype=bool)
+    duplicatedLinks[order[1:]] = sortedKeys[1:] == sortedKeys[:-1]
+    record("duplicated links", duplicatedLinks, linkSystem[valid], cellIds[source[valid]])
+
+    # symmetry: the reverse of each link must exist
+    reverse = target[valid] * nCells + source[valid]
+    reversePos = findLinks(sortedKeys, reverse)
+    record("asymmetric links", reversePos < 0, linkSystem[valid], cellIds[source[valid]])
+
+    # crosstalk coefficients of a link and of its reverse
+    if csr.maptype == "xtalk" and "list_crosstalks" in csr.arrays:
+        coefficients = np.asarray(csr.arrays["list_crosstalks"])[valid]
+        hasReverse = reversePos >= 0
+        reverseCoefficients = coefficients[order[np.where(hasReverse, reversePos, 0)]]
+        differ = hasReverse & (np.abs(coefficients - reverseCoefficients) > tolerance)
+        record("asymmetric crosstalk coefficients", differ, linkSystem[valid], cellIds[source[valid]])
+
+    # links between systems
+    targetSystem = np.where(dangling, -1, cellSystem[np.where(dangling, 0, target)])
+    pairs, counts = np.unique(np.stack([linkSystem, targetSystem]), axis=1, return_counts=True)
+    report["links between systems"] = {f"{systemName(a)} -> {systemName(b) if b >= 0 else 'missing'}": int(c)
+                                       for (a, b), c in zip(pairs.T, counts)}
+    return report, degrees, cellSystem
+
+
+def degreeTable(cellIds, degrees, cellSystem, coders):
+    """Degree statistics per system and layer"""
+    table = {}
+    for system in np.unique(cellSystem):
+        rows = np.flatnonzero(cellSystem == system)
+        coder = coders.get(int(system))
+        layers = coder.get(cellIds[rows], "layer") if coder and "layer" in coder.fieldNames() else np.zeros(len(rows), dtype=np.int64)
+        for layer in np.unique(layers):
+            d = degrees[rows[layers == layer]]
+            table[f"{systemName(system)} layer {int(layer)}"] = {
+                "cells": int(len(d)), "min": int(d.min()), "mean": float(d.mean()), "max": int(d.max()),
+                "histogram": {int(k): int(v) for k, v in enumerate(np.bincount(d)) if v},
+            }
+    return table
+
+
+def loadCoders(compact):
+    if compact:
+        from geometrySnapshot import loadSnapshot
+        snapshot = loadSnapshot(os.path.join(os.environ.get("K4GEO", ""), compact))
+        readouts = {4: "ECalBarrelModuleThetaMerged", 5: "ECalEndcapTurbine", 8: "HCalBarrelReadout", 9: "HCalEndcapReadout"}
+        return {system: BitFieldCoder(snapshot.encoding(readout)) for system, readout in readouts.items()}
+    return {system: BitFieldCoder(encoding) for system, encoding in defaultEncodingMap.items()}
+
+
+def main():
+    args = parseArgs()
+    if not os.path.exists(args.filename):
+        print(f"Error: map '{args.filename}' does not exist.", file=sys.stderr)
+        return 1
+    csr = loadCSRMap(args.filename, args.maptype)
+    report, degrees, cellSystem = checkGraph(csr, args.tolerance, args.examples)
+    report["map"] = args.filename
+    report["degrees"] = degreeTable(np.asarray(csr.cellIds), degrees, cellSystem, loadCoders(args.compact))
+
+    print(f"\nMap {args.filename}: {report['cells']} cells, {report['links']} links")
+    print("\nLinks between systems:")
+    for pair, count in report["links between systems"].items():
+        print(f"  {pair:35s} {count:>12d}")
+    print("\nDegree per system and layer:")
+    print(f"  {'':25s} {'cells':>10s} {'min':>6s} {'mean':>8s} {'max':>6s}")
+    for name, stats in report["degrees"].items():
+        print(f"  {name:25s} {stats['cells']:>10d} {stats['min']:>6d} {stats['mean']:>8.2f} {stats['max']:>6d}")
+    print("\nViolations:")
+    nViolations = 0
+    for name, perSystem in report["violations"].items():
+        total = sum(perSystem.values())
+        nViolations += total
+        details = ", ".join(f"{s}: {n}" for s, n in perSystem.items())
+        print(f"  {name:35s} {total:>10d}" + (f"   ({details}; e.g. cells {report['examples'][name]})" if total else ""))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print("\nReport written to", args.json)
+    if nViolations:
+        print("\nThe map has", nViolations, "violations")
+        return 1
+    print("\nNo violations found")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,89 +1,213 @@
 #
 # script to compare noise or neighbour maps in different root files
-# Usage: compareMaps.py <noise/neighbours> [file1.root] [file2.root]")
+# Usage: compareMaps.py <noise/neighbours/xtalk> [file1.root] [file2.root]")
+#
+# By default the trees are read entry by entry with PyROOT. With --columnar
+# the branches are read in bulk with uproot and compared as whole arrays,
+# which is much faster for the full-detector maps. With --ignoreCounts the
+# maps are always read in bulk and joined on cellId; with --nproc N this is
+# done in N processes, one shard per system, and the results are merged.
 #
 
-import ROOT
+import os
 import sys
-from tqdm import tqdm
 import argparse
 
-parser = argparse.ArgumentParser(
-    description="Compare noise, neighbour or cross-talk neighbour maps between two files"
-)
-parser.add_argument("maptype", type=str, help="Either noise, neighbour or xtalk")
-parser.add_argument("file1", type=str, help="The first file to compare")
-parser.add_argument("file2", type=str, help="The second file to compare")
-parser.add_argument(
-    "--nevts", type=int, default=-1,
-    help="The number of events to process (optional; default: all)"
-)
-parser.add_argument(
-    "--verbose", action="store_true",
-    help="Print verbose output (full file content)"
-)
-parser.add_argument(
-    "--ignoreCounts", action="store_true",
-    help="Ignore that the trees have different counts and match entries by key"
-)
-parser.add_argument(
-    "--debugevts", type=int, default=-1,
-    help="If >0, will print the values of the different branches for the first given number of different events"
-)
-args = parser.parse_args()
-print("")
-
-ROOT.gROOT.SetBatch()
-ROOT.EnableImplicitMT()
-
-nevts = args.nevts
-filename1 = args.file1
-filename2 = args.file2
-maptype = args.maptype
-# debug = args.debug
-debug = args.debugevts>0
-debugprint = args.debugevts
-verbose = args.verbose
-ignoreCounts = args.ignoreCounts
-
-file1 = ROOT.TFile(filename1)
-file2 = ROOT.TFile(filename2)
-
-if maptype=="neighbours":
-    treeName = "neighbours"
-    branchList = ["cellId", "neighbours"]
-elif maptype=="noise":
-    treeName = "noisyCells"
-    branchList = ["cellId", "noiseLevel", "noiseOffset"]
-elif maptype=="xtalk":
-    treeName = "crosstalk_neighbours"
-    branchList = ["cellId", "list_crosstalk_neighbours", "list_crosstalks", "CellInfo"]
-else:
-    print("Wrong argument")
-    sys.exit(1)
-
-tree1 = file1.Get(treeName)
-tree2 = file2.Get(treeName)
-
-total_entries = tree1.GetEntries()
-if total_entries != tree2.GetEntries():
-    print("Trees do not have equal numbers of entries")
-    print("Respectively: %lu and %lu" % (total_entries, tree2.GetEntries()))
-    if not ignoreCounts:
-        print("Exiting..")
-        sys.exit(1)
+
+def parseArgs():
+    parser = argparse.ArgumentParser(
+        description="Compare noise, neighbour or cross-talk neighbour maps between two files"
+    )
+    parser.add_argument("maptype", type=str, help="Either noise, neighbour or xtalk")
+    parser.add_argument("file1", type=str, help="The first file to compare")
+    parser.add_argument("file2", type=str, help="The second file to compare")
+    parser.add_argument(
+        "--nevts", type=int, default=-1,
+        help="The number of events to process (optional; default: all)"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true",
+        help="Print verbose output (full file content)"
+    )
+    parser.add_argument(
+        "--ignoreCounts", action="store_true",
+        help="Ignore that the trees have different counts and match entries by key"
+    )
+    parser.add_argument(
+        "--debugevts", type=int, default=-1,
+        help="If >0, will print the values of the different branches for the first given number of different events"
+    )
+    parser.add_argument(
+        "--columnar", action="store_true",
+        help="Read the branches in bulk and compare them as arrays (entries are aligned by cellId)"
+    )
+    parser.add_argument(
+        "--nproc", type=int, default=1,
+        help="If >1, split the maps by system and compare the shards in the given number of processes (implies matching entries by key)"
+    )
+    parser.add_argument(
+        "--cells", type=str, default="",
+        help="Comma-separated list of cellIDs: only compare these cells, looked up through the cellId index of each map"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.,
+        help="Maximum absolute difference for floating point values to be considered equal (columnar and ignoreCounts modes only; default: exact comparison)"
+    )
+    return parser.parse_args()
+
+
+# =============================================
+# Columnar comparison (uproot + numpy/awkward)
+# =============================================
+def compareColumnar(args, branchList):
+    import numpy as np
+    import mapTools
+
+    cols1 = mapTools.readMap(args.file1, args.maptype)
+    cols2 = mapTools.readMap(args.file2, args.maptype)
+    branchList = [b for b in branchList if b in cols1 and b in cols2]
+
+    # align the two maps by sorting both of them by cellId
+    cols1, entries1 = mapTools.sortByCellId(cols1)
+    cols2, entries2 = mapTools.sortByCellId(cols2)
+    # limit the comparison to the first nevts aligned rows (not entries of each file, which may be in different orders)
+    if args.nevts > 0:
+        rows = slice(0, args.nevts)
+        cols1, entries1 = mapTools.takeRows(cols1, rows), entries1[rows]
+        cols2, entries2 = mapTools.takeRows(cols2, rows), entries2[rows]
+    total_entries = mapTools.numEntries(cols1)
+
+    diffs, anyDiff = mapTools.compareColumns(cols1, cols2, args.tolerance)
+    badRows = np.flatnonzero(anyDiff)
+
+    if args.verbose:
+        for row in range(total_entries):
+            print("Entry", entries1[row])
+            content1 = mapTools.rowContent(cols1, row)
+            content2 = mapTools.rowContent(cols2, row)
+            for branch in branchList:
+                print("Branch", branch)
+                print("  file1: ", content1[branch])
+                print("  file2: ", content2[branch])
+
+    print("\nNumber of different entries: ", len(badRows))
+    for branch in branchList:
+        print(f"Branch {branch} has {int(diffs[branch].sum())} differences")
+
+    if args.debugevts > 0 and len(badRows) > 0:
+        nentries = min(args.debugevts, len(badRows))
+        print(f"\nContent of first {nentries} different entries")
+        for row in badRows[:nentries]:
+            print("\nEntry:", entries1[row])
+            if entries1[row] != entries2[row]:
+                print("(entry in file 2:", entries2[row], ")")
+            content1 = mapTools.rowContent(cols1, row)
+            content2 = mapTools.rowContent(cols2, row)
+            print("File 1:")
+            for branch in branchList:
+                print(branch, content1[branch])
+            print("File 2:")
+            for branch in branchList:
+                print(branch, content2[branch])
+
+    return 1 if len(badRows) > 0 else 0
+
+
+def compareByKey(args, branchList, total_entries):
+    import mapTools
+
+    maxMismatches = max(args.debugevts, 0)
+    if args.nproc > 1:
+        # one shard per system (lowest 4 bits of the cellId), compared in parallel
+        summary = mapTools.compareInShards(args.file1, args.file2, args.maptype, args.nproc,
+                                           args.tolerance, maxMismatches, args.nevts)
     else:
-        print("Ignoring..")
-else:
-    print("Trees have equal numbers of entries:", total_entries)
+        # one sequential bulk read per file, then join the two maps on cellId
+        cols1 = mapTools.readMap(args.file1, args.maptype)
+        cols2 = mapTools.readMap(args.file2, args.maptype)
+        summary = mapTools.compareByCellId(cols1, cols2, args.tolerance, maxMismatches, args.nevts)
+    branchList = [b for b in branchList if b in summary["diffs"]]
 
+    print("\nNumber of entries present in 1st file but missing in 2nd one:", len(summary["only1"]))
+    if len(summary["only1"])>0:
+        print("List:")
+        for (entry, cellid) in summary["only1"]:
+            print(f"Entry = {entry}, cellID = {cellid}")
+    print("\nNumber of entries present in 2nd file but missing in 1st one:", len(summary["only2"]))
+    if len(summary["only2"])>0:
+        print("List:")
+        for (entry, cellid) in summary["only2"]:
+            print(f"Entry = {entry}, cellID = {cellid}")
+
+    print(f"\nRan over {total_entries} entries")
+    print("\nNumber of entries common to both files and with same content", summary["ncommon"] - summary["nbad"])
+    print("\nNumber of entries common to both files but with differences:", summary["nbad"])
+    for branch in branchList:
+        print(f"Branch {branch} has {summary['diffs'][branch]} differences")
+
+    if summary["mismatches"]:
+        print(f"\nDetails of first {len(summary['mismatches'])} mismatches:")
+        print(f"File1:", args.file1)
+        print(f"File2:", args.file2)
+        for (cellid, entry1, entry2, content1, content2) in summary["mismatches"]:
+            print("\nFile 1:", entry1, "File 2:", entry2)
+            for branch in branchList:
+                print(f"{branch}: old={content1[branch]}  new={content2[branch]}")
+
+    return 1 if summary["nbad"] > 0 else 0
+
+
+def compareCells(args, branchList):
+    import mapTools
+
+    cells = [int(x, 0) for x in args.cells.split(",")]
+    treeName = mapTools.treeNames[args.maptype]
+    entries1 = mapTools.findMapEntries(args.file1, treeName, cells)
+    entries2 = mapTools.findMapEntries(args.file2, treeName, cells)
+    # entries of a CSR copy are its rows, sorted by cellId
+    label1 = "CSR row" if os.path.isdir(args.file1) else "entry"
+    label2 = "CSR row" if os.path.isdir(args.file2) else "entry"
+
+    nbad = 0
+    for cellid, entry1, entry2 in zip(cells, entries1, entries2):
+        print("\ncellID:", cellid)
+        if entry1 < 0 or entry2 < 0:
+            if entry1 < 0:
+                print("Missing in 1st file")
+            if entry2 < 0:
+                print("Missing in 2nd file")
+            nbad += 1
+            continue
+        cols1 = mapTools.readMap(args.file1, args.maptype, entry1, entry1 + 1)
+        cols2 = mapTools.readMap(args.file2, args.maptype, entry2, entry2 + 1)
+        diffs, anyDiff = mapTools.compareColumns(cols1, cols2, args.tolerance)
+        content1 = mapTools.rowContent(cols1, 0)
+        content2 = mapTools.rowContent(cols2, 0)
+        print("File 1:", label1, entry1)
+        for branch in branchList:
+            print(branch, content1.get(branch))
+        print("File 2:", label2, entry2)
+        for branch in branchList:
+            print(branch, content2.get(branch))
+        for branch, mask in diffs.items():
+            if mask[0]:
+                print(f"Branch {branch} is different")
+        if anyDiff[0]:
+            nbad += 1
 
-# decide on how many entries to run based on command line args
-if nevts>0:
-    total_entries = min(total_entries, nevts)
+    print("\nNumber of requested cells missing or with differences:", nbad)
+    return 1 if nbad > 0 else 0
+
+
+# =============================================
+# Entry-by-entry comparison (PyROOT)
+# =============================================
+def compareSorted(args, tree1, tree2, branchList, total_entries, use_tqdm):
+    from tqdm import tqdm
+
+    debug = args.debugevts > 0
+    verbose = args.verbose
 
-use_tqdm = sys.stderr.isatty()
-if not ignoreCounts:       # standard search: same number of entries, assume sorted in same way
     # initialise counters
     badEntries = []
     file1Values = {}
@@ -137,7 +261,7 @@ if not ignoreCounts:       # standard search: same number of entries, assume sor
 
     if debug:
         if len(badEntries)>0:
-            nentries = min(debugprint, len(badEntries))
+            nentries = min(args.debugevts, len(badEntries))
             print(f"\nContent of first {nentries} different entries")
             for i in range(nentries):
                 print("\nEntry:", badEntries[i])
@@ -147,114 +271,80 @@ if not ignoreCounts:       # standard search: same number of entries, assume sor
                 print("File 2:")
                 for branch in branchList:
                     print(branch, file2Values[branch][i])
-    if len(badEntries)>0:
-        sys.exit(1)
-
-else:    # compare entries by looking for same cellId in two trees
-    # index second tree by the key (cellId) for fast lookup
-    index2 = {}
-    for j in range(tree2.GetEntries()):
-        tree2.GetEntry(j)
-        key = getattr(tree2, "cellId")
-        index2[key] = j
-    # same for first tree
-    index1 = {}
-    for i in range(tree1.GetEntries()):
-        tree1.GetEntry(i)
-        key = getattr(tree1, "cellId")
-        index1[key] = i
+    return 1 if len(badEntries) > 0 else 0
 
-    badEntries = []
-    missingEntries1 = []
-    missingEntries2 = []
-    goodEntries = 0
-    diffs = {b: 0 for b in branchList}
-
-    # check entries in second tree but not in first one
-    for j in tqdm(range(tree2.GetEntries()), mininterval=0.2, disable=not use_tqdm):
-        tree2.GetEntry(j)
-        key2 = getattr(tree2, "cellId")
-        if key2 not in index1:
-            # no matching event in new tree
-            missingEntries1.append((j,key2))
-            continue
 
-    # check entries in first tree but not in second one
-    for i in tqdm(range(tree1.GetEntries()), mininterval=0.2, disable=not use_tqdm):
-        tree1.GetEntry(i)
-        key1 = getattr(tree1, "cellId")
-        if key1 not in index2:
-            # no matching event in new tree
-            missingEntries2.append((i,key1))
-            continue
+def main():
+    args = parseArgs()
+    print("")
 
-    print("\nNumber of entries present in 1st file but missing in 2nd one:", len(missingEntries2))
-    if len(missingEntries2)>0:
-        print("List:")
-        for (entry, cellid) in missingEntries2:
-            print(f"Entry = {entry}, cellID = {cellid}")
-    print("\nNumber of entries present in 2nd file but missing in 1st one:", len(missingEntries1))
-    if len(missingEntries1)>0:
-        print("List:")
-        for (entry, cellid) in missingEntries1:
-            print(f"Entry = {entry}, cellID = {cellid}")
+    maptype = args.maptype
+    if maptype=="neighbours":
+        treeName = "neighbours"
+        branchList = ["cellId", "neighbours"]
+    elif maptype=="noise":
+        treeName = "noisyCells"
+        branchList = ["cellId", "noiseLevel", "noiseOffset"]
+    elif maptype=="xtalk":
+        treeName = "crosstalk_neighbours"
+        branchList = ["cellId", "list_crosstalk_neighbours", "list_crosstalks", "CellInfo"]
+    else:
+        print("Wrong argument")
+        return 1
 
-    # now compare common entries (cellID in both files) - slow, so might want to run over only a fraction of events
-    # iterate first tree, match by key
-    for i in tqdm(range(total_entries), mininterval=0.2, disable=not use_tqdm):
-        tree1.GetEntry(i)
-        key1 = getattr(tree1, "cellId")
-        if key1 not in index2:
-            # no matching event in new tree
-            continue
+    if args.cells:
+        return compareCells(args, branchList)
 
-        # beware: sloooow
-        j = index2[key1]
-        tree2.GetEntry(j)
+    # the key-based comparison (--ignoreCounts or --nproc) always reads the branches in bulk
+    byKey = args.ignoreCounts or args.nproc > 1
+    columnar = args.columnar or byKey
+    if columnar:
+        import mapTools
+        entries1 = mapTools.countEntries(args.file1, treeName)
+        entries2 = mapTools.countEntries(args.file2, treeName)
+    else:
+        import ROOT
+        ROOT.gROOT.SetBatch()
+        ROOT.EnableImplicitMT()
 
-        diff = False
-        for branch in branchList:
-            if branch == "neighbours":
-                file1List = sorted(list(getattr(tree1, branch)))
-                file2List = sorted(list(getattr(tree2, branch)))
-                if file1List != file2List:
-                    diff = True
-                    diffs[branch] += 1
-            else:
-                if getattr(tree1, branch) != getattr(tree2, branch):
-                    diff = True
-                    diffs[branch] += 1
+        file1 = ROOT.TFile(args.file1)
+        file2 = ROOT.TFile(args.file2)
+        tree1 = file1.Get(treeName)
+        tree2 = file2.Get(treeName)
+        entries1 = tree1.GetEntries()
+        entries2 = tree2.GetEntries()
 
-        if diff:
-            badEntries.append((i, j))
-            # stop early if not debugging
-            if debugprint <= 0:
-                break
+    total_entries = entries1
+    if total_entries != entries2:
+        print("Trees do not have equal numbers of entries")
+        print("Respectively: %lu and %lu" % (total_entries, entries2))
+        if not args.ignoreCounts:
+            print("Exiting..")
+            return 1
         else:
-            goodEntries+=1
+            print("Ignoring..")
+    else:
+        print("Trees have equal numbers of entries:", total_entries)
 
-    print(f"\nRan over {total_entries} entries")
-    print("\nNumber of entries common to both files and with same content", goodEntries)
-    print("\nNumber of entries common to both files but with differences:", len(badEntries))
-    for branch in branchList:
-        print(f"Branch {branch} has {diffs[branch]} differences")
+    # decide on how many entries to run based on command line args
+    if args.nevts>0:
+        total_entries = min(total_entries, args.nevts)
 
-    if debugprint > 0 and badEntries:
-        nentries = min(debugprint, len(badEntries))
-        print(f"\nDetails of first {nentries} mismatches:")
-        print(f"File1:", filename1)
-        print(f"File2:", filename2)
-        for idx in range(nentries):
-            i, j = badEntries[idx]
-            print("\nFile 1:", i, "File 2:", j)
-            tree1.GetEntry(i)
-            tree2.GetEntry(j)
-            for branch in branchList:
-                val1 = getattr(tree1, branch)
-                val2 = getattr(tree2, branch)
-                print(f"{branch}: old={tree1}  new={tree2}")
+    use_tqdm = sys.stderr.isatty()
+    if byKey:
+        # compare entries by looking for same cellId in two trees
+        result = compareByKey(args, branchList, total_entries)
+    elif columnar:
+        result = compareColumnar(args, branchList)
+    else:
+        # standard search: same number of entries, assume sorted in same way
+        result = compareSorted(args, tree1, tree2, branchList, total_entries, use_tqdm)
+    if result != 0:
+        return result
+
+    print("")
+    return 0
 
-    if len(badEntries)>0:
-        sys.exit(1)
 
-print("")
+if __name__ == "__main__":
+    sys.exit(main())
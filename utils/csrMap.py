@@ -0,0 +1,209 @@
+#
+# csrMap.py
+#
+# compressed sparse row (CSR) copy of the neighbour and crosstalk maps, that
+# can be memory-mapped instead of deserialising one std::vector per entry
+#
+# A map <map>.root is converted to the folder <map>.csr containing
+#   cellId.npy       uint64 [N]     cellIds, sorted in increasing order
+#   offsets.npy      int64  [N+1]   the links of cell i are in [offsets[i], offsets[i+1])
+#   <branch>.npy     [M]            flat content of each vector branch (neighbours, or
+#                                   list_crosstalk_neighbours and list_crosstalks)
+#   <branch>.npy     [N]            scalar branches, if any
+#   meta.json        map type, branch names, size/mtime/checksum of the source map
+#
+# Usage:
+#   python csrMap.py neighbours neighbours_map_ecalB_ecalE_hcalB_hcalE.root
+#
+#   from csrMap import loadCSRMap
+#   csr = loadCSRMap("neighbours_map_ecalB_ecalE_hcalB_hcalE.root")   # converts if needed
+#   neighbours = csr.neighboursOf(cellId)                             # view, no copy
+#
+# The CSR folder can also be given instead of the ROOT file to
+# mapTools.readMap (and thus compareMaps.py --columnar) and printCell.py.
+#
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import awkward as ak
+import uproot
+import mapTools
+
+csrVersion = 1
+suffix = ".csr"
+
+# branch holding the neighbour cellIds for each type of map
+linkBranches = {
+    "neighbours": "neighbours",
+    "xtalk": "list_crosstalk_neighbours",
+}
+
+
+def csrFolder(filename):
+    return filename + suffix
+
+
+# ================================
+# Conversion
+# ================================
+def convert(filename, maptype, output=None, stepSize="200 MB"):
+    """Convert a ROOT map to the CSR format, return the output folder.
+    The map is read twice in chunks: first the cellIds and the lengths of the
+    lists, then the content that is scattered to its sorted position in the
+    (memory-mapped) output arrays."""
+    output = output or csrFolder(filename)
+    treeName = mapTools.treeNames[maptype]
+    linkBranch = linkBranches[maptype]
+    os.makedirs(output, exist_ok=True)
+
+    with uproot.open(filename) as f:
+        tree = f[treeName]
+        branches = [b for b in mapTools.branchLists[maptype] if b in tree]
+        cellIds = tree["cellId"].array(library="np").astype(np.uint64)
+        counts = np.concatenate([ak.to_numpy(ak.num(chunk[linkBranch]))
+                                 for chunk in tree.iterate([linkBranch], step_size=stepSize)]) if len(cellIds) else np.zeros(0, dtype=np.int64)
+
+        # sorted row of each entry, and offsets of the rows
+        order = np.argsort(cellIds, kind="stable")
+        rowOfEntry = np.empty(len(order), dtype=np.int64)
+        rowOfEntry[order] = np.arange(len(order))
+        offsets = np.zeros(len(cellIds) + 1, dtype=np.int64)
+        np.cumsum(counts[order], out=offsets[1:])
+        np.save(os.path.join(output, "cellId.npy"), cellIds[order])
+        np.save(os.path.join(output, "offsets.npy"), offsets)
+
+        # content of the branches, filled chunk by chunk
+        vectorBranches, scalarBranches = [], []
+        arrays = {}
+        entryStart = 0
+        for chunk in tree.iterate([b for b in branches if b != "cellId"], step_size=stepSize):
+            nChunk = len(chunk)
+            rows = rowOfEntry[entryStart:entryStart + nChunk]
+            chunkCounts = counts[entryStart:entryStart + nChunk]
+            # destination of each element of the flattened lists
+            destination = np.repeat(offsets[rows] - np.cumsum(chunkCounts) + chunkCounts, chunkCounts) + np.arange(chunkCounts.sum())
+            for branch in chunk.fields:
+                column = chunk[branch]
+                if column.ndim == 1:
+                    values, index, size = ak.to_numpy(column), rows, len(cellIds)
+                elif np.array_equal(ak.to_numpy(ak.num(column)), chunkCounts):
+                    values, index, size = ak.to_numpy(ak.flatten(column)), destination, int(offsets[-1])
+                else:
+                    print(f"WARNING: branch {branch} is not parallel to {linkBranch}, skipped")
+                    continue
+                if branch not in arrays:
+                    (scalarBranches if column.ndim == 1 else vectorBranches).append(branch)
+                    dtype = np.uint64 if branch == linkBranch else values.dtype
+                    arrays[branch] = np.lib.format.open_memmap(os.path.join(output, branch + ".npy"), mode="w+",
+                                                               dtype=dtype, shape=(size,))
+                arrays[branch][index] = values
+            entryStart += nChunk
+        for branch, array in arrays.items():
+            array.flush()
+        del arrays
+
+    stat = os.stat(filename)
+    mapTools.writeJson(os.path.join(output, "meta.json"), {
+        "version": csrVersion, "maptype": maptype, "tree": treeName, "source": os.path.abspath(filename),
+        "cells": len(cellIds), "links": int(offsets[-1]), "linkBranch": linkBranch,
+        "vectorBranches": vectorBranches, "scalarBranches": scalarBranches,
+        "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": mapTools.fileChecksum(filename)})
+    print(f"CSR map with {len(cellIds)} cells and {offsets[-1]} links written to {output}")
+    return output
+
+
+# ================================
+# Reader
+# ================================
+class CSRMap:
+    """Memory-mapped CSR neighbour/crosstalk map"""
+
+    def __init__(self, folder, mmap=True):
+        self.folder = folder
+        with open(os.path.join(folder, "meta.json")) as f:
+            self.meta = json.load(f)
+        mode = "r" if mmap else None
+        self.maptype = self.meta["maptype"]
+        self.cellIds = np.load(os.path.join(folder, "cellId.npy"), mmap_mode=mode)
+        self.offsets = np.load(os.path.join(folder, "offsets.npy"), mmap_mode=mode)
+        self.arrays = {b: np.load(os.path.join(folder, b + ".npy"), mmap_mode=mode)
+                       for b in self.meta["vectorBranches"] + self.meta["scalarBranches"]}
+        self.links = self.arrays[self.meta["linkBranch"]]
+
+    def __len__(self):
+        return len(self.cellIds)
+
+    def rows(self, cellIds):
+        """Row of each cellId, -1 if the cell is not in the map"""
+        cellIds = np.atleast_1d(np.asarray(cellIds, dtype=np.uint64))
+        rows = np.full(len(cellIds), -1, dtype=np.int64)
+        if len(self.cellIds) > 0:
+            pos = np.minimum(np.searchsorted(self.cellIds, cellIds), len(self.cellIds) - 1)
+            found = self.cellIds[pos] == cellIds
+            rows[found] = pos[found]
+        return rows
+
+    def degrees(self):
+        """Number of links of each cell"""
+        return np.diff(self.offsets)
+
+    def rowSlice(self, row):
+        return slice(int(self.offsets[row]), int(self.offsets[row + 1]))
+
+    def neighboursAt(self, row, branch=None):
+        """Content of a vector branch (default: the neighbour cellIds) for a row"""
+        return self.arrays[branch or self.meta["linkBranch"]][self.rowSlice(row)]
+
+    def neighboursOf(self, cellId, branch=None):
+        """Content of a vector branch for a cellId (empty if the cell is not in the map)"""
+        row = self.rows(cellId)[0]
+        if row < 0:
+            return self.arrays[branch or self.meta["linkBranch"]][:0]
+        return self.neighboursAt(row, branch)
+
+    def sourceRows(self):
+        """Row (cell) of each link, e.g. to build a sparse adjacency matrix with self.links"""
+        return np.repeat(np.arange(len(self.cellIds)), self.degrees())
+
+    def columns(self, entry_start=None, entry_stop=None):
+        """Branches as in mapTools.readMap (vector branches as awkward arrays,
+        built on the memory-mapped arrays without copy)"""
+        start = 0 if entry_start is None else entry_start
+        stop = len(self.cellIds) if entry_stop is None else min(entry_stop, len(self.cellIds))
+        offsets = ak.index.Index64(np.asarray(self.offsets[start:stop + 1]))
+        columns = {"cellId": self.cellIds[start:stop]}
+        for branch in self.meta["vectorBranches"]:
+            content = ak.contents.NumpyArray(self.arrays[branch])
+            columns[branch] = ak.Array(ak.contents.ListOffsetArray(offsets, content))
+        for branch in self.meta["scalarBranches"]:
+            columns[branch] = self.arrays[branch][start:stop]
+        return columns
+
+
+def loadCSRMap(filename, maptype="neighbours", rebuild=False):
+    """CSR copy of a map: the folder itself, or the ROOT map whose CSR copy is
+    (re)created next to it if missing or outdated"""
+    if os.path.isdir(filename):
+        return CSRMap(filename)
+    folder = csrFolder(filename)
+    metaFile = os.path.join(folder, "meta.json")
+    if rebuild or not mapTools.sidecarIsValid(filename, metaFile):
+        print(f"Converting {filename} to CSR format")
+        convert(filename, maptype, folder)
+    return CSRMap(folder)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a neighbour or crosstalk map to the CSR format")
+    parser.add_argument("maptype", choices=list(linkBranches), help="Type of map")
+    parser.add_argument("filename", type=str, help="ROOT map")
+    parser.add_argument("--output", type=str, default=None, help=f"Output folder (default: <filename>{suffix})")
+    args = parser.parse_args()
+    convert(args.filename, args.maptype, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
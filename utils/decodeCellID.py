@@ -1,7 +1,10 @@
-import ROOT
-import dd4hep
 import os
 import sys
+import argparse
+import warnings
+import numpy as np
+from bitFieldCoder import BitFieldCoder, defaultEncodingMap
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
 
 systemEB = 4
 systemEEC = 5
@@ -32,44 +35,130 @@ def readoutStr(system):
     return readoutName
 
 # ------------------------------------------------------------------
-# Parse cellIDs from command line (space-separated)
+# Read cellIDs for batch mode from text (or stdin), numpy or ROOT file
 # ------------------------------------------------------------------
-if len(sys.argv) < 2:
-    print("Usage: python decodeCellID.py <cellID1> [cellID2 ...]")
-    print("Example: python decodeCellID.py 0x834 12345")
-    sys.exit(1)
+def readCellIDs(inputSpec):
+    if inputSpec.endswith(".npy"):
+        return np.load(inputSpec).astype(np.uint64).ravel()
+    if ".root:" in inputSpec:
+        # file.root:tree:branch, the branch can be a vector (e.g. ECalBarrelCells.cellID)
+        import uproot
+        import awkward as ak
+        filename, treename, branch = inputSpec.split(":", 2)
+        with uproot.open(filename) as f:
+            values = f[treename][branch].array(library="ak")
+        return ak.to_numpy(ak.flatten(values, axis=None)).astype(np.uint64)
+    if inputSpec == "-":
+        text = sys.stdin.read()
+    else:
+        with open(inputSpec) as f:
+            text = f.read()
+    text = text.replace(",", " ")
+    if "x" not in text and "X" not in text:
+        # decimal cellIDs: parsed in bulk (exact for 64-bit values)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                ids = np.fromstring(text, dtype=np.uint64, sep=" ")
+        except ValueError:
+            ids = None
+        if ids is not None and len(ids) == len(text.split()):
+            return ids
+    # hexadecimal (or invalid) tokens: parsed one by one
+    return np.array([int(x, 0) for x in text.split()], dtype=np.uint64)
 
-cellIDs = [int(arg, 0) for arg in sys.argv[1:]]
+
+# ------------------------------------------------------------------
+# Write the decoded table to csv, npz or root file
+# ------------------------------------------------------------------
+def writeTable(filename, table):
+    if filename.endswith(".npz"):
+        np.savez(filename, **table)
+    elif filename.endswith(".root"):
+        import uproot
+        with uproot.recreate(filename) as f:
+            f["cells"] = table
+    else:
+        columns = list(table)
+        fmt = ",".join("%d" if table[c].dtype.kind in "iu" else "%.6f" for c in columns)
+        with open(filename, "w") as f:
+            f.write(",".join(columns) + "\n")
+            for row in zip(*(table[c].tolist() for c in columns)):
+                f.write(fmt % row + "\n")
+    print("Table of", len(table["cellID"]), "decoded cells written to", filename)
 
 
 # ------------------------------------------------------------------
-# Load detector geometry
+# Parse cellIDs from command line (space-separated) or input file
 # ------------------------------------------------------------------
-compactFile = "FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml"
-path_to_detector = os.environ.get("K4GEO", "")
-detectorFile = path_to_detector + "/" + compactFile
-detector = dd4hep.Detector.getInstance()
-detector.fromXML(detectorFile)
-volman = detector.volumeManager()
-print("\n" + "="*60)
-print("\nLoaded detector from compact file:", detectorFile)
-print("")
+parser = argparse.ArgumentParser(description="Decode cellIDs of the ALLEGRO calorimeters")
+parser.add_argument("cellIDs", nargs="*", help="cellIDs to decode (decimal or hex)")
+parser.add_argument("--input", type=str, default="",
+                    help="Batch mode: read cellIDs from a text file ('-' for stdin), a .npy file or a ROOT branch (file.root:tree:branch)")
+parser.add_argument("--output", type=str, default="decodedCells.csv",
+                    help="Batch mode: output table (.csv, .npz or .root)")
+parser.add_argument("--no-positions", action="store_true",
+                    help="Only decode the fields with the default encodings, without loading the geometry (no ROOT/DD4hep needed)")
+args = parser.parse_args()
+
+if not args.cellIDs and not args.input:
+    print("Usage: python decodeCellID.py <cellID1> [cellID2 ...]")
+    print("       python decodeCellID.py --input <cellIDs.txt|cellIDs.npy|file.root:tree:branch> [--output table.csv]")
+    print("Example: python decodeCellID.py 0x834 12345")
+    sys.exit(1)
+
+cellIDs = [int(arg, 0) for arg in args.cellIDs]
 
 
 # ------------------------------------------------------------------
-# Read encoding maps before loop, so that INFO messages from
-# segmentation classes do not pollute output later
+# Load detector geometry (only needed for the positions)
 # ------------------------------------------------------------------
 systems = [systemEB, systemEEC, systemHB, systemHEC]
+if args.no_positions:
+    print("\nUsing default encodings")
+    for system in systems:
+        encodingMap[system] = defaultEncodingMap[system]
+    positionTable = None
+else:
+    from geometrySnapshot import loadSnapshot
+    from cellPositions import loadCellPositions, lookupPositions
+    compactFile = "FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml"
+    path_to_detector = os.environ.get("K4GEO", "")
+    detectorFile = path_to_detector + "/" + compactFile
+    # encodings (and, if created with cellPositions.py, the cell positions)
+    # from the geometry snapshot, the geometry itself is only loaded if needed
+    snapshot = loadSnapshot(detectorFile)
+    for system in systems:
+        encodingMap[system] = snapshot.encoding(readoutStr(system))
+    positionTable = loadCellPositions(snapshot) if args.input else None
+
+
+def loadGeometry():
+    global detector, volman
+    detector = snapshot.detector()
+    volman = detector.volumeManager()
+    print("\n" + "="*60)
+    print("\nLoaded detector from compact file:", detectorFile)
+    print("")
+
+    # ------------------------------------------------------------------
+    # Read segmentations before loop, so that INFO messages from
+    # segmentation classes do not pollute output later
+    # ------------------------------------------------------------------
+    for system in systems:
+        readoutMap[system] = detector.readout(readoutStr(system))
+        segMap[system] = readoutMap[system].segmentation()
+        # to initialise layer info for Ecal barrel now
+        if (system==systemEB):
+            volumeID = system
+            _ = segMap[system].position(volumeID)
+
+
+if not args.no_positions and positionTable is None:
+    loadGeometry()
+
 for system in systems:
-    readoutMap[system] = detector.readout(readoutStr(system))
-    segMap[system] = readoutMap[system].segmentation()
-    encodingMap[system] = readoutMap[system].idSpec().fieldDescription()
-    coderMap[system] = ROOT.dd4hep.BitFieldCoder(encodingMap[system])
-    # to initialise layer info for Ecal barrel now
-    if (system==systemEB):
-        volumeID = system
-        _ = segMap[system].position(volumeID)
+    coderMap[system] = BitFieldCoder(encodingMap[system])
 
 print("\n" + "="*60)
 print("\nLoaded encoding maps:")
@@ -77,6 +166,76 @@ print("{:8s} {:30s} {:s}".format("System","readout","encoding"))
 for system in systems:
     print("{:<8d} {:30s} {:s}".format(system, readoutStr(system), encodingMap[system]))
 
+# ------------------------------------------------------------------
+# Batch mode: decode all cellIDs as arrays, write table
+# ------------------------------------------------------------------
+if args.input:
+    ids = readCellIDs(args.input)
+    print("\nRead", len(ids), "cellIDs from", args.input)
+    systemOfCell = (ids & np.uint64(0b1111)).astype(np.int64)
+
+    # union of the fields of all readouts (-1 if not defined for the readout of the cell)
+    fieldNames = []
+    for system in systems:
+        for name in coderMap[system].fieldNames():
+            if name not in fieldNames:
+                fieldNames.append(name)
+    table = {"cellID": ids}
+    positionColumns = ["pos_rho", "pos_theta", "pos_phi", "pos_z"]
+    for name in fieldNames:
+        table[name] = np.full(len(ids), -1, dtype=np.int64)
+    if not args.no_positions:
+        # prefix avoids clashes with the rho/z fields of the endcap readout (rho, z in mm)
+        for var in positionColumns:
+            table[var] = np.full(len(ids), np.nan)
+
+    unknown = ~np.isin(systemOfCell, systems)
+    if unknown.any():
+        print("WARNING:", int(unknown.sum()), "cellIDs belong to unknown systems, their fields are not decoded")
+
+    for system in systems:
+        rows = np.flatnonzero(systemOfCell == system)
+        if len(rows) == 0:
+            continue
+        for name, values in coderMap[system].decode(ids[rows]).items():
+            table[name][rows] = values
+        if args.no_positions:
+            continue
+
+        # positions (in mm): from the precomputed table if available, otherwise
+        # compute once per distinct cell, look up the volume context once per volumeID
+        uniqueIDs, inverse = np.unique(ids[rows], return_inverse=True)
+        positions = np.full((len(uniqueIDs), 4), np.nan)
+        missing = np.arange(len(uniqueIDs))
+        if positionTable is not None:
+            found = lookupPositions(positionTable, uniqueIDs)
+            positions[:] = np.stack([found["rho"], found["theta"], found["phi"], found["z"]], axis=1)
+            missing = np.flatnonzero(np.isnan(found["x"]))
+        contexts = {}
+        if len(missing) > 0:
+            if not segMap:
+                loadGeometry()
+            import dd4hep
+            seg = segMap[system]
+            for i in missing:
+                cellID = int(uniqueIDs[i])
+                volumeID = seg.volumeID(cellID)
+                vc = contexts.get(volumeID)
+                if vc is None:
+                    vc = volman.lookupContext(volumeID)
+                    contexts[volumeID] = vc
+                position = vc.localToWorld(seg.position(cellID))
+                positions[i] = (position.rho() / dd4hep.mm, position.theta(), position.phi(), position.z() / dd4hep.mm)
+        for j, var in enumerate(positionColumns):
+            table[var][rows] = positions[inverse, j]
+        print(f"System {system}: {len(rows)} cells, {len(uniqueIDs)} distinct, {len(missing)} computed with DD4hep in {len(contexts)} volumes")
+
+    writeTable(args.output, table)
+    if not args.no_positions:
+        print("Positions pos_rho, pos_z in mm, pos_theta, pos_phi in rad")
+    sys.exit(0)
+
+
 # ------------------------------------------------------------------
 # Loop over cellIDs
 # ------------------------------------------------------------------
@@ -96,8 +255,7 @@ for cellID in cellIDs:
 
     # Get readout (use caching)
     if readoutName != previous_readout:
-        readout = readoutMap[system]
-        seg = segMap[system]
+        seg = segMap.get(system)
         encoding = encodingMap[system]
         coder = coderMap[system]
         previous_readout = readoutName
@@ -105,18 +263,19 @@ for cellID in cellIDs:
     print("System:", system)
     print("Readout:", readoutName)
     print("CellID encoding:", encoding)
-    volumeID = seg.volumeID(cellID);
-    # print("volumeID:", volumeID)
-    vc = volman.lookupContext(volumeID);
-    inSeg = seg.position(cellID);
-    outSeg = vc.localToWorld(inSeg);
-    position = outSeg
-    print(f"Position (rho/theta/phi): {position.rho()}, {position.theta()}, {position.phi()}")
-    print(f"Position (rho/z/phi): {position.rho()}, {position.z()}, {position.phi()}")
+    if seg is not None:
+        volumeID = seg.volumeID(cellID);
+        # print("volumeID:", volumeID)
+        vc = volman.lookupContext(volumeID);
+        inSeg = seg.position(cellID);
+        outSeg = vc.localToWorld(inSeg);
+        position = outSeg
+        # in mm and rad, as the pos_* columns of the batch mode
+        import dd4hep
+        print(f"Position (rho [mm]/theta/phi): {position.rho() / dd4hep.mm}, {position.theta()}, {position.phi()}")
+        print(f"Position (rho [mm]/z [mm]/phi): {position.rho() / dd4hep.mm}, {position.z() / dd4hep.mm}, {position.phi()}")
     # Decode and print all fields
-    for field in coder.fields():
-        name = field.name()
-        value = coder.get(cellID, name)
+    for name, value in coder.decode(cellID).items():
         print(f"{name}: {value}")
 
 
@@ -0,0 +1,322 @@
+#
+# mapShards.py
+#
+# incremental generation of the neighbour and noise maps: the maps are
+# stored as one shard per subdetector (the entries of the cells of one
+# system), cached under a key computed from the content of the geometry, the
+# configuration of the map creation and the input noise files. Only the
+# missing shards are generated (with the usual k4run jobs, or with
+# noiseMapBuilder.py for the noise), and the requested shards are then merged
+# into a single map in the tree format expected downstream.
+#
+# Usage:
+#   python mapShards.py noise --subdetectors ecalb ecale hcalb hcale
+#   python mapShards.py noise --subdetectors ecalb ecale hcalb hcale --builder python
+#   python mapShards.py neighbours --subdetectors ecalb ecale hcalb hcale --link-calos --link-ecal --link-hcal
+#   python mapShards.py merge noise merged.root shard1.root shard2.root
+#
+# The shards are stored in $MAP_SHARD_DIR (default: ./map_shards) as
+# <maptype>_<subdetector>_<key>.root, with the configuration they were
+# created with in a .json file next to them.
+#
+# Since the neighbours of the cells at the boundaries depend on the other
+# subdetectors when they are linked (--link-*), the set of subdetectors is
+# part of the key of the neighbour shards in that case, and all of them are
+# generated together.
+#
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import uproot
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
+import mapTools
+
+shardVersion = 1
+defaultShardDir = "map_shards"
+topDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# subdetector -> system ID, readout, tag in the noise map file name, option and tag of neighbours.py
+subdetectors = {
+    "ecalb": {"system": 4, "readout": "ECalBarrelModuleThetaMerged", "noiseTag": "ecalB", "neighboursOption": "--ecalb", "neighboursTag": "ecalB"},
+    "ecale": {"system": 5, "readout": "ECalEndcapTurbine", "noiseTag": "ecalE", "neighboursOption": "--ecalec", "neighboursTag": "ecalE"},
+    "hcalb": {"system": 8, "readout": "HCalBarrelReadout", "noiseTag": "hcalB", "neighboursOption": "--hcalb", "neighboursTag": "hcalB"},
+    "hcale": {"system": 9, "readout": "HCalEndcapReadout", "noiseTag": "hcalE", "neighboursOption": "--hcalec", "neighboursTag": "hcalE"},
+}
+
+# neighbours.py options changing the neighbours of the cells of each calorimeter
+neighboursOptions = {
+    "ecal": ["diagonal_ecal", "link_calos", "link_ecal"],
+    "hcal": ["diagonal_hcal", "link_calos", "link_hcal"],
+}
+linkOptions = ["link_calos", "link_ecal", "link_hcal"]
+
+noiseFiles = {
+    "ecalb": "noise_capa_ecalbarrel/elecNoise_ecalBarrelFCCee_theta.root",
+    "ecale": "noise_capa_ecalendcap/elecNoise_ecalendcap.root",
+}
+noiseMapScript = os.path.join(topDir, "noise_maps", "noise_map.py")
+noiseBuilderScript = os.path.join(topDir, "noise_maps", "noiseMapBuilder.py")
+neighboursScript = os.path.join(topDir, "neighbor_maps", "neighbours.py")
+
+
+def outputFileName(maptype, subdets):
+    """Name of the full map, composed as in noise_map.py and neighbours.py"""
+    if maptype == "noise":
+        name = "cellNoise_map_electronicsNoiseLevel"
+        for subdet in subdetectors:
+            if subdet in subdets:
+                name += "_" + subdetectors[subdet]["noiseTag"] + "_" + subdetectors[subdet]["readout"]
+    else:
+        name = "neighbours_map"
+        for subdet in subdetectors:
+            if subdet in subdets:
+                name += "_" + subdetectors[subdet]["neighboursTag"]
+    return name + ".root"
+
+
+# ================================
+# Shard keys
+# ================================
+def shardConfig(maptype, subdet, args, geometryChecksum, cellsChecksum=None):
+    """Everything the content of a shard depends on"""
+    config = {"version": shardVersion, "maptype": maptype, "subdetector": subdet, "geometry": geometryChecksum}
+    if maptype == "noise":
+        config["builder"] = args.builder
+        script = noiseBuilderScript if args.builder == "python" else noiseMapScript
+        config["script"] = mapTools.fileChecksum(script)
+        if subdet in noiseFiles:
+            config["noiseFile"] = mapTools.fileChecksum(noiseFiles[subdet])
+        elif args.builder == "python":
+            config["hcalNoise"] = args.hcal_noise
+        if args.builder == "python":
+            config["cells"] = mapTools.fileChecksum(args.cells) if args.cells else cellsChecksum
+    else:
+        config["script"] = mapTools.fileChecksum(neighboursScript)
+        options = neighboursOptions[subdet[:4]]
+        config["options"] = {option: getattr(args, option) for option in options}
+        if any(getattr(args, option) for option in options if option in linkOptions):
+            config["linkedSubdetectors"] = sorted(args.subdetectors)
+    return config
+
+
+def snapshotCellsChecksum(detectorFile):
+    """Checksum of the table of cell positions stored in the geometry snapshot, which can be
+    recreated (geometry/cellPositions.py) without changing the geometry checksum"""
+    from geometrySnapshot import loadSnapshot
+    from cellPositions import loadCellPositions, columns
+    table = loadCellPositions(loadSnapshot(detectorFile))
+    if table is None:
+        return None
+    checksum = hashlib.sha256()
+    for column in columns:
+        checksum.update(np.ascontiguousarray(table[column]).tobytes())
+    return checksum.hexdigest()
+
+
+def shardKey(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def shardFile(shardDir, maptype, subdet, key):
+    return os.path.join(shardDir, f"{maptype}_{subdet}_{key}.root")
+
+
+# ================================
+# Splitting and merging
+# ================================
+def splitMap(filename, maptype, shardFiles):
+    """Write the entries of each system of a map (dict system -> shard file) to its shard"""
+    treeName = mapTools.treeNames[maptype]
+    if maptype == "noise":
+        # flat tree: read and written in bulk with uproot
+        columns = mapTools.readMap(filename, maptype)
+        systems = mapTools.systemOf(columns["cellId"])
+        for system, shard in shardFiles.items():
+            rows = np.flatnonzero(systems == system)
+            with uproot.recreate(shard + ".tmp") as f:
+                f[treeName] = {b: c[rows] for b, c in columns.items()}
+            os.replace(shard + ".tmp", shard)
+            print(f"Shard {shard}: {len(rows)} entries")
+        return
+
+    # trees with std::vector branches (not writable with uproot): copied with ROOT
+    import ROOT
+    fIn = ROOT.TFile.Open(filename)
+    tree = fIn.Get(treeName)
+    for system, shard in shardFiles.items():
+        fOut = ROOT.TFile(shard + ".tmp", "RECREATE")
+        selected = tree.CopyTree(f"(cellId & 0xF) == {system}")
+        selected.Write()
+        print(f"Shard {shard}: {selected.GetEntries()} entries")
+        fOut.Close()
+        os.replace(shard + ".tmp", shard)
+    fIn.Close()
+
+
+def mergeShards(maptype, shards, output):
+    """Concatenate the shards into a single map"""
+    treeName = mapTools.treeNames[maptype]
+    if maptype == "noise":
+        parts = [mapTools.readMap(shard, maptype) for shard in shards]
+        with uproot.recreate(output) as f:
+            f[treeName] = {b: np.concatenate([p[b] for p in parts]) for b in parts[0]}
+    else:
+        import ROOT
+        chain = ROOT.TChain(treeName)
+        for shard in shards:
+            chain.Add(shard)
+        chain.Merge(output)
+    print(f"Merged {len(shards)} shards into {output}")
+
+
+# ================================
+# Generation of the missing shards
+# ================================
+def runCommand(command, cwd=None):
+    print("Running:", " ".join(command))
+    result = subprocess.run(command, cwd=cwd)
+    if result.returncode != 0:
+        raise RuntimeError(f"command failed with exit code {result.returncode}: {' '.join(command)}")
+
+
+def generateNoise(subdets, args, workDir):
+    """Create the noise map of the subdetectors, return its file name"""
+    if args.builder == "python":
+        output = os.path.join(workDir, outputFileName("noise", subdets))
+        command = [sys.executable, noiseBuilderScript, "--subdetectors", *subdets, "--detector", args.detector,
+                   "--hcal-noise", str(args.hcal_noise), "--output", output]
+        if args.cells:
+            command += ["--cells", args.cells]
+        runCommand(command)
+        return output
+    # noise_map.py reads the noise files relative to the working directory and writes its output there:
+    # it is run in workDir, where the noise files are linked at the same relative paths
+    for subdet in subdets:
+        if subdet in noiseFiles:
+            link = os.path.join(workDir, noiseFiles[subdet])
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            if not os.path.lexists(link):
+                os.symlink(os.path.abspath(noiseFiles[subdet]), link)
+    runCommand(["k4run", noiseMapScript, "--subdetectors", *subdets, "--detector", args.detector], cwd=workDir)
+    return os.path.join(workDir, outputFileName("noise", subdets))
+
+
+def generateNeighbours(subdets, args, workDir):
+    command = ["k4run", neighboursScript, "--detector", args.detector]
+    command += [subdetectors[s]["neighboursOption"] for s in subdets]
+    for option in ["diagonal_ecal", "diagonal_hcal"] + linkOptions:
+        if getattr(args, option):
+            command.append("--" + option.replace("_", "-"))
+    runCommand(command, cwd=workDir)
+    return os.path.join(workDir, outputFileName("neighbours", subdets))
+
+
+def buildMap(maptype, args):
+    detectorFile = os.path.join(os.environ.get("K4GEO", ""), args.detector)
+    if not os.path.isfile(detectorFile):
+        print(f"Error: compact file '{detectorFile}' does not exist.", file=sys.stderr)
+        return 1
+    if maptype == "noise":
+        for subdet in args.subdetectors:
+            if subdet in noiseFiles and not os.path.isfile(noiseFiles[subdet]):
+                print(f"Error: noise file '{noiseFiles[subdet]}' does not exist.", file=sys.stderr)
+                return 1
+    from geometrySnapshot import compactChecksum
+    geometryChecksum = compactChecksum(detectorFile)
+
+    # subdetectors in the order of the full maps
+    subdets = [s for s in subdetectors if s in args.subdetectors]
+    shardDir = args.shard_dir or os.environ.get("MAP_SHARD_DIR", defaultShardDir)
+    os.makedirs(shardDir, exist_ok=True)
+    cellsChecksum = None
+    if maptype == "noise" and args.builder == "python" and not args.cells:
+        cellsChecksum = snapshotCellsChecksum(detectorFile)
+    configs = {s: shardConfig(maptype, s, args, geometryChecksum, cellsChecksum) for s in subdets}
+    shards = {s: shardFile(shardDir, maptype, s, shardKey(configs[s])) for s in subdets}
+    missing = [s for s in subdets if args.rebuild or not os.path.isfile(shards[s])]
+    for s in subdets:
+        print(f"{s:6s} {'to be created' if s in missing else 'cached':14s} {shards[s]}")
+    if args.dry_run:
+        return 0
+
+    if missing:
+        # linked neighbour maps need all the subdetectors in the same job
+        toGenerate = missing
+        if maptype == "neighbours" and any(getattr(args, option) for option in linkOptions):
+            toGenerate = subdets
+        with tempfile.TemporaryDirectory(dir=shardDir) as workDir:
+            if maptype == "noise":
+                fullMap = generateNoise(toGenerate, args, workDir)
+            else:
+                fullMap = generateNeighbours(toGenerate, args, workDir)
+            splitMap(fullMap, maptype, {subdetectors[s]["system"]: shards[s] for s in toGenerate})
+        for s in toGenerate:
+            with open(shards[s][:-len(".root")] + ".json", "w") as f:
+                json.dump(configs[s], f, indent=1)
+
+    output = args.output or outputFileName(maptype, subdets)
+    if len(subdets) == 1:
+        shutil.copyfile(shards[subdets[0]], output)
+        print(f"Copied shard {shards[subdets[0]]} to {output}")
+    else:
+        mergeShards(maptype, [shards[s] for s in subdets], output)
+    return 0
+
+
+# ================================
+# Command line
+# ================================
+def parseArgs():
+    parser = argparse.ArgumentParser(description="Create neighbour/noise maps from per-subdetector cached shards")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def addCommonArguments(subparser):
+        subparser.add_argument("--subdetectors", type=str, nargs="+", default=list(subdetectors), choices=list(subdetectors),
+                               help="List of subdetectors: ecalb, ecale, hcalb, hcale")
+        subparser.add_argument("--detector", type=str, default="FCCee/ALLEGRO/compact/ALLEGRO_o1_v03/ALLEGRO_o1_v03.xml",
+                               help="The detector xml file, relative to $K4GEO")
+        subparser.add_argument("--output", type=str, default=None,
+                               help="Merged map (default: name composed as in noise_map.py / neighbours.py)")
+        subparser.add_argument("--shard-dir", type=str, default=None,
+                               help=f"Folder of the shards (default: $MAP_SHARD_DIR or ./{defaultShardDir})")
+        subparser.add_argument("--rebuild", action="store_true", help="Recreate the shards even if cached")
+        subparser.add_argument("--dry-run", action="store_true", help="Only print which shards are cached")
+
+    noise = commands.add_parser("noise", help="Noise map")
+    addCommonArguments(noise)
+    noise.add_argument("--builder", choices=["gaudi", "python"], default="gaudi",
+                       help="Create the missing shards with noise_map.py (gaudi) or noiseMapBuilder.py (python)")
+    noise.add_argument("--cells", type=str, default=None, help="python builder: table of cell positions")
+    noise.add_argument("--hcal-noise", type=float, default=0.0115 / 4, help="python builder: constant HCal noise (GeV)")
+
+    neighbours = commands.add_parser("neighbours", help="Neighbour map")
+    addCommonArguments(neighbours)
+    neighbours.add_argument("--link-calos", action="store_true", help="link ECAL+HCAL")
+    neighbours.add_argument("--link-ecal", action="store_true", help="link ECAL barrel+endcap")
+    neighbours.add_argument("--link-hcal", action="store_true", help="link HCAL barrel+endcap")
+    neighbours.add_argument("--diagonal-ecal", action="store_true", help="include diagonal cells for ECal")
+    neighbours.add_argument("--diagonal-hcal", action="store_true", help="include diagonal cells for HCal")
+
+    merge = commands.add_parser("merge", help="Merge existing shards (or maps) into one map")
+    merge.add_argument("maptype", choices=["noise", "neighbours"], help="Type of map")
+    merge.add_argument("output", type=str, help="Merged map")
+    merge.add_argument("shards", type=str, nargs="+", help="Shards, in the order of the merged map")
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    if args.command == "merge":
+        mergeShards(args.maptype, args.shards, args.output)
+        return 0
+    return buildMap(args.command, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
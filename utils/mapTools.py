@@ -0,0 +1,407 @@
+#
+# mapTools.py
+#
+# columnar (uproot + numpy/awkward) access to the neighbour, noise and
+# cross-talk maps, shared by the scripts in this folder
+#
+import os
+import json
+import hashlib
+import numpy as np
+import awkward as ak
+import uproot
+
+# name of the tree and list of branches for each type of map
+treeNames = {
+    "neighbours": "neighbours",
+    "noise": "noisyCells",
+    "xtalk": "crosstalk_neighbours",
+}
+branchLists = {
+    "neighbours": ["cellId", "neighbours"],
+    "noise": ["cellId", "noiseLevel", "noiseOffset"],
+    "xtalk": ["cellId", "list_crosstalk_neighbours", "list_crosstalks", "CellInfo"],
+}
+
+# branches storing a set of cells: the order within an entry is not meaningful,
+# so each entry is sorted before comparing
+unorderedBranches = ["neighbours"]
+
+
+# ================================
+# Reading
+# ================================
+def readMap(filename, maptype, entry_start=None, entry_stop=None):
+    """Read all branches of a map in bulk (optionally only a range of entries).
+
+    Returns a dict branch -> array: numpy arrays for scalar branches,
+    awkward arrays for vector branches (rows of unordered branches are sorted).
+    The map can also be the folder of its CSR copy (csrMap.py).
+    """
+    if os.path.isdir(filename):
+        from csrMap import CSRMap
+        arrays = CSRMap(filename).columns(entry_start, entry_stop)
+        branches = list(arrays)
+    else:
+        branches = branchLists[maptype]
+        with uproot.open(filename) as f:
+            tree = f[treeNames[maptype]]
+            branches = [b for b in branches if b in tree]
+            arrays = tree.arrays(branches, entry_start=entry_start, entry_stop=entry_stop, library="ak")
+
+    columns = {}
+    for branch in branches:
+        column = arrays[branch]
+        if column.ndim == 1:
+            column = ak.to_numpy(column)
+        elif branch in unorderedBranches:
+            column = ak.sort(column, axis=1)
+        columns[branch] = column
+    return columns
+
+
+def readCellIds(filename, maptype=None, treeName=None):
+    if os.path.isdir(filename):
+        return np.load(os.path.join(filename, "cellId.npy"))
+    if treeName is None:
+        treeName = treeNames[maptype]
+    with uproot.open(filename) as f:
+        return f[treeName]["cellId"].array(library="np")
+
+
+def countEntries(filename, treeName):
+    if os.path.isdir(filename):
+        with open(os.path.join(filename, "meta.json")) as f:
+            return json.load(f)["cells"]
+    with uproot.open(filename) as f:
+        return f[treeName].num_entries
+
+
+def systemOf(cellIds):
+    """The system ID is stored in the lowest 4 bits of the cellId"""
+    return cellIds & np.uint64(0b1111)
+
+
+def numEntries(columns):
+    return len(columns["cellId"])
+
+
+def takeRows(columns, rows):
+    """Return the subset (or permutation) of the rows of all branches"""
+    return {branch: column[rows] for branch, column in columns.items()}
+
+
+def sortByCellId(columns):
+    """Sort all branches by cellId, return sorted columns and original entry numbers"""
+    order = np.argsort(columns["cellId"], kind="stable")
+    return takeRows(columns, order), order
+
+
+def joinOnCellId(columns1, columns2):
+    """Match the rows of two maps by cellId (sort-merge join).
+
+    Returns the entry numbers of the cells present in both maps (rows1, rows2,
+    aligned with each other) and those of the cells present only in the first
+    (only1) or only in the second map (only2), all ordered by cellId.
+    """
+    ids1 = columns1["cellId"]
+    ids2 = columns2["cellId"]
+    order1 = np.argsort(ids1, kind="stable")
+    order2 = np.argsort(ids2, kind="stable")
+    sorted1 = ids1[order1]
+    sorted2 = ids2[order2]
+
+    # position of each cell of map 1 in the sorted cells of map 2
+    pos = np.searchsorted(sorted2, sorted1)
+    if len(sorted2) > 0:
+        pos[pos == len(sorted2)] = 0
+        found = sorted2[pos] == sorted1
+    else:
+        found = np.zeros(len(sorted1), dtype=bool)
+    matched2 = np.zeros(len(sorted2), dtype=bool)
+    matched2[pos[found]] = True
+
+    rows1 = order1[found]
+    rows2 = order2[pos[found]]
+    only1 = order1[~found]
+    only2 = order2[~matched2]
+    return rows1, rows2, only1, only2
+
+
+# ================================
+# Comparison
+# ================================
+def _valuesDiffer(values1, values2, tolerance):
+    if tolerance > 0 and values1.dtype.kind == "f":
+        return ~(np.abs(values1 - values2) <= tolerance)
+    return values1 != values2
+
+
+def diffMask(column1, column2, tolerance=0.):
+    """Compare two aligned columns, return a boolean array which is True for
+    the rows with different content.
+
+    Floating point values are considered equal if they differ by at most
+    tolerance (exact comparison if tolerance is 0).
+    """
+    if isinstance(column1, np.ndarray):
+        return _valuesDiffer(column1, column2, tolerance)
+
+    # vector branches: rows differ if they have different lengths, or if any element differs
+    counts1 = ak.to_numpy(ak.num(column1, axis=1))
+    counts2 = ak.to_numpy(ak.num(column2, axis=1))
+    mask = counts1 != counts2
+    sameLength = np.flatnonzero(~mask)
+    flat1 = ak.to_numpy(ak.flatten(column1[sameLength], axis=None))
+    flat2 = ak.to_numpy(ak.flatten(column2[sameLength], axis=None))
+    differentElements = _valuesDiffer(flat1, flat2, tolerance)
+    rowOfElement = np.repeat(np.arange(len(sameLength)), counts1[sameLength])
+    mask[sameLength[np.unique(rowOfElement[differentElements])]] = True
+    return mask
+
+
+def compareColumns(columns1, columns2, tolerance=0.):
+    """Compare two sets of aligned columns branch by branch.
+
+    Returns a dict branch -> boolean difference mask, and the mask of rows
+    with at least one different branch.
+    """
+    diffs = {}
+    anyDiff = np.zeros(numEntries(columns1), dtype=bool)
+    for branch in columns1:
+        if branch not in columns2:
+            continue
+        diffs[branch] = diffMask(columns1[branch], columns2[branch], tolerance)
+        anyDiff |= diffs[branch]
+    return diffs, anyDiff
+
+
+def rowContent(columns, row):
+    """Return the content of one row as a dict branch -> python value, for printing"""
+    content = {}
+    for branch, column in columns.items():
+        value = column[row]
+        if isinstance(value, ak.Array):
+            value = value.tolist()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        content[branch] = value
+    return content
+
+
+# ================================
+# Comparison by cellId, in shards
+# ================================
+def compareByCellId(columns1, columns2, tolerance=0., maxMismatches=0, nevts=-1,
+                    entries1=None, entries2=None):
+    """Join two maps on cellId and compare the content of the common cells.
+
+    entries1/entries2 give the entry number in the file of each row (default:
+    the row number itself). If nevts > 0, only the common cells within the
+    first nevts entries of file 1 are compared. Returns a summary dict with
+    the cells missing in either map, the number of common/different cells,
+    the number of differences per branch and the first maxMismatches
+    mismatches (ordered by cellId).
+    """
+    if entries1 is None:
+        entries1 = np.arange(numEntries(columns1))
+    if entries2 is None:
+        entries2 = np.arange(numEntries(columns2))
+
+    rows1, rows2, only1, only2 = joinOnCellId(columns1, columns2)
+    if nevts > 0:
+        keep = entries1[rows1] < nevts
+        rows1 = rows1[keep]
+        rows2 = rows2[keep]
+    common1 = takeRows(columns1, rows1)
+    common2 = takeRows(columns2, rows2)
+    diffs, anyDiff = compareColumns(common1, common2, tolerance)
+    badRows = np.flatnonzero(anyDiff)
+
+    mismatches = []
+    for row in badRows[:maxMismatches]:
+        mismatches.append((int(common1["cellId"][row]),
+                           int(entries1[rows1[row]]), int(entries2[rows2[row]]),
+                           rowContent(common1, row), rowContent(common2, row)))
+    return {
+        "only1": sorted((int(entries1[e]), int(columns1["cellId"][e])) for e in only1),
+        "only2": sorted((int(entries2[e]), int(columns2["cellId"][e])) for e in only2),
+        "ncommon": len(rows1),
+        "nbad": len(badRows),
+        "diffs": {branch: int(mask.sum()) for branch, mask in diffs.items()},
+        "mismatches": mismatches,
+    }
+
+
+def shardRanges(cellIds, maxGap=10000):
+    """Return, for each system, the list of ranges of entries [start, stop) containing its
+    cells: the runs of consecutive entries of the system, merged when they are separated by
+    less than maxGap entries of other systems (e.g. maps merged with links between systems)"""
+    systems = systemOf(cellIds)
+    ranges = {}
+    for system in np.unique(systems):
+        entries = np.flatnonzero(systems == system)
+        breaks = np.flatnonzero(np.diff(entries) > maxGap)
+        starts = np.concatenate([entries[:1], entries[breaks + 1]])
+        stops = np.concatenate([entries[breaks], entries[-1:]]) + 1
+        ranges[int(system)] = [(int(start), int(stop)) for start, stop in zip(starts, stops)]
+        nread = int((stops - starts).sum())
+        if nread > 1.5 * len(entries):
+            print(f"WARNING: the cells of system {int(system)} are interleaved with other systems, "
+                  f"its shard reads {nread} entries for {len(entries)} cells")
+    return ranges
+
+
+def concatColumns(parts):
+    """Concatenate the rows of several sets of columns with the same branches"""
+    if len(parts) == 1:
+        return parts[0]
+    return {branch: np.concatenate([p[branch] for p in parts]) if isinstance(parts[0][branch], np.ndarray)
+            else ak.concatenate([p[branch] for p in parts]) for branch in parts[0]}
+
+
+def _readShard(filename, maptype, system, entryRanges):
+    parts, entries = [], []
+    for start, stop in entryRanges or [(0, 0)]:
+        columns = readMap(filename, maptype, start, stop)
+        rows = np.flatnonzero(systemOf(columns["cellId"]) == system)
+        parts.append(takeRows(columns, rows))
+        entries.append(rows + start)
+    return concatColumns(parts), np.concatenate(entries)
+
+
+def compareShard(task):
+    """Compare the cells of one system in two maps (executed in a worker process).
+
+    task is a tuple (file1, file2, maptype, system, ranges1, ranges2, tolerance,
+    maxMismatches, nevts), with ranges1/ranges2 the lists of entry ranges to read.
+    """
+    file1, file2, maptype, system, ranges1, ranges2, tolerance, maxMismatches, nevts = task
+    columns1, entries1 = _readShard(file1, maptype, system, ranges1)
+    columns2, entries2 = _readShard(file2, maptype, system, ranges2)
+    return compareByCellId(columns1, columns2, tolerance, maxMismatches, nevts, entries1, entries2)
+
+
+def mergeSummaries(summaries, maxMismatches=0):
+    """Merge the summaries of several shards into one, independently of their order"""
+    merged = {"only1": [], "only2": [], "ncommon": 0, "nbad": 0, "diffs": {}, "mismatches": []}
+    for summary in summaries:
+        merged["only1"] += summary["only1"]
+        merged["only2"] += summary["only2"]
+        merged["ncommon"] += summary["ncommon"]
+        merged["nbad"] += summary["nbad"]
+        for branch, ndiffs in summary["diffs"].items():
+            merged["diffs"][branch] = merged["diffs"].get(branch, 0) + ndiffs
+        merged["mismatches"] += summary["mismatches"]
+    merged["only1"].sort()
+    merged["only2"].sort()
+    merged["mismatches"] = sorted(merged["mismatches"], key=lambda m: m[0])[:maxMismatches]
+    return merged
+
+
+def compareInShards(file1, file2, maptype, nproc, tolerance=0., maxMismatches=0, nevts=-1):
+    """Compare two maps by cellId with one shard per system, using nproc worker processes"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    ranges1 = shardRanges(readCellIds(file1, maptype))
+    ranges2 = shardRanges(readCellIds(file2, maptype))
+    tasks = []
+    for system in sorted(set(ranges1) | set(ranges2)):
+        tasks.append((file1, file2, maptype, system,
+                      ranges1.get(system, []), ranges2.get(system, []),
+                      tolerance, maxMismatches, nevts))
+    with ProcessPoolExecutor(max_workers=nproc) as pool:
+        summaries = list(pool.map(compareShard, tasks))
+    return mergeSummaries(summaries, maxMismatches)
+
+
+# ================================
+# cellId index sidecar
+# ================================
+# The index of a map is stored next to it in <map>.root.<tree>.idx.npy, as a
+# (2, N) uint64 array holding the cellIds sorted in increasing order and the
+# corresponding entry numbers, that can be memory-mapped, with the checksum of the map it was built from in
+# <map>.root.<tree>.idx.json. Lookups are then binary searches.
+def fileChecksum(filename, blockSize=1 << 24):
+    sha = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(blockSize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def sidecarIsValid(filename, metaFile):
+    """Check the metadata of a file derived from a map (index, CSR copy) against
+    the map (size and modification time first, then the checksum if these changed)"""
+    if not os.path.isfile(metaFile):
+        return False
+    with open(metaFile) as f:
+        meta = json.load(f)
+    stat = os.stat(filename)
+    if meta.get("size") == stat.st_size and meta.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    if meta.get("size") != stat.st_size or meta.get("sha256") != fileChecksum(filename):
+        return False
+    # same content, just touched: refresh the metadata
+    meta["mtime_ns"] = stat.st_mtime_ns
+    writeJson(metaFile, meta)
+    return True
+
+
+def writeJson(filename, content):
+    tmpFile = filename + ".tmp"
+    with open(tmpFile, "w") as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmpFile, filename)
+
+
+def buildIndex(filename, treeName):
+    """Return the (2, N) array of sorted cellIds and corresponding entries of a map"""
+    cellIds = readCellIds(filename, treeName=treeName)
+    order = np.argsort(cellIds, kind="stable")
+    return np.vstack((cellIds[order], order.astype(np.uint64)))
+
+
+def loadIndex(filename, treeName, rebuild=False):
+    """Load the cellId index of a map, (re)building its sidecar file if missing or outdated"""
+    if os.path.isdir(filename):
+        raise ValueError(f"{filename} is the folder of a CSR map, whose rows are already sorted by cellId (use findMapEntries)")
+    indexFile = f"{filename}.{treeName}.idx.npy"
+    metaFile = f"{filename}.{treeName}.idx.json"
+    if not rebuild and os.path.isfile(indexFile) and sidecarIsValid(filename, metaFile):
+        return np.load(indexFile, mmap_mode="r")
+
+    print(f"Building cellId index for tree {treeName} in file {filename}")
+    index = buildIndex(filename, treeName)
+    stat = os.stat(filename)
+    try:
+        with open(indexFile + ".tmp", "wb") as f:
+            np.save(f, index)
+        os.replace(indexFile + ".tmp", indexFile)
+        writeJson(metaFile, {"tree": treeName, "entries": index.shape[1], "size": stat.st_size,
+                              "mtime_ns": stat.st_mtime_ns, "sha256": fileChecksum(filename)})
+    except OSError as e:
+        print(f"WARNING: cannot write index file {indexFile} ({e}), using index in memory")
+    return index
+
+
+def findMapEntries(filename, treeName, cellIds):
+    """Return the entry numbers of the given cellIds in a map (-1 for cells not in the map).
+    For the folder of a CSR copy these are the rows of the cells, found without index."""
+    if os.path.isdir(filename):
+        from csrMap import CSRMap
+        return CSRMap(filename).rows(cellIds)
+    return findEntries(loadIndex(filename, treeName), cellIds)
+
+
+def findEntries(index, cellIds):
+    """Return the entry numbers of the given cellIds (-1 for cells not in the map)"""
+    cellIds = np.atleast_1d(np.asarray(cellIds, dtype=np.uint64))
+    sortedIds = index[0]
+    pos = np.searchsorted(sortedIds, cellIds)
+    entries = np.full(len(cellIds), -1, dtype=np.int64)
+    if len(sortedIds) > 0:
+        pos[pos == len(sortedIds)] = 0
+        found = sortedIds[pos] == cellIds
+        entries[found] = index[1][pos[found]]
+    return entries
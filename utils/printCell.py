@@ -4,11 +4,13 @@
 # print content of noise and neighbour maps
 # TODO: consolidate, merge with decodeCellID.py
 #
-import ROOT
-import dd4hep
 import os
 import sys
 import argparse
+import uproot
+import mapTools
+from bitFieldCoder import BitFieldCoder, defaultEncodingMap
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "geometry"))
 
 # ================================
 # CONFIG
@@ -30,14 +32,6 @@ readoutMap = {
     9 : "HCalEndcapReadout",
 }
 
-# default encoding (can be overridden reading from the XML)
-defaultEncodingMap = {
-    4 : "system:0:4,cryo:4:1,type:5:3,subtype:8:3,layer:11:8,module:19:11,theta:30:10",
-    5 : "system:0:4,cryo:4:1,type:5:3,subtype:8:3,side:11:-2,wheel:13:3,layer:16:12,module:28:11,rho:39:8,z:47:8",
-    8 : "system:0:4,layer:4:5,row:9:9,theta:18:9,phi:27:10",
-    9 : "system:0:4,type:4:3,layer:7:6,row:13:11,theta:24:11,phi:35:10"
-}
-
 # default files
 defaultFilenameNeighbours = "neighbours_map_HCalBarrel.root"
 defaultFilenameNoise = "cellNoise_map_electronicsNoiseLevel_ecalB_thetamodulemerged_hcalB_thetaphi.root"
@@ -67,13 +61,12 @@ coderMap = {}
 # Load decoders
 # ================================
 def readCodersFromXML(compactFile):
+    from geometrySnapshot import loadSnapshot
     path_to_detector = os.environ.get("K4GEO", "")
     detectorFile = path_to_detector + "/" + compactFile
-    det = dd4hep.Detector.getInstance()
-    det.fromXML(detectorFile)
+    snapshot = loadSnapshot(detectorFile)
     for system in systems:
-        readout = det.readout(readoutStr(system))
-        coderMap[system] = readout.idSpec().decoder()
+        coderMap[system] = BitFieldCoder(snapshot.encoding(readoutStr(system)))
 
 def loadCoders(readFromFile=False, compactFile=""):
     if readFromFile:
@@ -83,7 +76,7 @@ def loadCoders(readFromFile=False, compactFile=""):
         print("Using default encodings")
         for system in systems:
             encoding = defaultEncodingMap[system]
-            coderMap[system] = ROOT.dd4hep.BitFieldCoder(encoding)
+            coderMap[system] = BitFieldCoder(encoding)
 
     print("\nLoaded encoding maps:")
     print("{:8s} {:30s} {:s}".format("System","readout","encoding"))
@@ -120,11 +113,7 @@ def decode(cellID):
     #     value = coder.get(cellID, name)
     #     print(f"{name}: {value}")
 
-    fields = {}
-    for field in coder.fields():
-        name = field.name()
-        fields[name] = coder.get(cellID, name)
-    return fields
+    return coder.decode(cellID)
 
 
 # =============================================
@@ -141,12 +130,23 @@ def print_cell(cellID):
 # =======================================
 # Print cell with position iEntry in tree
 # =======================================
-def print_entry(iEntry, showNeighbours, showNoise):
-    TNeighbours.GetEntry(iEntry)
+def read_entry(iEntry):
+    if csrNeighbours is not None:
+        return int(csrNeighbours.cellIds[iEntry]), csrNeighbours.neighboursAt(iEntry)
+    entry = TNeighbours.arrays(["cellId", "neighbours"], entry_start=iEntry, entry_stop=iEntry+1, library="np")
+    return int(entry["cellId"][0]), entry["neighbours"][0]
+
 
+def find_entries(cellIDs):
+    if csrNeighbours is not None:
+        return csrNeighbours.rows(cellIDs)
+    return mapTools.findEntries(neighboursIndex, cellIDs)
+
+
+def print_entry(iEntry, showNeighbours, showNoise):
     # print("="*50)
     print()
-    cID = TNeighbours.cellId
+    cID, neighbours = read_entry(iEntry)
     print_cell(cID)
 
     if showNeighbours:
@@ -154,17 +154,15 @@ def print_entry(iEntry, showNeighbours, showNoise):
         # neighbours = TNeighbours.neighbours
         # neihbours = sorted(list(getattr(TNeighbours, "neighbours")))
         for n in neighbours:
-            print_cell(n)
+            print_cell(int(n))
 
     if showNoise and TNoise:
-        for j in range(TNoise.GetEntries()):
-            TNoise.GetEntry(j)
-            cIDNoise = TNoise.cellId
-            if cIDNoise == cID:
-                noiseLevel = TNoise.noiseLevel
-                noiseOffset = TNoise.noiseOffset
-                print(f"Noise: level={noiseLevel}, offset={noiseOffset}")
-                break
+        jEntry = mapTools.findEntries(noiseIndex, cID)[0]
+        if jEntry >= 0:
+            noise = TNoise.arrays(["noiseLevel", "noiseOffset"], entry_start=int(jEntry), entry_stop=int(jEntry)+1, library="np")
+            noiseLevel = noise["noiseLevel"][0]
+            noiseOffset = noise["noiseOffset"][0]
+            print(f"Noise: level={noiseLevel}, offset={noiseOffset}")
 
     print("="*50)
 
@@ -173,12 +171,10 @@ def print_entry(iEntry, showNeighbours, showNoise):
 # Loop over neighbours and print their info
 # =========================================
 def print_neighbours_of_cell(cellID):
-    for i in range(TNeighbours.GetEntries()):
-        TNeighbours.GetEntry(i)
-        cID = TNeighbours.cellId
-        if cID == cellID:
-            print_cell(i, False, False)
-            return
+    iEntry = find_entries(cellID)[0]
+    if iEntry >= 0:
+        print_entry(int(iEntry), True, False)
+        return
 
     print("CellID not found")
 
@@ -188,7 +184,7 @@ def print_neighbours_of_cell(cellID):
 # =========================================
 def print_random(n=10, showNeighbours=False, showNoise=False):
     import random
-    nEntries = TNeighbours.GetEntries()
+    nEntries = len(csrNeighbours) if csrNeighbours is not None else TNeighbours.num_entries
 
     for _ in range(n):
         i = random.randint(0, nEntries-1)
@@ -203,7 +199,8 @@ def print_random(n=10, showNeighbours=False, showNoise=False):
 parser = argparse.ArgumentParser(description="Print cell info")
 parser.add_argument("--neighbours", action="store_true",
                     help="Print neighbours info")
-parser.add_argument("--neighbours-file", default=defaultFilenameNeighbours)
+parser.add_argument("--neighbours-file", default=defaultFilenameNeighbours,
+                    help="Neighbour map (ROOT file or folder of its CSR copy, see csrMap.py)")
 parser.add_argument("--noise", action="store_true",
                     help="Print noise info")
 parser.add_argument("--noise-file", default=defaultFilenameNoise)
@@ -233,40 +230,42 @@ loadCoders(args.read_xml, compactFile)
 # Load trees
 # ================================
 
-fNeighbours = ROOT.TFile.Open(filenameNeighbours)
-TNeighbours = fNeighbours.Get(treenameNeighbours)
+csrNeighbours = None
+if os.path.isdir(filenameNeighbours):
+    # memory-mapped CSR copy of the map: entries are the rows, sorted by cellId
+    from csrMap import CSRMap
+    csrNeighbours = CSRMap(filenameNeighbours)
+else:
+    fNeighbours = uproot.open(filenameNeighbours)
+    TNeighbours = fNeighbours[treenameNeighbours]
 
-neighbours = ROOT.std.vector('unsigned long')()
-TNeighbours.SetBranchAddress("neighbours", neighbours)
+    # cellId -> entry indices (built once and stored next to the maps)
+    neighboursIndex = mapTools.loadIndex(filenameNeighbours, treenameNeighbours)
 
 fNoise = None
 TNoise = None
+noiseIndex = None
 if args.noise:
-    fNoise = ROOT.TFile.Open(filenameNoise)
-    TNoise = fNoise.Get(treenameNoise)
+    fNoise = uproot.open(filenameNoise)
+    TNoise = fNoise[treenameNoise]
+    noiseIndex = mapTools.loadIndex(filenameNoise, treenameNoise)
 
 
 # ================================
 # Print cell info
 # ================================
 if args.cells:
-    cell_list = [int(x) for x in args.cells.split(",")]
-
-    # Use sets for fast lookup and tracking
-    cells_to_find = set(cell_list)
-    found_cells = set()
-
-    for iEntry in range(TNeighbours.GetEntries()):
-        TNeighbours.GetEntry(iEntry)
-        cell_id = TNeighbours.cellId
-        if cell_id in cells_to_find:
-            print_entry(iEntry, showNeighbours, showNoise)
-            found_cells.add(cell_id)
-            # Stop early if all cells have been found
-            if found_cells == cells_to_find:
-                break
+    cell_list = list(dict.fromkeys(int(x) for x in args.cells.split(",")))
+
+    # look up the entries of all cells in the index
+    entries = find_entries(cell_list)
+    missing_cells = set()
+    for cell_id, iEntry in zip(cell_list, entries):
+        if iEntry >= 0:
+            print_entry(int(iEntry), showNeighbours, showNoise)
+        else:
+            missing_cells.add(cell_id)
     # Print cells that were not found
-    missing_cells = cells_to_find - found_cells
     if missing_cells:
         print("\nCells not found:")
         for cell in sorted(missing_cells):